@@ -0,0 +1,249 @@
+'''
+Validation and recording for incoming turn notifications, shared by the API
+and the bot's embedded webhook listener.
+
+Validation runs before the database is touched, so that junk requests can be
+turned away as cheaply as possible.
+'''
+
+import logging
+import re
+from datetime import datetime
+from json import loads
+from typing import Optional, Tuple
+from sqlalchemy import exists, select
+from sqlalchemy.exc import IntegrityError
+from api.ratelimit import allow
+from database.connect import get_session
+from database.models import (
+    TurnNotification,
+    WebhookURL,
+    Player,
+    Game,
+    PlayerGames
+)
+from database.stats import record_turn_duration
+from utils import config
+
+
+logger = logging.getLogger(f'civviebot.api.{__name__}')
+
+
+# Slugs are the first 16 hex characters of a SHA1 digest; see
+# WebhookURL.generate_slug().
+SLUG_PATTERN = re.compile(r'[0-9a-f]{16}')
+# Names are stored in 255 character columns.
+MAX_NAME_LENGTH = 255
+
+
+def is_valid_slug(slug: str) -> bool:
+    '''
+    Whether the given string could be a webhook URL slug.
+    '''
+    return SLUG_PATTERN.fullmatch(slug) is not None
+
+
+def _get_name(body: dict, key: str) -> str:
+    '''
+    Gets a non-empty name from the given key of a notification body.
+    '''
+    name = body.get(key)
+    if not isinstance(name, str) or not name:
+        raise ValueError(f'{key} must be a non-empty string')
+    if len(name) > MAX_NAME_LENGTH:
+        raise ValueError(f'{key} is longer than {MAX_NAME_LENGTH} characters')
+    return name
+
+
+def parse_notification(body: bytes) -> Tuple[str, str, int]:
+    '''
+    Parses the body of a turn notification into the game name, player name and
+    turn number, raising a ValueError if it isn't one.
+
+    Civilization 6 sends these as value1, value2 and value3 respectively; any
+    other keys are ignored.
+    '''
+    # JSONDecodeError and UnicodeDecodeError are both ValueErrors.
+    try:
+        parsed = loads(body)
+    except RecursionError as error:
+        raise ValueError('Body is nested too deeply') from error
+    if not isinstance(parsed, dict):
+        raise ValueError('Body must be a JSON object')
+    turn = parsed.get('value3')
+    # bool is a subclass of int, but isn't a turn number.
+    if isinstance(turn, bool) or not isinstance(turn, int) or turn < 1:
+        raise ValueError('value3 must be a positive integer')
+    return (_get_name(parsed, 'value1'), _get_name(parsed, 'value2'), turn)
+
+
+def ingest_notification(slug: str, body: bytes, address: str) -> Optional[int]:
+    '''
+    Validates, rate limits and records a turn notification sent to the given
+    (already checked) slug from the given address. Returns the ID of the game
+    a new turn was recorded in, or None if nothing new was.
+    '''
+    gamename: str
+    playername: str
+    turnnumber: int
+    try:
+        gamename, playername, turnnumber = parse_notification(body)
+    except ValueError as error:
+        logger.debug('Invalid request to %s: %s', slug, error)
+        return None
+
+    if not allow(
+        f'ip:{address}',
+        config.API_IP_RATE_LIMIT,
+        60
+    ) or not allow(f'slug:{slug}', config.API_SLUG_RATE_LIMIT, 60):
+        logger.debug('Rate limited request to %s from %s', slug, address)
+        return None
+
+    with get_session() as session:
+        channel_id = session.scalar(
+            select(WebhookURL.channelid)
+            .where(WebhookURL.slug == slug)
+        )
+        if not channel_id:
+            # This is not a real slug.
+            logger.debug('Valid request to invalid slug %s', slug)
+            return None
+
+        game = session.scalar(
+            select(Game)
+            .where(Game.name == gamename)
+            .where(Game.slug == slug)
+        )
+        if not game:
+            # This game is not in the allowlist and we should leave.
+            logger.debug(
+                'Valid request to %s references untracked game %s',
+                slug,
+                gamename
+            )
+            return None
+
+        latest = session.execute(
+            select(
+                TurnNotification.turn,
+                TurnNotification.playerid,
+                TurnNotification.logtime
+            )
+            .where(TurnNotification.gameid == game.id)
+            .order_by(TurnNotification.logtime.desc())
+            .limit(1)
+        ).first()
+        if latest and latest.turn > turnnumber:
+            logger.info(
+                'Duplicate game detected (%s) obtained from webhook URL %s',
+                game.name,
+                slug
+            )
+            if game.duplicatewarned is None:
+                logger.info(
+                    'Duplicate warning not yet sent for %s; flagging',
+                    game.name
+                )
+                game.duplicatewarned = False
+                session.commit()
+            return None
+
+        # Check for the player, create if needed.
+        player = session.scalar(
+            select(Player)
+            .where(Player.name == playername)
+            .where(Player.slug == slug)
+        )
+        if not player:
+            # Anyone with the URL can make up players, so don't let them make
+            # too many.
+            if not allow(f'players:{game.id}', config.NEW_PLAYER_LIMIT, 3600):
+                logger.info(
+                    'Too many new players in game %s; not tracking %s',
+                    gamename,
+                    playername
+                )
+                return None
+            player = Player(
+                name=playername,
+                slug=slug
+            )
+            session.add(player)
+            # The player needs an ID to be linked to the game; it's committed
+            # along with the turn below.
+            session.flush()
+            player_game = PlayerGames(
+                gameid=game.id,
+                playerid=player.id,
+                slug=slug
+            )
+            session.add(player_game)
+            logger.info(
+                'Tracking new player %s in game %s from webhook URL %s',
+                playername,
+                gamename,
+                slug
+            )
+        elif session.scalar(
+            select(
+                exists()
+                .where(TurnNotification.turn == turnnumber)
+                .where(TurnNotification.playerid == player.id)
+                .where(TurnNotification.gameid == game.id)
+            )
+        ):
+            # Civ 6 sometimes sends the same turn more than once. This is
+            # checked up front because a partitioned turn_notification's
+            # primary key includes logtime, so a repeat wouldn't conflict.
+            logger.debug(
+                'Ignoring repeated notification for %s in game %s at turn %d',
+                playername,
+                gamename,
+                turnnumber
+            )
+            return None
+        # Register a new turn.
+        now = datetime.now()
+        notification = TurnNotification(
+            playerid=player.id,
+            gameid=game.id,
+            turn=turnnumber,
+            slug=slug,
+            logtime=now
+        )
+        session.add(notification)
+        # The previous player's turn is over.
+        if latest and (
+            (latest.turn, latest.playerid) != (turnnumber, player.id)
+        ):
+            record_turn_duration(
+                session,
+                game.id,
+                latest.playerid,
+                now - latest.logtime,
+                now
+            )
+        game_id = game.id
+        try:
+            session.commit()
+        except IntegrityError:
+            # Civ 6 sometimes sends the same turn more than once.
+            logger.debug(
+                'Ignoring repeated notification for %s in game %s at turn %d',
+                playername,
+                gamename,
+                turnnumber
+            )
+            return None
+
+        # If we got here, log and accept.
+        logger.info(
+            ('Notification from Civilization 6 validated and logged: %s in '
+             'game "%s" at turn %d (tracked in channel: %s)'),
+            playername,
+            gamename,
+            turnnumber,
+            channel_id
+        )
+    return game_id
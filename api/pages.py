@@ -0,0 +1,67 @@
+'''
+Pre-rendered pages served by the API.
+
+The help and slug pages only change when the configuration does or the year
+ticks over, so each is rendered once per process and year, kept alongside a
+gzipped copy, and served with validators and caching headers so that repeat
+visitors (and anything sitting in front of the API) can skip the body.
+'''
+
+import gzip
+from datetime import datetime, timezone
+from functools import lru_cache
+from flask import Response, render_template, request
+from werkzeug.http import generate_etag
+from utils import config
+
+
+class CachedPage:
+    '''
+    A rendered template, in plain and gzipped forms.
+    '''
+
+    def __init__(self, body: str):
+        self.body = body.encode('utf-8')
+        self.compressed = gzip.compress(self.body, mtime=0)
+        self.etag = generate_etag(self.body)
+        # HTTP dates don't carry microseconds.
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+
+    def respond(self) -> Response:
+        '''
+        Builds a response serving this page to the current request; a 304 if
+        the client already has it.
+        '''
+        if 'gzip' in request.accept_encodings:
+            response = Response(self.compressed, mimetype='text/html')
+            response.headers['Content-Encoding'] = 'gzip'
+            # The compressed body is a different representation, so it needs
+            # its own entity tag.
+            response.set_etag(f'{self.etag}-gzip')
+        else:
+            response = Response(self.body, mimetype='text/html')
+            response.set_etag(self.etag)
+        response.vary.add('Accept-Encoding')
+        response.last_modified = self.last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = config.PAGE_CACHE_MAX_AGE
+        return response.make_conditional(request)
+
+
+@lru_cache(maxsize=None)
+def _render_page(template: str, year: int, **context) -> CachedPage:
+    '''
+    Renders a template to a CachedPage.
+    '''
+    return CachedPage(render_template(template, year=year, **context))
+
+
+def get_page(template: str, **context) -> Response:
+    '''
+    Gets a response serving the given template, rendering it only if it hasn't
+    been rendered yet this year.
+
+    The context is part of the cache key, so it should only contain hashable
+    values that rarely change.
+    '''
+    return _render_page(template, datetime.now().year, **context).respond()
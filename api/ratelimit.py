@@ -0,0 +1,156 @@
+'''
+Token bucket rate limiting for the API.
+
+Each bucket holds up to 'capacity' requests and refills at a rate of
+'capacity' requests per 'period' seconds. Buckets are kept in a backend,
+chosen by API_RATE_LIMIT_BACKEND:
+
+- 'memory' keeps them in the process, so each gunicorn worker limits on its
+  own
+- 'file' keeps them in a local SQLite file, shared by every worker on a host
+- 'database' keeps them in the CivvieBot database, shared by every worker
+  anywhere
+'''
+
+import logging
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from threading import Lock
+from time import time
+from sqlalchemy import Engine, case, create_engine, delete, insert, update
+from sqlalchemy.exc import IntegrityError
+from database.connect import get_db, tune_sqlite
+from database.models import RateLimit
+from utils import config
+
+
+logger = logging.getLogger(f'civviebot.api.{__name__}')
+
+
+class RateLimitBackend(ABC):
+    '''
+    Somewhere token buckets are kept.
+    '''
+
+    @abstractmethod
+    def take(
+        self,
+        key: str,
+        capacity: int,
+        period: float,
+        now: float
+    ) -> bool:
+        '''
+        Takes a token from the bucket with the given key, returning whether
+        there was one to take.
+        '''
+
+
+class MemoryBackend(RateLimitBackend):
+    '''
+    Keeps token buckets in the current process.
+    '''
+    # Beyond this, the least recently used buckets are forgotten.
+    MAX_BUCKETS = 10000
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = Lock()
+
+    def take(self, key, capacity, period, now):
+        with self._lock:
+            # Re-inserting the bucket keeps the dict in least recently used
+            # order.
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(
+                capacity,
+                tokens + (now - updated) * capacity / period
+            )
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.MAX_BUCKETS:
+                del self._buckets[next(iter(self._buckets))]
+        return allowed
+
+
+class DatabaseBackend(RateLimitBackend):
+    '''
+    Keeps token buckets in the rate_limit table of a database.
+    '''
+    # How often, in takes, to delete buckets nobody has used in a while.
+    PRUNE_EVERY = 1000
+    # How long, in seconds, a bucket has to go unused to be deleted. This
+    # should be longer than any limit's period, as a bucket left alone for a
+    # whole period is full, and so no different from one that doesn't exist.
+    PRUNE_AFTER = 86400
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self._takes = 0
+
+    def take(self, key, capacity, period, now):
+        refilled = RateLimit.tokens + (now - RateLimit.updated) * (
+            capacity / period
+        )
+        refilled = case((refilled > capacity, capacity), else_=refilled)
+        self._takes += 1
+        with self.engine.begin() as connection:
+            if self._takes % self.PRUNE_EVERY == 0:
+                connection.execute(
+                    delete(RateLimit)
+                    .where(RateLimit.updated < now - self.PRUNE_AFTER)
+                )
+            # Refilling and taking in one statement keeps this atomic across
+            # workers.
+            taken = connection.execute(
+                update(RateLimit)
+                .where(RateLimit.key == key)
+                .where(refilled >= 1)
+                .values(tokens=refilled - 1, updated=now)
+            ).rowcount
+        if taken:
+            return True
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(
+                    insert(RateLimit)
+                    .values(key=key, tokens=capacity - 1, updated=now)
+                )
+        except IntegrityError:
+            # The bucket exists, so it was empty (or another worker made it
+            # just now, which we'll count against this request).
+            return False
+        return True
+
+
+@lru_cache(maxsize=None)
+def get_backend() -> RateLimitBackend:
+    '''
+    Gets the configured backend for this process.
+    '''
+    if config.API_RATE_LIMIT_BACKEND == 'database':
+        return DatabaseBackend(get_db())
+    if config.API_RATE_LIMIT_BACKEND == 'file':
+        engine = create_engine(f'sqlite:///{config.API_RATE_LIMIT_FILE}')
+        tune_sqlite(engine)
+        RateLimit.__table__.create(engine, checkfirst=True)
+        return DatabaseBackend(engine)
+    if config.API_RATE_LIMIT_BACKEND != 'memory':
+        logger.warning(
+            'Unknown rate limit backend %s; limiting in memory instead',
+            config.API_RATE_LIMIT_BACKEND
+        )
+    return MemoryBackend()
+
+
+def allow(key: str, capacity: int, period: float) -> bool:
+    '''
+    Takes a token from the bucket with the given key, returning whether the
+    request it's for should go ahead. A capacity of 0 or less disables the
+    limit.
+    '''
+    if capacity <= 0:
+        return True
+    return get_backend().take(key, capacity, period, time())
@@ -3,21 +3,15 @@ Routes that serve the API.
 '''
 
 import logging
-from datetime import datetime
-from operator import itemgetter
-from discord import Permissions
-from discord.utils import oauth_url
-from flask import Blueprint, request, render_template, Response
-from sqlalchemy import select
-from database.models import (
-    TurnNotification,
-    WebhookURL,
-    Player,
-    Game,
-    PlayerGames
-)
-from database.connect import get_session
+from functools import lru_cache
+from uuid import uuid4
+from flask import Blueprint, request, Response
+from werkzeug.exceptions import RequestEntityTooLarge
+from database.profiler import label_queries
+from api.ingest import ingest_notification, is_valid_slug
+from api.pages import get_page
 from utils import config
+from utils.logs import set_log_context
 
 
 logger = logging.getLogger(f'civviebot.api.{__name__}')
@@ -29,6 +23,11 @@ api_blueprint = Blueprint('routes', __name__)
 # return. Anyone who would care is spoofing calls, which we don't want to
 # communicate that we know. So, this is the response to ALL calls.
 JUST_ACCEPT = Response(response='Accepted', status=200)
+# Bot permissions the invite link asks for: View Channels (1 << 10), Send
+# Messages (1 << 11) and Send Messages in Threads (1 << 38). These are spelled
+# out here so that the API doesn't have to import py-cord to build the link.
+INVITE_PERMISSIONS = (1 << 10) | (1 << 11) | (1 << 38)
+INVITE_SCOPES = ('bot', 'applications.commands')
 
 
 def request_source_is_civ_6():
@@ -38,11 +37,37 @@ def request_source_is_civ_6():
 
     @TODO: How feasible is this even? Test.
     '''
-    logger.debug(request.headers)
-    logger.debug(request.get_json())
     return True
 
 
+@lru_cache(maxsize=None)
+def get_invite_link() -> str:
+    '''
+    Gets the OAuth2 link used to invite CivvieBot to a server.
+    '''
+    return (
+        'https://discord.com/oauth2/authorize'
+        f'?client_id={config.DISCORD_CLIENT_ID}'
+        f'&scope={"+".join(INVITE_SCOPES)}'
+        f'&permissions={INVITE_PERMISSIONS}'
+    )
+
+
+@api_blueprint.before_request
+def label_route():
+    '''
+    Attributes queries run for a request to its route, for the SQL profiler,
+    and labels records logged for it with the request's ID.
+    '''
+    rule = request.url_rule.rule if request.url_rule else 'unmatched'
+    label_queries(f'route {request.method} {rule}')
+    # A proxy in front of the API can pass along its own ID for the request.
+    set_log_context(
+        request_id=request.headers.get('X-Request-ID', '')[:64] or uuid4().hex,
+        route=rule
+    )
+
+
 @api_blueprint.route('/')
 def send_help():
     '''
@@ -50,21 +75,11 @@ def send_help():
     '''
     if request.headers.get('Content-Type', '') == 'application/json':
         return JUST_ACCEPT
-    bot_perms = Permissions()
-    bot_perms.send_messages = True
-    bot_perms.send_messages_in_threads = True
-    bot_perms.view_channel = True
-    invite_link = oauth_url(
-        client_id=config.DISCORD_CLIENT_ID,
-        permissions=bot_perms,
-        scopes=('bot', 'applications.commands')
-    )
-    return render_template(
+    return get_page(
         'help.j2',
-        oauth_url=invite_link,
-        command_prefix=config.COMMAND_PREFIX,
-        year=datetime.now().year
-    ), 200
+        oauth_url=get_invite_link(),
+        command_prefix=config.COMMAND_PREFIX
+    )
 
 
 @api_blueprint.route('/civ6/<string:slug>', methods=['GET'])
@@ -73,30 +88,23 @@ def slug_get(slug):
     Provide help if the endpoint is requested as GET.
     '''
     del slug
-    return render_template('slug_to_page.j2', year=datetime.now().year), 200
+    return get_page('slug_to_page.j2')
 
 
-def get_body_json():
+def get_body():
     '''
-    Attempts to parse the incoming body as JSON.
+    Reads the incoming body, raising a ValueError if it's too large.
+
+    The declared length is checked first so that oversized requests are
+    turned away without reading them; the application's MAX_CONTENT_LENGTH
+    catches bodies that don't declare one.
     '''
-    body = request.get_json()
-    if not body:
-        raise ValueError('Failed to parse JSON')
-    gamename, playername, turnnumber = itemgetter(
-        'value1',
-        'value2',
-        'value3'
-    )(body)
-    if not gamename or not playername or not turnnumber:
-        raise ValueError('JSON was missing keys')
-    if (
-        not isinstance(gamename, str)
-        or not isinstance(playername, str)
-        or not isinstance(turnnumber, int)
-    ):
-        raise ValueError('JSON contains invalid types')
-    return (gamename, playername, turnnumber)
+    if (request.content_length or 0) > config.API_MAX_CONTENT_LENGTH:
+        raise ValueError('Body is too large')
+    try:
+        return request.get_data(cache=False)
+    except RequestEntityTooLarge as error:
+        raise ValueError('Body is too large') from error
 
 
 @api_blueprint.route('/civ6/<string:slug>', methods=['POST'])
@@ -104,6 +112,12 @@ def incoming_civ6_request(slug):
     '''
     Process an individual request.
     '''
+    # Anything that isn't shaped like a slug can't be one; don't bother the
+    # database with it.
+    if not is_valid_slug(slug):
+        logger.debug('Request to malformed slug %.16r', slug)
+        return JUST_ACCEPT
+
     # Basic test for source.
     if not request_source_is_civ_6():
         logger.debug(
@@ -112,98 +126,10 @@ def incoming_civ6_request(slug):
         )
         return JUST_ACCEPT
 
-    gamename: str
-    playername: str
-    turnnumber: int
     try:
-        gamename, playername, turnnumber = get_body_json()
-    except ValueError:
-        logger.debug('Invalid request: %s', get_body_json())
+        body = get_body()
+    except ValueError as error:
+        logger.debug('Invalid request to %s: %s', slug, error)
         return JUST_ACCEPT
-
-    with get_session() as session:
-        channel_id, _ = session.execute(
-            select(WebhookURL.channelid, WebhookURL.slug)
-            .where(WebhookURL.slug == slug)
-        ).first().tuple()
-        if not channel_id:
-            # This is not a real slug.
-            logger.debug('Valid request to invalid slug %s', slug)
-            return JUST_ACCEPT
-
-        game = session.scalar(
-            select(Game)
-            .where(Game.name == gamename)
-            .where(Game.slug == slug)
-        )
-        if not game:
-            # This game is not in the allowlist and we should leave.
-            logger.debug(
-                'Valid request to %s references untracked game %s',
-                slug,
-                gamename
-            )
-            return JUST_ACCEPT
-
-        if game.turns and game.turns[0].turn > turnnumber:
-            logger.info(
-                'Duplicate game detected (%s) obtained from webhook URL %s',
-                game.name,
-                slug
-            )
-            if game.duplicatewarned is None:
-                logger.info(
-                    'Duplicate warning not yet sent for %s; flagging',
-                    game.name
-                )
-                game.duplicatewarned = False
-            return JUST_ACCEPT
-
-        # Check for the player, create if needed.
-        player = session.scalar(
-            select(Player)
-            .where(Player.name == playername)
-            .where(Player.slug == slug)
-        )
-        if not player:
-            player = Player(
-                name=playername,
-                slug=slug
-            )
-            session.add(player)
-            session.commit()
-            player_game = PlayerGames(
-                gameid=game.id,
-                playerid=player.id,
-                slug=slug
-            )
-            session.add(player_game)
-            player.games.append(player_game)
-            session.commit()
-            logger.info(
-                'Tracking new player %s in game %s from webhook URL %s',
-                playername,
-                gamename,
-                slug
-            )
-        # Register a new turn.
-        notification = TurnNotification(
-            playerid=player.id,
-            gameid=game.id,
-            turn=turnnumber,
-            slug=slug,
-            logtime=datetime.now()
-        )
-        session.add(notification)
-        session.commit()
-
-        # If we got here, log and accept.
-        logger.info(
-            ('Notification from Civilization 6 validated and logged: %s in '
-             'game "%s" at turn %d (tracked in channel: %s)'),
-            playername,
-            gamename,
-            turnnumber,
-            channel_id
-        )
+    ingest_notification(slug, body, request.remote_addr)
     return JUST_ACCEPT
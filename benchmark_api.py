@@ -0,0 +1,77 @@
+'''
+A utility script to measure the CPU time the API spends per turn notification.
+
+Each case is POSTed repeatedly through Flask's test client, so no server is
+needed. Run as 'benchmark_api.py [slug game]'; the cases that get past
+validation touch the configured database, and given the slug of a webhook
+URL and the name of a game tracked by it, turns are logged to that game too.
+'''
+
+from json import dumps
+from sys import argv
+from time import process_time
+from civviebot_api import create_app
+
+ITERATIONS = 1000
+UNKNOWN_SLUG = 'ffffffffffffffff'
+
+
+def notification(game: str, player: str, turn: int) -> bytes:
+    '''
+    Builds a turn notification body like the ones Civ 6 sends.
+    '''
+    return dumps({'value1': game, 'value2': player, 'value3': turn}).encode()
+
+
+def measure(client, slug: str, bodies) -> float:
+    '''
+    POSTs each body to the given slug, returning the mean CPU time per
+    request in microseconds.
+    '''
+    count = 0
+    start = process_time()
+    for body in bodies:
+        client.post(
+            f'/civ6/{slug}',
+            data=body,
+            content_type='application/json'
+        )
+        count += 1
+    return (process_time() - start) / count * 1000000
+
+
+CASES = {
+    'Malformed slug': lambda: (
+        'not-a-slug',
+        [notification('game', 'player', 1)] * ITERATIONS
+    ),
+    'Oversized body': lambda: (
+        UNKNOWN_SLUG,
+        [b'x' * 1024 * 1024] * ITERATIONS
+    ),
+    'Invalid JSON': lambda: (
+        UNKNOWN_SLUG,
+        [b'{"value1": "game", "value2": '] * ITERATIONS
+    ),
+    'Invalid schema': lambda: (
+        UNKNOWN_SLUG,
+        [b'{"value1": "game", "value2": "player", "value3": "1"}'] * ITERATIONS
+    ),
+    'Unknown slug': lambda: (
+        UNKNOWN_SLUG,
+        [notification('game', 'player', 1)] * ITERATIONS
+    )
+}
+
+if len(argv) == 3:
+    CASES['Tracked game'] = lambda: (
+        argv[1],
+        [
+            notification(argv[2], f'player{turn % 4}', turn)
+            for turn in range(1, ITERATIONS + 1)
+        ]
+    )
+
+test_client = create_app().test_client()
+for name, case in CASES.items():
+    print(f'{name}: {measure(test_client, *case()):.1f}µs')
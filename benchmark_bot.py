@@ -0,0 +1,248 @@
+'''
+A utility script to run the bot end to end against a fake Discord, measuring
+dispatch throughput and how long the event loop is blocked for.
+
+Webhook URLs, games, players and turn notifications are seeded into the
+configured database, which should be a scratch one (e.g., an empty SQLite
+file), as anything else in it gets notified and cleaned up too; then a
+round each of
+notifications, stale game cleanup and startup reconciliation is run, followed
+by a number of slash commands. Everything seeded is removed afterwards.
+
+How many SQL statements each of those runs is checked by tests/test_loading.py
+instead.
+'''
+
+import asyncio
+from argparse import ArgumentParser, Namespace
+from datetime import datetime, timedelta
+from secrets import token_hex
+from time import perf_counter
+from typing import List
+from bot.civviebot import civviebot
+from bot.harness import FakeDiscord
+from bot.scheduler import get_scheduler
+from database.connect import get_session
+from database.models import (
+    Game,
+    Player,
+    PlayerGames,
+    TurnNotification,
+    WebhookURL
+)
+from database.utils import emit_all, purge_channels
+from utils import config
+
+
+def get_arguments() -> Namespace:
+    '''
+    Parses the command line.
+    '''
+    parser = ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument(
+        '--games',
+        type=int,
+        default=100,
+        help='How many channels to seed, each with a game awaiting a ping'
+    )
+    parser.add_argument(
+        '--stale',
+        type=int,
+        default=10,
+        help='How many extra channels to seed with a stale game'
+    )
+    parser.add_argument(
+        '--orphans',
+        type=int,
+        default=10,
+        help='How many webhook URLs to seed for channels that no longer exist'
+    )
+    parser.add_argument(
+        '--commands',
+        type=int,
+        default=100,
+        help='How many slash commands to invoke'
+    )
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0,
+        help='Seconds of latency to add to each request to Discord'
+    )
+    parser.add_argument(
+        '--rate-limit-every',
+        type=int,
+        default=0,
+        help='Respond to every Nth request to Discord with a 429'
+    )
+    return parser.parse_args()
+
+
+def seed(channels: List[int], guild_id: int, logtime: datetime):
+    '''
+    Seeds a game with one player and a turn notification awaiting a ping in
+    each of the given channels.
+    '''
+    with get_session() as session:
+        for channel_id in channels:
+            url = WebhookURL(
+                slug=token_hex(8),
+                channelid=channel_id,
+                guildid=guild_id
+            )
+            game = Game(name=f'Benchmark {channel_id}', slug=url.slug)
+            player = Player(name='Player', slug=url.slug)
+            session.add_all([url, game, player])
+            session.flush()
+            session.add_all([
+                PlayerGames(gameid=game.id, playerid=player.id, slug=url.slug),
+                TurnNotification(
+                    turn=game.minturns + 1,
+                    playerid=player.id,
+                    gameid=game.id,
+                    slug=url.slug,
+                    logtime=logtime
+                )
+            ])
+        session.commit()
+
+
+async def watch_loop(lags: List[float], interval: float = 0.005):
+    '''
+    Records how late the event loop is to wake up from each short sleep;
+    i.e., how long it was blocked for.
+    '''
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(loop.time() - start - interval, 0))
+
+
+async def timed(name: str, coroutine, lags: List[float], requests: list):
+    '''
+    Runs a coroutine, printing how long it took, how many requests it made to
+    Discord and how long the event loop was blocked for.
+    '''
+    lags.clear()
+    made = len(requests)
+    start = perf_counter()
+    await coroutine
+    elapsed = perf_counter() - start
+    # Let the watcher see the end of anything that was still blocking.
+    await asyncio.sleep(0.01)
+    print(
+        f'{name}: {elapsed:.3f}s, {len(requests) - made} requests to '
+        f'Discord, event loop blocked for {sum(lags):.3f}s '
+        f'(longest {max(lags, default=0) * 1000:.1f}ms)'
+    )
+
+
+async def run_commands(
+    fake: FakeDiscord,
+    channels: List[int],
+    user: dict,
+    count: int
+):
+    '''
+    Invokes a mix of slash commands across the given channels.
+    '''
+    durations = []
+    for index in range(count):
+        channel_id = channels[index % len(channels)]
+        name = ('c6game info', 'c6game players', 'c6game stats')[index % 3]
+        _, duration = await fake.invoke(
+            name.replace('c6', config.COMMAND_PREFIX, 1),
+            channel_id,
+            user,
+            game=f'Benchmark {channel_id}'
+        )
+        durations.append(duration)
+    durations.sort()
+    print(
+        f'Commands: p50 {durations[len(durations) // 2] * 1000:.1f}ms, '
+        f'max {durations[-1] * 1000:.1f}ms'
+    )
+
+
+async def main(arguments: Namespace):
+    '''
+    Runs the benchmark.
+    '''
+    notify = civviebot.get_cog('Notify')
+    cleanup = civviebot.get_cog('Cleanup')
+    # The loops are driven by hand here instead.
+    for loop in (notify.notify_turns, cleanup.run_cleanup):
+        loop.cancel()
+
+    emit_all()
+    fake = FakeDiscord(
+        civviebot,
+        latency=arguments.latency,
+        rate_limit_every=arguments.rate_limit_every
+    )
+    user = fake.make_user('Benchmarker')
+    guild = fake.add_guild(arguments.games + arguments.stale, [user])
+    channels = [channel.id for channel in guild.channels]
+    active = channels[:arguments.games]
+    orphans = [fake.snowflake() for _ in range(arguments.orphans)]
+    # Turns are only pinged once they've outlasted the debounce window.
+    seed(
+        active,
+        guild.id,
+        datetime.now() - timedelta(seconds=config.NOTIFY_DEBOUNCE)
+    )
+    seed(
+        channels[arguments.games:],
+        guild.id,
+        datetime.now() - timedelta(seconds=config.STALE_GAME_LENGTH + 60)
+    )
+    with get_session() as session:
+        session.add_all([
+            WebhookURL(slug=token_hex(8), channelid=channel_id)
+            for channel_id in orphans
+        ])
+        session.commit()
+
+    lags = []
+    watcher = asyncio.create_task(watch_loop(lags))
+    try:
+        await timed(
+            'Notifications',
+            notify.notify_turns.coro(notify),
+            lags,
+            fake.calls
+        )
+        # With NOTIFY_VIA_WEBHOOKS, notifications are webhook executions.
+        sent = fake.get_calls('POST', r'/channels/\d+/messages') + [
+            call for call in fake.get_calls('POST', r'/webhooks/(\d+)/[^/]+')
+            if int(call.path.split('/')[2]) in fake.webhooks
+        ]
+        print(f'  {len(sent)} messages sent')
+        for name, metrics in get_scheduler().get_metrics().items():
+            print(
+                f"  {name}: {metrics['sent']} sent, mean wait "
+                f"{metrics['mean_wait_seconds']:.1f}s, "
+                f"{metrics['deferred']} deferred"
+            )
+        await timed('Cleanup', cleanup.cleanup(civviebot), lags, fake.calls)
+        await timed(
+            'Reconciliation',
+            cleanup.reconcile(civviebot),
+            lags,
+            fake.calls
+        )
+        if arguments.commands:
+            await timed(
+                'Commands',
+                run_commands(fake, active, user, arguments.commands),
+                lags,
+                fake.calls
+            )
+    finally:
+        watcher.cancel()
+        purge_channels(channels + orphans)
+
+
+if __name__ == '__main__':
+    civviebot.loop.run_until_complete(main(get_arguments()))
@@ -0,0 +1,248 @@
+'''
+A utility script to check that the bot and API can share an SQLite database
+without "database is locked" errors, at a given rate of turn notifications.
+
+Webhook URLs and games are seeded into the configured database, which should
+be a scratch SQLite file set up with 'civviebot.py migrate'. Several API
+worker processes then POST turn notifications for those games through
+Flask's test client, while the bot sends notifications for them to a fake
+Discord as fast as it can, all against the same file. Rate limits and the
+notification debounce are turned off, so that every request writes. Lock
+errors are counted on both sides, and the script fails if there were any.
+Everything seeded is removed afterwards.
+'''
+
+import asyncio
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from secrets import token_hex
+from time import perf_counter, sleep
+from typing import List, Tuple
+from sqlalchemy.exc import OperationalError
+from bot.civviebot import civviebot
+from bot.harness import FakeDiscord
+from civviebot_api import create_app
+from database.connect import get_session
+from database.models import Game, WebhookURL
+from database.utils import emit_all, purge_channels
+from utils import config
+
+
+PLAYERS = 4
+
+
+def get_arguments() -> Namespace:
+    '''
+    Parses the command line.
+    '''
+    parser = ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument(
+        '--games',
+        type=int,
+        default=50,
+        help='How many channels to seed, each with a game'
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=50,
+        help='How many turn notifications to POST per second, in total'
+    )
+    parser.add_argument(
+        '--duration',
+        type=float,
+        default=10,
+        help='How many seconds to POST turn notifications for'
+    )
+    parser.add_argument(
+        '--api-workers',
+        type=int,
+        default=2,
+        help='How many API worker processes to POST from'
+    )
+    return parser.parse_args()
+
+
+def unlimit():
+    '''
+    Turns off everything that would stop a turn notification from being
+    written and then sent straight away.
+    '''
+    settings = config.get_settings()
+    settings.API_IP_RATE_LIMIT = 0
+    settings.API_SLUG_RATE_LIMIT = 0
+    settings.NEW_PLAYER_LIMIT = 0
+    settings.NOTIFY_DEBOUNCE = 0
+
+
+def is_locked(error: OperationalError) -> bool:
+    '''
+    Whether an error was SQLite giving up on waiting for a lock.
+    '''
+    return 'database is locked' in str(error.orig)
+
+
+def post_turns(
+    games: List[Tuple[str, str]],
+    rate: float,
+    duration: float
+) -> Tuple[List[float], int]:
+    '''
+    POSTs turn notifications for the given slugs and games in turn, at the
+    given rate, for the given number of seconds. Returns how long each
+    request took, and how many failed on a lock.
+
+    Runs in an API worker process.
+    '''
+    unlimit()
+    app = create_app()
+    app.config['PROPAGATE_EXCEPTIONS'] = True
+    client = app.test_client()
+    durations = []
+    locked = 0
+    start = perf_counter()
+    while perf_counter() - start < duration:
+        # Keep to the rate, rather than sleeping a fixed time per request.
+        wait = start + len(durations) / rate - perf_counter()
+        if wait > 0:
+            sleep(wait)
+        slug, game = games[len(durations) % len(games)]
+        # Each game's turns go up with each round of requests, so none look
+        # like duplicates.
+        turn = len(durations) // len(games) + 1
+        requested = perf_counter()
+        try:
+            client.post(
+                f'/civ6/{slug}',
+                json={
+                    'value1': game,
+                    'value2': f'Player {turn % PLAYERS}',
+                    'value3': turn
+                }
+            )
+        except OperationalError as error:
+            if not is_locked(error):
+                raise
+            locked += 1
+        durations.append(perf_counter() - requested)
+    return durations, locked
+
+
+def seed(channels: List[int], guild_id: int) -> List[Tuple[str, str]]:
+    '''
+    Seeds a game that pings from its first turn in each of the given
+    channels. Returns the slug and name of each.
+    '''
+    games = []
+    with get_session() as session:
+        for channel_id in channels:
+            url = WebhookURL(
+                slug=token_hex(8),
+                channelid=channel_id,
+                guildid=guild_id
+            )
+            game = Game(
+                name=f'Benchmark {channel_id}',
+                slug=url.slug,
+                minturns=0
+            )
+            session.add_all([url, game])
+            games.append((url.slug, game.name))
+        session.commit()
+    return games
+
+
+async def send_rounds(notify, api: asyncio.Future) -> Tuple[List[float], int]:
+    '''
+    Runs rounds of notifications back to back until the API workers are
+    done. Returns how long each round took, and how many failed on a lock.
+    '''
+    durations = []
+    locked = 0
+    while not api.done():
+        start = perf_counter()
+        try:
+            await notify.send_round()
+        except OperationalError as error:
+            if not is_locked(error):
+                raise
+            locked += 1
+        durations.append(perf_counter() - start)
+        # Let the API workers' results in.
+        await asyncio.sleep(0)
+    return durations, locked
+
+
+def summarize(durations: List[float]) -> str:
+    '''
+    Describes the median, 99th percentile and longest of some durations.
+    '''
+    if not durations:
+        return 'none'
+    durations = sorted(durations)
+    return (
+        f'p50 {durations[len(durations) // 2] * 1000:.1f}ms, '
+        f'p99 {durations[int(len(durations) * 0.99)] * 1000:.1f}ms, '
+        f'max {durations[-1] * 1000:.1f}ms'
+    )
+
+
+async def main(arguments: Namespace) -> int:
+    '''
+    Runs the benchmark, returning how many requests or rounds failed on a
+    lock.
+    '''
+    if config.CIVVIEBOT_DB_DIALECT != 'sqlite':
+        raise SystemExit('This benchmark needs an SQLite database')
+    unlimit()
+    notify = civviebot.get_cog('Notify')
+    cleanup = civviebot.get_cog('Cleanup')
+    # The loops are driven by hand here instead.
+    for loop in (notify.notify_turns, cleanup.run_cleanup):
+        loop.cancel()
+
+    emit_all()
+    fake = FakeDiscord(civviebot)
+    guild = fake.add_guild(arguments.games, [fake.make_user('Benchmarker')])
+    channels = [channel.id for channel in guild.channels]
+    games = seed(channels, guild.id)
+
+    loop = asyncio.get_running_loop()
+    workers = arguments.api_workers
+    # Workers are started fresh, rather than forked with this process's
+    # connections.
+    with ProcessPoolExecutor(workers, mp_context=get_context('spawn')) as pool:
+        try:
+            api = asyncio.gather(*(
+                loop.run_in_executor(
+                    pool,
+                    post_turns,
+                    games[index::workers],
+                    arguments.rate / workers,
+                    arguments.duration
+                )
+                for index in range(workers)
+            ))
+            rounds, bot_locked = await send_rounds(notify, api)
+            results = await api
+        finally:
+            purge_channels(channels)
+    requests = [duration for durations, _ in results for duration in durations]
+    api_locked = sum(locked for _, locked in results)
+    sent = fake.get_calls('POST', r'/channels/\d+/messages')
+    print(
+        f'API: {len(requests)} turn notifications from {workers} workers '
+        f'({len(requests) / arguments.duration:.1f}/s), '
+        f'{summarize(requests)}, {api_locked} locked'
+    )
+    print(
+        f'Bot: {len(rounds)} rounds, {len(sent)} messages sent, '
+        f'{summarize(rounds)}, {bot_locked} locked'
+    )
+    return api_locked + bot_locked
+
+
+if __name__ == '__main__':
+    if civviebot.loop.run_until_complete(main(get_arguments())):
+        raise SystemExit('Lock errors were hit')
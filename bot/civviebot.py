@@ -3,6 +3,8 @@ Contains civviebot, the standard implementation of CivvieBot.
 '''
 
 import logging
+from asyncio import to_thread
+from signal import SIGUSR1
 from traceback import extract_tb, format_list
 from discord import (
     Intents,
@@ -12,24 +14,20 @@ from discord import (
     ChannelType
 )
 from discord.abc import GuildChannel
-from discord.errors import NotFound
+from discord.errors import CheckFailure, NotFound
 from discord.ext.commands import (
     Bot,
     errors as command_errors,
     when_mentioned_or
 )
 from discord.utils import get
-from sqlalchemy import select, delete
 from sqlalchemy.exc import NoResultFound
-from database.models import (
-    WebhookURL,
-    PlayerGames,
-    Player,
-    Game,
-    TurnNotification
-)
-from database.connect import get_session
+from bot.monitor import describe_current_task, get_loop_monitor
+from bot.scheduler import get_scheduler
+from database.profiler import get_profiler, label_queries
+from database.utils import purge_channel, purge_guild
 from utils import config
+from utils.logs import set_log_context
 from utils.string import get_display_name
 
 
@@ -73,26 +71,49 @@ civviebot.load_extension("bot.cogs.notify")
 civviebot.load_extension("bot.cogs.player")
 civviebot.load_extension("bot.cogs.self")
 civviebot.load_extension("bot.cogs.webhookurl")
+civviebot.load_extension("bot.cogs.diagnostics")
+if config.WEBHOOK_LISTENER:
+    civviebot.load_extension("bot.cogs.listener")
+
+
+if config.LOOP_MONITOR:
+    get_loop_monitor().install(civviebot)
+if config.SQL_PROFILER:
+    get_profiler().describe_source = describe_current_task
 
 
-def purge_channel(channel: int):
+def log_diagnostics():
     '''
-    Cascade deletes the data for a channel.
+    Logs the notification queue metrics, and the SQL profile and event loop
+    stall metrics, where enabled.
     '''
-    with get_session() as session:
-        slug = session.scalar(
-            select(WebhookURL.slug)
-            .where(WebhookURL.channelid == channel)
+    logger.info('Notification queue: %s', get_scheduler().get_metrics())
+    if config.SQL_PROFILER:
+        get_profiler().log_report(config.SQL_PROFILER_TOP)
+    if config.LOOP_MONITOR:
+        logger.info(
+            'Event loop stalls: %s',
+            get_loop_monitor().get_metrics()
         )
-        if not slug:
-            # Already removed.
-            return
-        for model in (PlayerGames, TurnNotification, Player, Game, WebhookURL):
-            session.execute(
-                delete(model)
-                .where(model.slug == slug)
-            )
-        session.commit()
+
+
+civviebot.loop.add_signal_handler(SIGUSR1, log_diagnostics)
+
+
+@civviebot.before_invoke
+async def label_command(ctx: ApplicationContext):
+    '''
+    Attributes the work done by a command to it.
+    '''
+    label_queries(f'command /{ctx.command.qualified_name}')
+    set_log_context(
+        interaction=ctx.interaction.id,
+        command=ctx.command.qualified_name,
+        channel=ctx.channel_id,
+        user=ctx.user.id if ctx.user else None
+    )
+    if config.LOOP_MONITOR:
+        get_loop_monitor().label_command(ctx)
 
 
 @civviebot.event
@@ -100,13 +121,18 @@ async def on_guild_remove(guild: Guild):
     '''
     Purge everything from the database pertaining to this guild.
     '''
-    for channel in guild.channels:
-        purge_channel(channel.id)
+    label_queries('event on_guild_remove')
+    # The channel list only matters for URLs that haven't recorded their guild.
+    removed = await to_thread(
+        purge_guild,
+        guild.id,
+        [channel.id for channel in guild.channels + guild.threads]
+    )
     logger.info(
-        ('CivvieBot was removed from guild %d; any attached webhook URL was '
-         'removed, and any attached games and players, were flagged to be '
-         'removed.'),
-        guild.id
+        ('CivvieBot was removed from guild %d; %d attached webhook URLs and '
+         'their games and players were removed.'),
+        guild.id,
+        removed
     )
 
 
@@ -170,12 +196,11 @@ async def on_application_command(ctx: ApplicationContext):
         '/%s called by %s in %d',
         ctx.command.qualified_name,
         get_display_name(ctx.user),
-        ctx.channel_id
+        ctx.channel_id,
+        extra={'interaction': ctx.interaction.id}
     )
-    # Stringifying the interaction data is too heavy to be constantly doing
-    # without even knowing if it's going to be used.
-    if logger.getEffectiveLevel() == logging.DEBUG:
-        logger.debug(str(ctx.interaction.data))
+    # The interaction data is only stringified if the record is written.
+    logger.debug('Interaction data: %s', ctx.interaction.data)
 
 
 @civviebot.event
@@ -186,6 +211,12 @@ async def on_application_command_error(
     '''
     Responds to an error invoking a command.
     '''
+    if isinstance(error, (CheckFailure, command_errors.CheckFailure)):
+        await ctx.respond(
+            "Sorry, you don't have permission to use that command.",
+            ephemeral=True
+        )
+        return
     if isinstance(error.__context__, (NotFound, command_errors.UserNotFound)):
         await ctx.respond(
             "Sorry, I couldn't find a user by that name; please try again.",
@@ -3,12 +3,29 @@ CivvieBot cog to handle cleanup of stale games from the database.
 '''
 
 import logging
+from asyncio import sleep, to_thread
 from datetime import datetime, timedelta
-from sqlalchemy import select
+from sqlalchemy import exists, func, select
+from discord.errors import Forbidden, NotFound
 from discord.ext import commands, tasks
-from database.connect import get_session
+from bot.delivery import DELIVERY_ERRORS, get_delivery
+from bot.worker import runs_cleanup
+from database.connect import get_db, get_session
+from database.loading import joined_url
 from database.models import Game, TurnNotification, WebhookURL
-from database.utils import delete_game
+from database.partitions import (
+    ensure_partitions,
+    partitioning_enabled,
+    retire_partitions
+)
+from database.profiler import label_queries
+from database.retention import compact_turns
+from database.utils import (
+    delete_game,
+    get_tracked_channels,
+    purge_channels,
+    set_guild_for_channels
+)
 from utils import config
 from utils.string import expand_seconds
 
@@ -23,17 +40,171 @@ class Cleanup(commands.Cog):
 
     def __init__(self, bot):
         '''
-        Initialization; start the cleanup loop.
+        Initialization; start the cleanup loop, unless it's left to a
+        notifier worker.
         '''
         self.bot: commands.Bot = bot
-        self.run_cleanup.start()
+        self._reconciled = False
+        if runs_cleanup(bot):
+            self.run_cleanup.start()
+
+    def cog_unload(self):
+        '''
+        Stops the cleanup loop.
+        '''
+        self.run_cleanup.cancel()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        '''
+        Reconciles tracked channels the first time the bot is ready.
+        '''
+        if self._reconciled:
+            return
+        self._reconciled = True
+        # Queries run in threads from here aren't otherwise attributable.
+        label_queries('event Cleanup.on_ready')
+        await self.reconcile(self.bot)
+
+    @staticmethod
+    async def reconcile(bot: commands.Bot):
+        '''
+        Removes the data for tracked channels that were deleted or hidden from
+        CivvieBot while it wasn't around to see it happen.
+
+        Tracked channels are checked against the gateway's cache; only those
+        missing from it are checked with Discord, and both those checks and
+        the removals happen in rate limited batches.
+        '''
+        guilds = {guild.id: guild for guild in bot.guilds}
+        cached = {
+            channel.id: channel
+            for guild in guilds.values()
+            if not guild.unavailable
+            for channel in guild.channels + guild.threads
+        }
+        orphans = []
+        uncached = []
+        missing_guilds = {}
+        for channel_id, guild_id in await to_thread(get_tracked_channels):
+            channel = cached.get(channel_id)
+            if channel:
+                if not channel.permissions_for(channel.guild.me).view_channel:
+                    orphans.append(channel_id)
+                elif not guild_id:
+                    missing_guilds.setdefault(channel.guild.id, []).append(
+                        channel_id
+                    )
+            elif guild_id and guild_id not in guilds:
+                orphans.append(channel_id)
+            elif not guild_id or not guilds[guild_id].unavailable:
+                # Could be an archived thread; we have to ask.
+                uncached.append(channel_id)
+        for guild_id, channels in missing_guilds.items():
+            await to_thread(set_guild_for_channels, guild_id, channels)
+
+        for start in range(0, len(uncached), config.RECONCILE_LIMIT):
+            if start:
+                await sleep(config.RECONCILE_INTERVAL)
+            for channel_id in uncached[start:start + config.RECONCILE_LIMIT]:
+                try:
+                    await bot.fetch_channel(channel_id)
+                except (Forbidden, NotFound):
+                    orphans.append(channel_id)
+
+        removed = 0
+        for start in range(0, len(orphans), config.RECONCILE_LIMIT):
+            if start:
+                await sleep(config.RECONCILE_INTERVAL)
+            removed += await to_thread(
+                purge_channels,
+                orphans[start:start + config.RECONCILE_LIMIT]
+            )
+        logger.info(
+            ('Reconciliation has finished; checked %d uncached channels and '
+             'removed %d webhook URLs'),
+            len(uncached),
+            removed
+        )
 
     @tasks.loop(seconds=config.CLEANUP_INTERVAL)
     async def run_cleanup(self):
         '''
-        Cleans up stale games.
+        Cleans up stale games, then compacts old turn notifications.
+
+        With partitioning, old turn notifications are compacted a month at a
+        time when their partition is retired, so they aren't also compacted
+        row by row.
         '''
+        label_queries('loop task Cleanup.run_cleanup')
         await self.cleanup(self.bot)
+        if partitioning_enabled(get_db()):
+            await self.maintain_partitions()
+        else:
+            await self.compact()
+
+    @staticmethod
+    async def maintain_partitions():
+        '''
+        Creates upcoming turn notification partitions and retires old ones, if
+        turn notifications are partitioned.
+        '''
+        database = get_db()
+        if not partitioning_enabled(database):
+            return
+
+        def premake() -> int:
+            with database.begin() as connection:
+                return ensure_partitions(
+                    connection,
+                    config.TURN_PARTITION_PREMAKE
+                )
+
+        # Partition DDL and retiring whole months are bulk work, so they're
+        # kept off the event loop.
+        created = await to_thread(premake)
+        retired = 0
+        if config.TURN_RETENTION_LENGTH:
+            retired = await to_thread(
+                retire_partitions,
+                database,
+                datetime.now() - timedelta(
+                    seconds=config.TURN_RETENTION_LENGTH
+                ),
+                archive_path=config.TURN_ARCHIVE_PATH
+            )
+        logger.info(
+            'Partition maintenance has finished; created %d, retired %d',
+            created,
+            retired
+        )
+
+    @staticmethod
+    async def compact():
+        '''
+        Compacts turn notifications over the turn retention length, in batches,
+        each run off the event loop.
+        '''
+        if not config.TURN_RETENTION_LENGTH:
+            return
+        compacted = 0
+        before = (
+            datetime.now() - timedelta(seconds=config.TURN_RETENTION_LENGTH)
+        )
+        while True:
+            batch = await to_thread(
+                compact_turns,
+                before,
+                config.TURN_RETENTION_LIMIT,
+                archive_path=config.TURN_ARCHIVE_PATH
+            )
+            compacted += batch
+            if batch < config.TURN_RETENTION_LIMIT:
+                break
+        logger.info(
+            'Round of compaction has finished; compacted %d notifications',
+            compacted
+        )
 
     @staticmethod
     async def cleanup(bot: commands.Bot, limit_channel: int = None):
@@ -45,23 +216,27 @@ class Cleanup(commands.Cog):
         stale_time = (
             datetime.now() - timedelta(seconds=config.STALE_GAME_LENGTH)
         )
+        last_logtime = (
+            select(func.max(TurnNotification.logtime))
+            .where(TurnNotification.gameid == Game.id)
+            .scalar_subquery()
+        )
         with get_session() as session:
             query = (
-                select(Game)
-                .join(Game.turns)
-                .where(TurnNotification.logtime < stale_time)
+                select(Game, last_logtime)
+                .join(Game.webhookurl)
+                .options(joined_url(Game))
+                .where(
+                    exists()
+                    .where(TurnNotification.gameid == Game.id)
+                    .where(TurnNotification.logtime < stale_time)
+                )
                 .limit(config.CLEANUP_LIMIT)
-                .distinct()
             )
             if limit_channel:
-                query = (
-                    query.join(Game.webhookurl)
-                    .where(WebhookURL.channelid == limit_channel)
-                )
-            for game in session.scalars(query):
-                last_turn = game.turns[0].logtime.strftime(
-                    '%m/%%d/%Y, %H:%M:%S'
-                )
+                query = query.where(WebhookURL.channelid == limit_channel)
+            for game, logtime in session.execute(query).all():
+                last_turn = logtime.strftime('%m/%%d/%Y, %H:%M:%S')
                 delete_game(game.id)
                 removed += 1
                 logger.info(
@@ -70,19 +245,31 @@ class Cleanup(commands.Cog):
                     game.webhookurl.channelid,
                     last_turn
                 )
-                channel = await bot.fetch_channel(game.webhookurl.channelid)
-                await channel.send(
-                    content=(
-                        f'No activity detected in the game {game.name} for '
-                        f'{expand_seconds(config.STALE_GAME_LENGTH)} (last '
-                        f'turn: <t:{int(game.turns[0].logtime.timestamp())}:R>'
-                        '), so tracking information about the game has been '
-                        'automatically removed. If you would like to continue '
-                        'recieving notifications for this game, a new turn '
-                        'will have to be taken and CivvieBot will have to '
-                        'recieve a turn notification for it.'
+                channel_id = game.webhookurl.channelid
+                if not get_delivery(bot).is_available(channel_id):
+                    continue
+                # The game's already gone, so there's nothing to retry.
+                try:
+                    await get_delivery(bot).send(
+                        channel_id,
+                        content=(
+                            f'No activity detected in the game {game.name} '
+                            f'for {expand_seconds(config.STALE_GAME_LENGTH)} '
+                            f'(last turn: <t:{int(logtime.timestamp())}:R>'
+                            '), so tracking information about the game has '
+                            'been automatically removed. If you would like to '
+                            'continue recieving notifications for this game, '
+                            'a new turn will have to be taken and CivvieBot '
+                            'will have to recieve a turn notification for it.'
+                        )
+                    )
+                except DELIVERY_ERRORS as error:
+                    logger.warning(
+                        'Could not tell %d that %s was cleaned up: %s',
+                        channel_id,
+                        game.name,
+                        error
                     )
-                )
         logger.info('Round of cleanup has finished; removed %d games', removed)
 
 
@@ -0,0 +1,150 @@
+'''
+CivvieBot cog for the bot's owner to check on how the bot is performing.
+'''
+
+from io import BytesIO
+from discord import ApplicationContext, File
+from discord.commands import SlashCommandGroup, option
+from discord.ext.commands import Bot, Cog, is_owner
+from sqlalchemy import func, select
+from bot import permissions
+from bot.monitor import get_loop_monitor
+from bot.scheduler import get_scheduler
+from bot.worker import runs_loops
+from database.models import Game
+from database.profiler import get_profiler
+from database.replica import get_read_session
+from database.utils import date_rank_subquery
+from utils import config
+
+
+NAME = config.COMMAND_PREFIX + 'diagnostics'
+DESCRIPTION = "Check on CivvieBot's performance."
+
+
+class DiagnosticsCommands(Cog, name=NAME, description=DESCRIPTION):
+    '''
+    Commands for reporting on SQL profiling, event loop stalls and the
+    notification queue.
+    '''
+
+    def __init__(self, bot):
+        '''
+        Initialization; sets the bot.
+        '''
+        self.bot: Bot = bot
+
+    diagnostics = SlashCommandGroup(NAME, DESCRIPTION)
+    diagnostics.default_member_permissions = permissions.admin_level
+
+    @diagnostics.command(
+        description='Get the slowest and most frequent SQL statements'
+    )
+    @option(
+        'top',
+        type=int,
+        description='How many statements to list in each section',
+        default=config.SQL_PROFILER_TOP,
+        min_value=1
+    )
+    @option(
+        'reset',
+        type=bool,
+        description='Start profiling again from scratch afterwards',
+        default=False
+    )
+    @is_owner()
+    async def queries(self, ctx: ApplicationContext, top: int, reset: bool):
+        '''
+        Responds with the SQL profiler's report, as a file.
+        '''
+        if not config.SQL_PROFILER:
+            await ctx.respond('SQL_PROFILER is not enabled.', ephemeral=True)
+            return
+        profiler = get_profiler()
+        report = profiler.get_report(top)
+        if reset:
+            profiler.reset()
+        await ctx.respond(
+            file=File(BytesIO(report.encode()), filename='queries.txt'),
+            ephemeral=True
+        )
+
+    @diagnostics.command(description='Get how often the event loop stalled')
+    @is_owner()
+    async def stalls(self, ctx: ApplicationContext):
+        '''
+        Responds with the event loop monitor's metrics.
+        '''
+        if not config.LOOP_MONITOR:
+            await ctx.respond('LOOP_MONITOR is not enabled.', ephemeral=True)
+            return
+        metrics = get_loop_monitor().get_metrics()
+        lines = [
+            f"{metrics['stalls']} stalls, "
+            f"{metrics['stalled_seconds'] * 1000:.0f}ms in total, "
+            f"longest {metrics['longest_seconds'] * 1000:.0f}ms"
+        ]
+        for source, stalls in sorted(
+            metrics['sources'].items(),
+            key=lambda item: item[1]['stalled_seconds'],
+            reverse=True
+        ):
+            lines.append(
+                f"{source}: {stalls['stalls']} stalls, "
+                f"{stalls['stalled_seconds'] * 1000:.0f}ms"
+            )
+        report = '\n'.join(lines)
+        await ctx.respond(
+            file=File(BytesIO(report.encode()), filename='stalls.txt'),
+            ephemeral=True
+        )
+
+    @diagnostics.command(
+        description='Get how long each kind of notification waits to be sent'
+    )
+    @is_owner()
+    async def queue(self, ctx: ApplicationContext):
+        '''
+        Responds with the notification scheduler's metrics, or, if notifier
+        workers send the notifications, with how many new turns are waiting
+        on them.
+        '''
+        if not runs_loops(self.bot):
+            # Counted the way Notify finds new turns to send: each game's
+            # latest turn, once it's past the game's minimum.
+            subquery = date_rank_subquery()
+            with get_read_session() as session:
+                waiting = session.scalar(
+                    select(func.count())
+                    .select_from(subquery)
+                    .join(Game, Game.id == subquery.c.gameid)
+                    .where(Game.muted == False)
+                    .where(subquery.c.turn > Game.minturns)
+                    .where(subquery.c.date_rank == 1)
+                    .where(subquery.c.lastnotified == None)
+                    .where(subquery.c.deadlettered == None)
+                )
+            await ctx.respond(
+                f'{waiting} new turns are waiting to be sent. Notifications '
+                'are sent by the notifier workers; send them SIGUSR1 to log '
+                'how long each kind waited.',
+                ephemeral=True
+            )
+            return
+        lines = []
+        for name, metrics in get_scheduler().get_metrics().items():
+            lines.append(
+                f"{name}: {metrics['sent']} sent, waited "
+                f"{metrics['mean_wait_seconds']:.1f}s on average, "
+                f"{metrics['longest_wait_seconds']:.1f}s at most; "
+                f"{metrics['deferred']} put off to a later round"
+            )
+        await ctx.respond('\n'.join(lines), ephemeral=True)
+
+
+def setup(bot: Bot):
+    '''
+    Adds this cog to the bot.
+    '''
+    bot.add_cog(DiagnosticsCommands(bot))
@@ -4,19 +4,30 @@ CivvieBot cog to handle commands dealing with games.
 
 import logging
 from discord import ApplicationContext, Embed, EmbedField, TextChannel
+from discord.errors import Forbidden, NotFound
 from discord.commands import SlashCommandGroup, option
 from discord.ext.commands import Cog, Bot
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.exc import IntegrityError
 from bot import permissions
+from bot.converters import GameConverter
 from bot.interactions.common import View
 import bot.interactions.common as common_interactions
 import bot.interactions.game as game_interactions
+import bot.messaging.board as board_messaging
 import bot.messaging.game as game_messaging
 import bot.messaging.notify as notify_messaging
 from database.autocomplete import get_games_for_channel
 from database.connect import get_session
-from database.models import Game, Player, PlayerGames
+from database.loading import GAME_WITH_URL, current_turn
+from database.models import (
+    Game,
+    Player,
+    PlayerGames,
+    TurnNotification,
+    WebhookURL
+)
+from database.replica import mark_written
 from database.utils import get_url_for_channel
 from utils import config
 from utils.string import get_display_name
@@ -67,12 +78,13 @@ class GameCommands(Cog, name=NAME, description=DESCRIPTION):
         '''
         Adds a new game to track in this channel.
         '''
-        url = get_url_for_channel(ctx.channel_id)
+        url = get_url_for_channel(ctx.channel_id, ctx.guild_id)
         with get_session() as session:
             session.add(url)
             try:
                 session.add(Game(name=game_name, slug=url.slug))
                 session.commit()
+                mark_written()
                 embed = Embed()
                 embed.add_field(name='Channel URL', value=url.full_url)
                 embed.set_footer(
@@ -111,7 +123,7 @@ class GameCommands(Cog, name=NAME, description=DESCRIPTION):
     )
     @option(
         'game',
-        input_type=Game,
+        type=GameConverter,
         description='The game to get info about',
         required=True,
         autocomplete=get_games_for_channel
@@ -138,7 +150,7 @@ class GameCommands(Cog, name=NAME, description=DESCRIPTION):
     )
     @option(
         'game',
-        input_type=Game,
+        type=GameConverter,
         description='The game to get players for',
         required=True,
         autocomplete=get_games_for_channel
@@ -181,7 +193,7 @@ class GameCommands(Cog, name=NAME, description=DESCRIPTION):
                 select(Player)
                 .join(PlayerGames, PlayerGames.playerid == Player.id)
                 .where(PlayerGames.gameid == game.id)
-            )
+            ).all()
             if players:
                 embed = Embed(title='Players')
                 embed.fields = [
@@ -196,12 +208,37 @@ class GameCommands(Cog, name=NAME, description=DESCRIPTION):
                 )
         await ctx.respond(content=content, embed=embed, ephemeral=private)
 
+    @games.command(
+        description='Get turn time statistics for a game in this channel'
+    )
+    @option(
+        'game',
+        type=GameConverter,
+        description='The game to get turn time statistics for',
+        required=True,
+        autocomplete=get_games_for_channel
+    )
+    @option(
+        'private',
+        type=bool,
+        description='Make the response visible only to you',
+        default=True
+    )
+    async def stats(self, ctx: ApplicationContext, game: Game, private: bool):
+        '''
+        Prints out how long each player in a game takes to take their turn.
+        '''
+        await ctx.respond(
+            embed=game_messaging.get_stats_embed(game),
+            ephemeral=private
+        )
+
     @manage_games.command(
         description='Edit the configuration for an active game in this channel'
     )
     @option(
         'game',
-        input_type=Game,
+        type=GameConverter,
         description='The game to edit',
         required=True,
         autocomplete=get_games_for_channel
@@ -228,7 +265,7 @@ class GameCommands(Cog, name=NAME, description=DESCRIPTION):
     )
     @option(
         'game',
-        input_type=Game,
+        type=GameConverter,
         description='The game to toggle muting for',
         required=True,
         autocomplete=get_games_for_channel
@@ -241,6 +278,7 @@ class GameCommands(Cog, name=NAME, description=DESCRIPTION):
             session.add(game)
             game.muted = not game.muted
             session.commit()
+            mark_written()
             await ctx.respond(
                 content=(
                     f'Notifications for **{game.name}** are now muted.'
@@ -255,7 +293,7 @@ class GameCommands(Cog, name=NAME, description=DESCRIPTION):
     )
     @option(
         'game',
-        input_type=Game,
+        type=GameConverter,
         description='The game to delete',
         required=True,
         autocomplete=get_games_for_channel
@@ -274,7 +312,7 @@ class GameCommands(Cog, name=NAME, description=DESCRIPTION):
                 'will stay linked to users afterwards.'
             ),
             embed=embed,
-            view=View(game_interactions.ConfirmDeleteButton(game.id))
+            view=View(game_interactions.ConfirmDeleteButton(game))
         )
 
     @manage_games.command(
@@ -282,7 +320,7 @@ class GameCommands(Cog, name=NAME, description=DESCRIPTION):
     )
     @option(
         'game',
-        input_type=Game,
+        type=GameConverter,
         description='The game to ping',
         required=True,
         autocomplete=get_games_for_channel
@@ -292,14 +330,14 @@ class GameCommands(Cog, name=NAME, description=DESCRIPTION):
         Re-sends a turn notification for the most recent turn in a game.
         '''
         with get_session() as session:
-            session.add(game)
             logger.info(
                 'User %s requested re-pinging for game %s (channel ID: %d)',
                 get_display_name(ctx.user),
                 game.name,
                 ctx.channel_id
             )
-            if not game.turns:
+            turn = session.scalar(current_turn(game.id))
+            if not turn:
                 await ctx.respond(
                     content=(
                         "Sorry; I haven't gotten a turn notification for this "
@@ -309,9 +347,9 @@ class GameCommands(Cog, name=NAME, description=DESCRIPTION):
                 )
                 return
             await ctx.respond(
-                content=notify_messaging.get_content(game.turns[0]),
-                embed=notify_messaging.get_embed(game.turns[0]),
-                view=notify_messaging.get_view(game.turns[0])
+                content=notify_messaging.get_content(turn),
+                embed=notify_messaging.get_embed(turn),
+                view=notify_messaging.get_view(turn)
             )
 
     @manage_games.command(
@@ -329,12 +367,72 @@ class GameCommands(Cog, name=NAME, description=DESCRIPTION):
             ephemeral=True
         )
 
+    @manage_games.command(
+        description=(
+            'Keep one status board message for the games in this channel, '
+            'instead of a message per turn'
+        )
+    )
+    @option(
+        'enabled',
+        type=bool,
+        description='Use a status board in this channel',
+        default=True
+    )
+    async def board(self, ctx: ApplicationContext, enabled: bool):
+        '''
+        Posts a status board to the channel and switches it over to being
+        notified through it, or switches it back to a message per turn.
+
+        Any previous board is removed; using this with a board already up
+        reposts it.
+        '''
+        url = get_url_for_channel(ctx.channel_id, ctx.guild_id)
+        previous = url.statusboard
+        board = None
+        if enabled:
+            board = (
+                await board_messaging.post_board(
+                    ctx.channel,
+                    board_messaging.get_board_embed(
+                        board_messaging.get_board_games(ctx.channel_id)
+                    )
+                )
+            ).id
+        with get_session() as session:
+            session.execute(
+                update(WebhookURL)
+                .where(WebhookURL.slug == url.slug)
+                .values(statusboard=board)
+            )
+            session.commit()
+        if previous:
+            try:
+                await ctx.channel.get_partial_message(previous).delete()
+            except (NotFound, Forbidden):
+                pass
+        logger.info(
+            'User %s turned the status board %s in %d',
+            get_display_name(ctx.user),
+            'on' if enabled else 'off',
+            ctx.channel_id
+        )
+        await ctx.respond(
+            content=(
+                "I'll keep the status board up to date as turns come in, "
+                'and only ping players who are linked to someone.'
+                if enabled
+                else "I'll go back to sending a message for each turn."
+            ),
+            ephemeral=True
+        )
+
     @manage_games.command(
         description='Move a game and its tracking data to a different channel'
     )
     @option(
         'game',
-        input_type=Game,
+        type=GameConverter,
         description='The game to move',
         required=True,
         autocomplete=get_games_for_channel
@@ -362,12 +460,13 @@ class GameCommands(Cog, name=NAME, description=DESCRIPTION):
                 )
             )
             return
-        new_url = get_url_for_channel(new_channel.id)
+        new_url = get_url_for_channel(new_channel.id, new_channel.guild.id)
         with get_session() as session:
             session.add(new_url)
             # Check for an existing game, possibly request merge.
             existing_game = session.scalar(
                 select(Game)
+                .options(*GAME_WITH_URL)
                 .where(Game.slug == new_url.slug)
                 .where(Game.name == game.name)
             )
@@ -402,11 +501,14 @@ class GameCommands(Cog, name=NAME, description=DESCRIPTION):
 
             session.add(game)
             game.slug = new_url.slug
-            for player in game.players:
-                player.slug = new_url.slug
-            for turn in game.turns:
-                turn.slug = new_url.slug
+            for model in (PlayerGames, TurnNotification):
+                session.execute(
+                    update(model)
+                    .where(model.gameid == game.id)
+                    .values(slug=new_url.slug)
+                )
             session.commit()
+            mark_written()
             await ctx.respond(
                 content=(
                     f'{game.name} has been moved to {new_channel.name}; '
@@ -0,0 +1,131 @@
+'''
+CivvieBot cog that serves webhook URLs from the bot itself, for deployments
+small enough not to need the API as well.
+
+Only loaded if WEBHOOK_LISTENER is enabled. Turn notifications are validated,
+rate limited and recorded just as the API would (see api.ingest); each turn
+recorded then wakes the notification loop for when its NOTIFY_DEBOUNCE is up,
+instead of waiting for the next NOTIFY_INTERVAL.
+'''
+
+import logging
+from asyncio import to_thread
+from uuid import uuid4
+from aiohttp import web
+from discord.ext import commands
+from api.ingest import ingest_notification, is_valid_slug
+from database.profiler import label_queries
+from utils import config
+from utils.logs import set_log_context
+
+
+logger = logging.getLogger(f'civviebot.{__name__}')
+
+
+ROUTE = '/civ6/{slug}'
+
+
+def get_address(request: web.Request) -> str:
+    '''
+    Gets the address a request came from, trusting as many proxies in front
+    of the bot as API_TRUSTED_PROXIES says there are.
+    '''
+    if config.API_TRUSTED_PROXIES:
+        header = request.headers.get('X-Forwarded-For', '')
+        forwarded = [
+            address.strip()
+            for address in header.split(',')
+            if address.strip()
+        ]
+        if len(forwarded) >= config.API_TRUSTED_PROXIES:
+            return forwarded[-config.API_TRUSTED_PROXIES]
+    return request.remote
+
+
+class Listener(commands.Cog):
+    '''
+    Serves webhook URLs.
+    '''
+
+    def __init__(self, bot):
+        '''
+        Initialization; starts serving once the bot's event loop runs.
+        '''
+        self.bot: commands.Bot = bot
+        self.runner: web.AppRunner = None
+        self._starting = self.bot.loop.create_task(self.start())
+
+    async def start(self):
+        '''
+        Starts serving on WEBHOOK_LISTENER_HOST and WEBHOOK_LISTENER_PORT.
+        '''
+        app = web.Application(client_max_size=config.API_MAX_CONTENT_LENGTH)
+        app.router.add_post(ROUTE, self.incoming_civ6_request)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(
+            self.runner,
+            config.WEBHOOK_LISTENER_HOST,
+            config.WEBHOOK_LISTENER_PORT
+        ).start()
+        logger.info(
+            'Listening for turn notifications on %s:%d',
+            config.WEBHOOK_LISTENER_HOST,
+            config.WEBHOOK_LISTENER_PORT
+        )
+
+    def cog_unload(self):
+        '''
+        Stops serving.
+        '''
+        self._starting.cancel()
+        if self.runner:
+            self.bot.loop.create_task(self.runner.cleanup())
+
+    async def incoming_civ6_request(
+        self,
+        request: web.Request
+    ) -> web.Response:
+        '''
+        Process an individual request.
+
+        Like the API, this accepts every request, whether or not anything
+        came of it.
+        '''
+        slug = request.match_info['slug']
+        label_queries(f'listener POST {ROUTE}')
+        set_log_context(
+            request_id=(
+                request.headers.get('X-Request-ID', '')[:64] or uuid4().hex
+            ),
+            route=ROUTE
+        )
+        accepted = web.Response(text='Accepted')
+        if not is_valid_slug(slug):
+            logger.debug('Request to malformed slug %.16r', slug)
+            return accepted
+        if (request.content_length or 0) > config.API_MAX_CONTENT_LENGTH:
+            logger.debug('Invalid request to %s: Body is too large', slug)
+            return accepted
+        try:
+            body = await request.read()
+        except web.HTTPRequestEntityTooLarge:
+            logger.debug('Invalid request to %s: Body is too large', slug)
+            return accepted
+        game_id = await to_thread(
+            ingest_notification,
+            slug,
+            body,
+            get_address(request)
+        )
+        notify = self.bot.get_cog('Notify')
+        if game_id is not None and notify:
+            notify.wake(config.NOTIFY_DEBOUNCE)
+        return accepted
+
+
+def setup(bot: commands.Bot):
+    '''
+    Adds this cog to the bot.
+    '''
+    bot.add_cog(Listener(bot))
@@ -3,13 +3,37 @@ CivvieBot cog that sends out turn notifications.
 '''
 
 import logging
+from asyncio import Lock, Task, sleep
+from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Tuple
+from functools import partial
+from math import ceil
+from typing import Dict, Iterable, List, Set, Tuple
+from discord import Interaction, InteractionType
+from discord.errors import Forbidden, NotFound
 from discord.ext import tasks, commands
-from sqlalchemy import select, Row, Subquery, Select
+from sqlalchemy import (
+    exists,
+    func,
+    or_,
+    select,
+    tuple_,
+    update,
+    Over,
+    Row,
+    Subquery,
+    Select
+)
+from sqlalchemy.orm import Session, aliased
 from database.connect import get_session
+from database.loading import NOTIFICATION
 from database.models import TurnNotification, Game, WebhookURL
 from database.utils import date_rank_subquery
+from bot.delivery import DELIVERY_ERRORS, get_delivery
+from bot.scheduler import Job, NotificationQueue, Priority, get_scheduler
+from bot.worker import channel_share, runs_loops
+import bot.interactions.notify as notify_interactions
+import bot.messaging.board as board_messaging
 import bot.messaging.notify as notify_messaging
 from utils import config
 
@@ -24,21 +48,67 @@ class Notify(commands.Cog):
 
     def __init__(self, bot):
         '''
-        Initialization; starts the notification loop.
+        Initialization; starts the notification loop, unless it's left to
+        notifier workers.
         '''
         self.bot: commands.Bot = bot
-        self.notify_turns.start()
-        self.notify_duplicates.start()
+        # Regular and woken rounds take turns.
+        self._round = Lock()
+        self._wakes: Dict[int, Task] = {}
+        if runs_loops(bot):
+            self.notify_turns.start()
+
+    def cog_unload(self):
+        '''
+        Stops the notification loop and closes anything held for sending.
+        '''
+        self.notify_turns.cancel()
+        for task in self._wakes.values():
+            task.cancel()
+        self.bot.loop.create_task(get_delivery(self.bot).close())
+
+    @commands.Cog.listener()
+    async def on_interaction(self, interaction: Interaction):
+        '''
+        Presses turn notification buttons on messages this process isn't
+        tracking a view for; those sent by a notifier worker, or before the
+        bot last restarted.
+        '''
+        if (
+            interaction.type != InteractionType.component
+            or not interaction.message
+        ):
+            return
+        # pylint: disable=protected-access
+        if self.bot._connection._view_store.is_message_tracked(
+            interaction.message.id
+        ):
+            return
+        custom_id = interaction.data.get('custom_id', '')
+        if not notify_interactions.is_notification_button(custom_id):
+            return
+        button = notify_interactions.get_button(custom_id)
+        if button is None:
+            await interaction.response.send_message(
+                "That game isn't being tracked anymore.",
+                ephemeral=True
+            )
+            return
+        await button.callback(interaction)
 
     @staticmethod
     def notification_query(
-        subquery: Subquery
+        subquery: Subquery,
+        now: datetime,
+        unavailable: List[int]
     ) -> Select[Tuple[int, str, str, str, datetime, datetime, int, int]]:
         '''
-        Gets the base query to use for notifications.
+        Gets the base query to use for notifications, leaving out those
+        waiting to be retried or given up on, those in the given unavailable
+        channels, and those in channels another worker sends for.
 
         Gives the tuple back in model defined order, plus the
-        WebhookURL.channelid.
+        WebhookURL.channelid and statusboard.
         '''
         return (
             select(
@@ -48,73 +118,402 @@ class Notify(commands.Cog):
                 subquery.c.slug,
                 subquery.c.logtime,
                 subquery.c.lastnotified,
+                subquery.c.attempts,
                 subquery.c.date_rank,
-                WebhookURL.channelid
+                WebhookURL.channelid,
+                WebhookURL.statusboard
             )
             .join(Game, Game.id == subquery.c.gameid)
             .join(WebhookURL, WebhookURL.slug == subquery.c.slug)
             .where(Game.muted == False)
             .where(subquery.c.turn > Game.minturns)
             .where(subquery.c.date_rank == 1)
+            .where(subquery.c.deadlettered == None)
+            .where(
+                or_(
+                    subquery.c.nextattempt == None,
+                    subquery.c.nextattempt <= now
+                )
+            )
+            .where(WebhookURL.channelid.not_in(unavailable))
+            .where(channel_share())
+        )
+
+    @staticmethod
+    def fair_order(*order_by) -> Over:
+        '''
+        Gets an ordering that takes rows from each channel in turn (in the
+        given order within a channel), so that a limited query doesn't take
+        them all from the channel with the most.
+        '''
+        return func.row_number().over(
+            partition_by=WebhookURL.channelid,
+            order_by=order_by
         )
 
     @tasks.loop(seconds=config.NOTIFY_INTERVAL)
     async def notify_turns(self):
         '''
-        Sends out notifications for games that should send notifications (i.e.,
-        they are not muted and are at a high enough turn to start pinging).
+        Sends out a round of notifications every NOTIFY_INTERVAL.
+        '''
+        async with self._round:
+            await self.send_round()
+
+    def wake(self, delay: float):
+        '''
+        Sends out an extra round of notifications in the given number of
+        seconds, for a turn that was just recorded by this process, rather
+        than waiting for the next regular round.
+
+        Wakes due in the same second share a round.
+        '''
+        if not runs_loops(self.bot):
+            return
+        due = ceil(self.bot.loop.time() + delay)
+        if due not in self._wakes:
+            self._wakes[due] = self.bot.loop.create_task(
+                self.send_woken_round(due)
+            )
+
+    async def send_woken_round(self, due: int):
+        '''
+        Sends out a round of notifications woken for the given loop time.
+        '''
+        await sleep(due - self.bot.loop.time())
+        del self._wakes[due]
+        async with self._round:
+            try:
+                await self.send_round()
+            # Nothing else will see this task's exception; the regular rounds
+            # carry on regardless.
+            except Exception as error:
+                logger.error(
+                    'Woken round of notifications failed: %s',
+                    error,
+                    exc_info=error
+                )
+
+    async def send_round(self):
+        '''
+        Sends out a round of notifications for games that should send
+        notifications (i.e., they are not muted and are at a high enough turn
+        to start pinging), and warnings about duplicate games.
+
+        New turns are sent for games that assert that the most recent
+        notification has no 'lastnotified' time, once it's been the most
+        recent for NOTIFY_DEBOUNCE seconds. Earlier notifications it
+        superseded are marked as skipped.
 
-        First, notifications are sent for games that assert that the most
-        recent notification has no 'lastnotified' time.
+        Duplicate warnings are sent for games that haven't been warned about
+        yet (see queue_duplicates).
 
-        Second, notifications are sent for games whose 'nextremind' is before
-        the current time.
+        Reminders are sent for games whose 'nextremind' is before the current
+        time.
+
+        Everything due is queued and sent in that order of priority, taking
+        turns between channels, up to NOTIFY_LIMIT per round (see
+        bot.scheduler); anything left over is sent in a later round.
+
+        Notifications for channels with a status board are held back, and the
+        board is updated once for all of them instead.
+
+        A notification that fails to send doesn't stop the others; it's
+        retried after a while (see record_failures), and channels where sends
+        keep failing are skipped until their circuit breaker closes.
         '''
         now = datetime.now()
         subquery = date_rank_subquery()
+        unavailable = get_delivery(self.bot).get_unavailable()
+        queue = NotificationQueue()
+        # Held back notifications, by game, by channel and board, and the
+        # boards holding back any new turns.
+        boards = defaultdict(dict)
+        boards_with_turns = set()
 
-        # Round of standard notifications: the most recent turn notification
-        # has no 'lastnotified'.
+        # New turns: the most recent turn notification has no 'lastnotified',
+        # and no newer one has come in for a while.
+        debounce = timedelta(seconds=config.NOTIFY_DEBOUNCE)
         with get_session() as session:
             notifications = session.execute(
-                self.notification_query(subquery)
+                self.notification_query(subquery, now, unavailable)
                 .where(subquery.c.lastnotified == None)
+                .where(subquery.c.logtime <= now - debounce)
+                .order_by(self.fair_order(subquery.c.logtime))
                 .limit(config.NOTIFY_LIMIT)
-            )
+            ).all()
+            if notifications:
+                self.skip_superseded(
+                    session,
+                    {notification.gameid for notification in notifications},
+                    now
+                )
+                session.commit()
         for notification in notifications:
-            await self.send_notification(self.bot, notification)
-            logger.info(
-                (
-                    'Standard turn notification sent for %s (turn %d, logged '
-                    'at %s)'
-                ),
-                notification.gameid,
-                notification.turn,
-                notification.logtime.strftime('%m/%%d/%Y, %H:%M:%S')
-            )
+            if notification.statusboard:
+                board = (notification.channelid, notification.statusboard)
+                boards[board][notification.gameid] = notification
+                boards_with_turns.add(board)
+                continue
+            queue.put(Job(
+                Priority.TURN,
+                notification.channelid,
+                (Priority.TURN, notification.gameid),
+                partial(self.send_turn, notification),
+                notification.logtime + debounce
+            ))
 
-        # Round of reminder notifications: the game's 'nextremind' is before
-        # the current time. The 'nextremind' is expected to be calculated when
-        # a notification is sent.
+        self.queue_duplicates(queue, unavailable)
+
+        # Reminders: the most recent turn notification was pinged, and the
+        # game's 'nextremind' is before the current time. The 'nextremind' is
+        # expected to be calculated when a notification is sent.
         with get_session() as session:
             notifications = session.execute(
-                self.notification_query(subquery)
+                self.notification_query(subquery, now, unavailable)
+                .add_columns(Game.nextremind)
+                .where(subquery.c.lastnotified != None)
                 .where(Game.nextremind != None)
                 .where(Game.nextremind < now)
+                .order_by(self.fair_order(Game.nextremind))
                 .limit(config.NOTIFY_LIMIT)
-            )
+            ).all()
         for notification in notifications:
+            if notification.statusboard:
+                board = (notification.channelid, notification.statusboard)
+                boards[board][notification.gameid] = notification
+                continue
+            queue.put(Job(
+                Priority.REMINDER,
+                notification.channelid,
+                (Priority.REMINDER, notification.gameid),
+                partial(self.send_reminder, notification),
+                notification.nextremind
+            ))
+
+        for board, pending in boards.items():
+            channel_id, message_id = board
+            priority = (
+                Priority.TURN
+                if board in boards_with_turns
+                else Priority.REMINDER
+            )
+            queue.put(Job(
+                priority,
+                channel_id,
+                (priority, board),
+                partial(self.send_board, channel_id, message_id, pending),
+                min(
+                    notification.logtime + debounce
+                    if notification.lastnotified is None
+                    else notification.nextremind
+                    for notification in pending.values()
+                )
+            ))
+
+        await get_scheduler().run(queue, config.NOTIFY_LIMIT)
+
+    async def send_turn(self, notification: Row[Tuple]) -> bool:
+        '''
+        Sends a new turn notification. Returns whether it was sent.
+        '''
+        if not await self.dispatch(notification):
+            return False
+        logger.info(
+            (
+                'Standard turn notification sent for %s (turn %d, logged '
+                'at %s)'
+            ),
+            notification.gameid,
+            notification.turn,
+            notification.logtime.strftime('%m/%%d/%Y, %H:%M:%S')
+        )
+        return True
+
+    async def send_reminder(self, notification: Row[Tuple]) -> bool:
+        '''
+        Sends a reminder for a turn notification. Returns whether it was sent.
+        '''
+        if not await self.dispatch(notification):
+            return False
+        logger.info(
+            (
+                'Reminder sent for %s (turn %d, last ping: %s, last '
+                'logged notification: %s)'
+            ),
+            notification.gameid,
+            notification.turn,
+            notification.lastnotified.strftime('%m/%%d/%Y, %H:%M:%S'),
+            notification.logtime.strftime('%m/%%d/%Y, %H:%M:%S')
+        )
+        return True
+
+    async def send_board(
+        self,
+        channel_id: int,
+        board: int,
+        pending: Dict[int, Row[Tuple]]
+    ) -> bool:
+        '''
+        Updates a status board for the given pending notifications, recording
+        them as failed if it can't be. Returns whether it was updated.
+        '''
+        if not get_delivery(self.bot).is_available(channel_id):
+            return False
+        try:
+            await self.update_board(channel_id, board, pending)
+        except DELIVERY_ERRORS as error:
+            get_delivery(self.bot).record_failure(channel_id)
+            self.record_failures(pending.values(), error)
+            return False
+        logger.info(
+            'Status board updated in %d for %d games',
+            channel_id,
+            len(pending)
+        )
+        return True
+
+    async def update_board(
+        self,
+        channel_id: int,
+        board: int,
+        pending: Dict[int, Row[Tuple]]
+    ):
+        '''
+        Edits a channel's status board, pings linked players whose turn it is
+        in the given pending notifications' games, and marks the notifications
+        as sent.
+
+        If the board's message was deleted, a new one is posted in its place.
+        '''
+        games = board_messaging.get_board_games(channel_id)
+        embed = board_messaging.get_board_embed(games)
+        channel = await get_delivery(self.bot).get_channel(channel_id)
+        try:
+            await channel.get_partial_message(board).edit(embed=embed)
+        except NotFound:
+            message = await board_messaging.post_board(channel, embed)
+            with get_session() as session:
+                session.execute(
+                    update(WebhookURL)
+                    .where(WebhookURL.channelid == channel_id)
+                    .values(statusboard=message.id)
+                )
+                session.commit()
+        for content in board_messaging.get_ping_contents(
+            game for game in games if game.id in pending
+        ):
+            await get_delivery(self.bot).send(channel_id, content=content)
+        now = datetime.now()
+        with get_session() as session:
+            session.execute(
+                update(TurnNotification)
+                .where(
+                    tuple_(
+                        TurnNotification.gameid,
+                        TurnNotification.turn,
+                        TurnNotification.playerid
+                    ).in_([
+                        (
+                            notification.gameid,
+                            notification.turn,
+                            notification.playerid
+                        )
+                        for notification in pending.values()
+                    ])
+                )
+                .values(lastnotified=now, attempts=0, nextattempt=None)
+            )
+            for game in session.scalars(
+                select(Game).where(Game.id.in_(pending))
+            ):
+                game.nextremind = now + timedelta(seconds=game.remindinterval)
+            session.commit()
+
+    async def dispatch(self, notification: Row[Tuple]) -> bool:
+        '''
+        Sends a notification, recording it as failed instead if it can't be
+        sent. Returns whether it was sent.
+        '''
+        if not get_delivery(self.bot).is_available(notification.channelid):
+            # The channel's breaker opened earlier in this round.
+            return False
+        try:
             await self.send_notification(self.bot, notification)
-            logger.info(
-                (
-                    'Reminder sent for %s (turn %d, last ping: %s, last '
-                    'logged notification: %s)'
-                ),
-                notification.gameid,
-                notification.turn,
-                notification.lastnotified.strftime('%m/%%d/%Y, %H:%M:%S'),
-                notification.logtime.strftime('%m/%%d/%Y, %H:%M:%S')
+        except DELIVERY_ERRORS as error:
+            self.record_failures([notification], error)
+            return False
+        return True
+
+    @staticmethod
+    def record_failures(
+        notifications: Iterable[Row[Tuple]],
+        error: Exception
+    ):
+        '''
+        Records that the given notifications failed to send; they're retried
+        after NOTIFY_RETRY_DELAY seconds, doubling with each failure in a row,
+        and given up on after NOTIFY_MAX_ATTEMPTS.
+        '''
+        now = datetime.now()
+        with get_session() as session:
+            for notification in notifications:
+                attempts = notification.attempts + 1
+                values = {
+                    'attempts': attempts,
+                    'nextattempt': now + timedelta(
+                        seconds=config.NOTIFY_RETRY_DELAY * 2 ** (attempts - 1)
+                    )
+                }
+                if attempts >= config.NOTIFY_MAX_ATTEMPTS:
+                    values['deadlettered'] = now
+                    logger.warning(
+                        ('Giving up on the notification for %d (turn %d) in '
+                         '%d after %d failed attempts: %s'),
+                        notification.gameid,
+                        notification.turn,
+                        notification.channelid,
+                        attempts,
+                        error
+                    )
+                else:
+                    logger.info(
+                        ('Notification for %d (turn %d) in %d failed: %s; '
+                         'retrying at %s'),
+                        notification.gameid,
+                        notification.turn,
+                        notification.channelid,
+                        error,
+                        values['nextattempt']
+                    )
+                session.execute(
+                    update(TurnNotification)
+                    .where(TurnNotification.turn == notification.turn)
+                    .where(TurnNotification.slug == notification.slug)
+                    .where(TurnNotification.playerid == notification.playerid)
+                    .where(TurnNotification.gameid == notification.gameid)
+                    .values(**values)
+                )
+            session.commit()
+
+    @staticmethod
+    def skip_superseded(session: Session, games: Set[int], now: datetime):
+        '''
+        Marks every unpinged TurnNotification in the given games that has a
+        newer one as skipped, in one statement.
+        '''
+        newer = aliased(TurnNotification)
+        session.execute(
+            update(TurnNotification)
+            .where(TurnNotification.gameid.in_(games))
+            .where(TurnNotification.lastnotified == None)
+            .where(TurnNotification.skipped == None)
+            .where(
+                exists()
+                .where(newer.gameid == TurnNotification.gameid)
+                .where(newer.logtime > TurnNotification.logtime)
             )
+            .values(skipped=now)
+        )
 
     @staticmethod
     async def send_notification(bot: commands.Bot, notification: Row[Tuple]):
@@ -124,67 +523,106 @@ class Notify(commands.Cog):
         The input Row[Tuple] expects all fields from TurnNotification, plus the
         channelid from its linked WebhookURL.
         '''
-        channel = await bot.fetch_channel(notification.channelid)
         # Directly load the object and update.
         now = datetime.now()
         with get_session() as session:
             to_modify = session.scalar(
                 select(TurnNotification)
+                .options(*NOTIFICATION)
                 .where(TurnNotification.turn == notification.turn)
                 .where(TurnNotification.slug == notification.slug)
                 .where(TurnNotification.playerid == notification.playerid)
                 .where(TurnNotification.gameid == notification.gameid)
             )
-            await channel.send(
+            await get_delivery(bot).send(
+                notification.channelid,
                 content=notify_messaging.get_content(to_modify),
                 embed=notify_messaging.get_embed(to_modify),
                 view=notify_messaging.get_view(to_modify)
             )
             to_modify.lastnotified = now
+            to_modify.attempts = 0
+            to_modify.nextattempt = None
             to_modify.game.nextremind = (
                 now + timedelta(seconds=to_modify.game.remindinterval)
             )
             session.commit()
 
-    @tasks.loop(seconds=config.NOTIFY_INTERVAL)
-    async def notify_duplicates(self):
+    def queue_duplicates(
+        self,
+        queue: NotificationQueue,
+        unavailable: List[int]
+    ):
         '''
-        Sends a round of duplicate game notifications.
+        Queues warnings for games that got a notification that looked like a
+        duplicate.
         '''
         with get_session() as session:
-            for game in session.scalars(
-                select(Game)
+            games = session.execute(
+                select(Game.id, Game.name, WebhookURL.channelid)
+                .join(Game.webhookurl)
                 .where(Game.duplicatewarned == False)
+                .where(WebhookURL.channelid.not_in(unavailable))
+                .where(channel_share())
+                .order_by(self.fair_order(Game.id))
                 .limit(config.NOTIFY_LIMIT)
-            ):
-                channel = await self.bot.fetch_channel(
-                    game.webhookurl.channelid
+            ).all()
+        for game in games:
+            queue.put(Job(
+                Priority.DUPLICATE,
+                game.channelid,
+                (Priority.DUPLICATE, game.id),
+                partial(self.send_duplicate, game)
+            ))
+
+    async def send_duplicate(self, game: Row[Tuple[int, str, int]]) -> bool:
+        '''
+        Sends a duplicate game warning. Returns whether it's done with; a
+        warning that fails to send is retried next round, unless the channel
+        is gone or the bot can't post there, in which case it's given up on.
+        '''
+        if not get_delivery(self.bot).is_available(game.channelid):
+            # The channel's breaker opened earlier in this round.
+            return False
+        try:
+            await get_delivery(self.bot).send(
+                game.channelid,
+                content=(
+                    '**NOTICE**: I got a notification about a game in this '
+                    f'channel (**{game.name}**) that appears to be a '
+                    'duplicate, since its current turn is lower than the one '
+                    'I was already tracking. If you want to start a new game '
+                    "with the same name in this channel, and you don't want "
+                    "to wait for me to automatically remove the existing "
+                    "one, you'll need to manually remove it first using "
+                    f'`/{config.COMMAND_PREFIX}tracking delete`.'
                 )
-                if channel:
-                    await channel.send(
-                        content=(
-                            '**NOTICE**: I got a notification about a game in '
-                            f'this channel (**{game.name}**) that appears to '
-                            'be a duplicate, since its current turn is lower '
-                            'than the one I was already tracking. If you want '
-                            'to start a new game with the same name in this '
-                            "channel, and you don't want to wait for me to "
-                            "automatically remove the existing one, you'll "
-                            "need to manually remove it first using "
-                            f'`/{config.COMMAND_PREFIX}tracking delete`.'
-                        )
-                    )
-                else:
-                    logger.error(
-                        (
-                            'Tried to send a duplicate warning to %s for game '
-                            '%s, but the channel could not be found'
-                        ),
-                        game.webhookurl.channelid,
-                        game.name
-                    )
-                game.duplicatewarned = True
+            )
+        except (Forbidden, NotFound) as error:
+            logger.error(
+                (
+                    'Tried to send a duplicate warning to %s for game %s, but '
+                    'the channel could not be posted in: %s'
+                ),
+                game.channelid,
+                game.name,
+                error
+            )
+        except DELIVERY_ERRORS as error:
+            logger.warning(
+                'Duplicate warning for %s failed; will retry: %s',
+                game.name,
+                error
+            )
+            return False
+        with get_session() as session:
+            session.execute(
+                update(Game)
+                .where(Game.id == game.id)
+                .values(duplicatewarned=True)
+            )
             session.commit()
+        return True
 
 
 def setup(bot: commands.Bot):
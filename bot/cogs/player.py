@@ -6,12 +6,14 @@ from discord import ApplicationContext, SlashCommandOptionType, User
 from discord.commands import SlashCommandGroup, option
 from discord.ext.commands import Cog, Bot
 from bot import permissions
+from bot.converters import PlayerConverter
 from bot.messaging import player as player_messaging
 from database.autocomplete import (
     get_linked_players_for_channel,
     get_unlinked_players_for_channel
 )
 from database.connect import get_session
+from database.replica import mark_written
 from database.models import Player
 from utils import config
 
@@ -38,7 +40,7 @@ class PlayerCommands(Cog, name=NAME, description=DESCRIPTION):
     @players.command(description='Link a player to a user')
     @option(
         'player',
-        input_type=Player,
+        type=PlayerConverter,
         description='The player to link',
         required=True,
         autocomplete=get_unlinked_players_for_channel
@@ -58,6 +60,7 @@ class PlayerCommands(Cog, name=NAME, description=DESCRIPTION):
             session.add(player)
             player.discordid = user.id
             session.commit()
+            mark_written()
             await ctx.respond(
                 content=(
                     f'**{user.display_name}** has been linked to player '
@@ -69,7 +72,7 @@ class PlayerCommands(Cog, name=NAME, description=DESCRIPTION):
     @players.command(description="Remove a player's link to a user")
     @option(
         'player',
-        input_type=Player,
+        type=PlayerConverter,
         description='The player to unlink',
         required=True,
         autocomplete=get_linked_players_for_channel
@@ -83,6 +86,7 @@ class PlayerCommands(Cog, name=NAME, description=DESCRIPTION):
             old_user = player.discordid
             player.discordid = None
             session.commit()
+            mark_written()
             if old_user:
                 user = await ctx.bot.fetch_user(old_user)
                 await ctx.respond(
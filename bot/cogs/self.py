@@ -9,6 +9,7 @@ from discord import ApplicationContext
 from discord.commands import SlashCommandGroup, option
 from discord.ext.commands import Bot, Cog
 from bot import permissions
+from bot.converters import PlayerConverter
 from bot.messaging import player as player_messaging
 from database.autocomplete import (
     get_self_linked_players_for_channel,
@@ -16,6 +17,7 @@ from database.autocomplete import (
 )
 from database.models import Player
 from database.connect import get_session
+from database.replica import mark_written
 from utils import config
 
 
@@ -40,7 +42,7 @@ class SelfCommands(Cog, name=NAME, description=DESCRIPTION):
     @selfcommands.command(description='Link yourself to a player')
     @option(
         'player',
-        input_type=Player,
+        type=PlayerConverter,
         description='The player to link yourself to',
         required=True,
         autocomplete=get_unlinked_players_for_channel
@@ -53,6 +55,7 @@ class SelfCommands(Cog, name=NAME, description=DESCRIPTION):
             session.add(player)
             player.discordid = ctx.user.id
             session.commit()
+            mark_written()
             await ctx.respond(
                 content=(
                     f"You've been linked to **{player.name}** and will be "
@@ -64,7 +67,7 @@ class SelfCommands(Cog, name=NAME, description=DESCRIPTION):
     @selfcommands.command(description="Remove a player's link to you")
     @option(
         'player',
-        input_type=Player,
+        type=PlayerConverter,
         description='The player to unlink yourself from',
         required=True,
         autocomplete=get_self_linked_players_for_channel
@@ -79,6 +82,7 @@ class SelfCommands(Cog, name=NAME, description=DESCRIPTION):
             session.add(player)
             player.discordid = None
             session.commit()
+            mark_written()
             await ctx.respond(
                 content=(
                     'You have removed the link between yourself and '
@@ -5,8 +5,10 @@ CivvieBot cog to handle commands dealing with Webhook URLs.
 from discord import ApplicationContext, Embed
 from discord.commands import SlashCommandGroup, option
 from discord.ext.commands import Cog, Bot
+from sqlalchemy import func, select
 from bot import permissions
 from database.connect import get_session
+from database.models import Game
 from database.utils import get_url_for_channel
 from utils import config
 
@@ -47,13 +49,18 @@ class WebhookURLCommands(Cog, name=NAME, description=DESCRIPTION):
         Responds with an embed containing webhook URL information.
         '''
         with get_session() as session:
-            url = get_url_for_channel(ctx.channel_id)
+            url = get_url_for_channel(ctx.channel_id, ctx.guild_id)
             session.add(url)
             content = ''
             embed = Embed(title=f'Webhook URL for {ctx.channel.name}')
             embed.add_field(name='URL', value=url.full_url)
-            if url.games:
-                embed.add_field(name='Games tracked', value=len(url.games))
+            games = session.scalar(
+                select(func.count())
+                .select_from(Game)
+                .where(Game.slug == url.slug)
+            )
+            if games:
+                embed.add_field(name='Games tracked', value=games)
                 embed.set_footer(
                     text=(
                         'For usage instructions, use "/'
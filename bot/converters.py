@@ -0,0 +1,54 @@
+'''
+Converters that turn slash command options into database models.
+
+These live on the bot side so that the models themselves (and the API that
+uses them) don't need to import py-cord.
+'''
+
+from typing import Type
+from discord import ApplicationContext
+from discord.ext.commands import Converter
+from sqlalchemy import select
+from sqlalchemy.exc import NoResultFound
+from database.connect import get_session
+from database.loading import joined_url
+from database.models import Game, NamedConvertable, Player, WebhookURL
+
+
+class NamedModelConverter(Converter):
+    '''
+    Converts an option to the model with that name in the context's channel.
+    '''
+    model: Type[NamedConvertable] = None
+
+    async def convert(self, ctx: ApplicationContext, argument: str):
+        '''
+        Converts the given string to the appropriate resource, with its
+        webhookurl loaded.
+        '''
+        with get_session() as session:
+            scalar = session.scalar(
+                select(self.model)
+                .join(self.model.webhookurl)
+                .options(joined_url(self.model))
+                .where(self.model.name == argument)
+                .where(WebhookURL.channelid == ctx.channel_id)
+            )
+        if not scalar:
+            raise NoResultFound(
+                'Failed to find the given resource in the database.')
+        return scalar
+
+
+class GameConverter(NamedModelConverter):
+    '''
+    Converts an option to a Game in the context's channel.
+    '''
+    model = Game
+
+
+class PlayerConverter(NamedModelConverter):
+    '''
+    Converts an option to a Player in the context's channel.
+    '''
+    model = Player
@@ -0,0 +1,303 @@
+'''
+How turn notifications get to their channels.
+
+By default they're sent as the bot user, which shares the bot's global rate
+limit and each channel's rate limit with command responses. With
+NOTIFY_VIA_WEBHOOKS enabled, CivvieBot instead creates a Discord webhook in
+each channel it notifies (stored on the channel's WebhookURL) and posts
+through that. Webhook requests go out on their own HTTP session and are rate
+limited per webhook, so notifications for busy servers don't hold up
+commands; channels CivvieBot can't create a webhook in still get
+notifications as the bot user, and making one is tried again every
+NOTIFY_BREAKER_COOLDOWN seconds.
+
+Either way, each channel has a circuit breaker. After NOTIFY_BREAKER_THRESHOLD
+sends to a channel fail in a row, it's considered unavailable for
+NOTIFY_BREAKER_COOLDOWN seconds, and senders are expected to skip it until
+then, rather than spending requests (and holding up other channels) on it.
+One send is let through after the cooldown; if it fails, the channel is
+unavailable for another cooldown.
+'''
+
+import logging
+from functools import lru_cache
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+from aiohttp import ClientError, ClientSession
+from discord import ChannelType, Message, Object, Thread, Webhook
+from discord.abc import GuildChannel
+from discord.errors import Forbidden, HTTPException, NotFound
+from discord.ext.commands import Bot
+from discord.utils import MISSING
+from sqlalchemy import select, update
+from database.connect import get_session
+from database.models import WebhookURL
+from utils import config
+
+
+logger = logging.getLogger(f'civviebot.{__name__}')
+
+
+WEBHOOK_NAME = 'CivvieBot'
+# What a send that didn't make it to Discord can raise; anything else is a
+# bug, rather than a problem with the channel.
+DELIVERY_ERRORS = (HTTPException, ClientError, TimeoutError)
+THREAD_TYPES = (
+    ChannelType.news_thread,
+    ChannelType.public_thread,
+    ChannelType.private_thread
+)
+
+
+class ChannelDelivery:
+    '''
+    Sends messages to channels as the bot user.
+    '''
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        # Sends that have failed in a row, and when the breaker closes again,
+        # by channel.
+        self._failures: Dict[int, int] = {}
+        self._unavailable: Dict[int, float] = {}
+
+    def is_available(self, channel_id: int) -> bool:
+        '''
+        Whether a channel's circuit breaker is letting sends through.
+        '''
+        return monotonic() >= self._unavailable.get(channel_id, 0)
+
+    def get_unavailable(self) -> List[int]:
+        '''
+        Gets the channels whose circuit breakers are currently open.
+        '''
+        now = monotonic()
+        return [
+            channel_id
+            for channel_id, until in self._unavailable.items()
+            if until > now
+        ]
+
+    def record_success(self, channel_id: int):
+        '''
+        Closes a channel's circuit breaker.
+        '''
+        self._failures.pop(channel_id, None)
+        self._unavailable.pop(channel_id, None)
+
+    def record_failure(self, channel_id: int):
+        '''
+        Counts a failed send to a channel, opening its circuit breaker if
+        enough have failed in a row.
+        '''
+        failures = self._failures.get(channel_id, 0) + 1
+        self._failures[channel_id] = failures
+        if failures >= config.NOTIFY_BREAKER_THRESHOLD:
+            logger.warning(
+                '%d sends to %d have failed in a row; skipping it for %ds',
+                failures,
+                channel_id,
+                config.NOTIFY_BREAKER_COOLDOWN
+            )
+            self._unavailable[channel_id] = (
+                monotonic() + config.NOTIFY_BREAKER_COOLDOWN
+            )
+
+    async def get_channel(self, channel_id: int) -> GuildChannel:
+        '''
+        Gets a channel, from the cache if it's there.
+        '''
+        return (
+            self.bot.get_channel(channel_id)
+            or await self.bot.fetch_channel(channel_id)
+        )
+
+    async def send(self, channel_id: int, **kwargs) -> Message:
+        '''
+        Sends a message to a channel, taking the same arguments as
+        Messageable.send(), and updates the channel's circuit breaker.
+        '''
+        try:
+            message = await self.deliver(channel_id, **kwargs)
+        except DELIVERY_ERRORS:
+            self.record_failure(channel_id)
+            raise
+        self.record_success(channel_id)
+        return message
+
+    async def deliver(self, channel_id: int, **kwargs) -> Message:
+        '''
+        Sends a message to a channel as the bot user.
+
+        Channels that aren't cached (which is all of them, without a gateway
+        connection) are sent to by ID, rather than fetched first.
+        '''
+        channel = (
+            self.bot.get_channel(channel_id)
+            or self.bot.get_partial_messageable(channel_id)
+        )
+        return await channel.send(**kwargs)
+
+    async def close(self):
+        '''
+        Releases anything held for sending.
+        '''
+
+
+class WebhookDelivery(ChannelDelivery):
+    '''
+    Sends messages to channels through a webhook in each.
+    '''
+
+    def __init__(self, bot: Bot):
+        super().__init__(bot)
+        self.session: ClientSession = None
+        # Each channel's webhook and whether the channel is a thread of the
+        # webhook's channel.
+        self._webhooks: Dict[int, Tuple[Webhook, bool]] = {}
+        # When to try making a webhook again, for channels where one couldn't
+        # be made.
+        self._retry_webhook: Dict[int, float] = {}
+
+    def make_webhook(self, webhook_id: int, token: str) -> Webhook:
+        '''
+        Makes a webhook to send through on this delivery's session.
+
+        Webhooks get the bot's connection state so that messages sent through
+        them can have views.
+        '''
+        if self.session is None:
+            self.session = ClientSession()
+        # pylint: disable=protected-access
+        return Webhook(
+            {'id': webhook_id, 'type': 1, 'token': token},
+            session=self.session,
+            state=self.bot._connection
+        )
+
+    async def get_webhook(
+        self,
+        channel_id: int
+    ) -> Optional[Tuple[Webhook, bool]]:
+        '''
+        Gets the webhook for a channel, creating it if there isn't one yet,
+        and whether the channel is a thread.
+        '''
+        if channel_id in self._webhooks:
+            return self._webhooks[channel_id]
+        if monotonic() < self._retry_webhook.get(channel_id, 0):
+            return None
+        with get_session() as session:
+            stored = session.execute(
+                select(
+                    WebhookURL.channelwebhookid,
+                    WebhookURL.channelwebhooktoken
+                )
+                .where(WebhookURL.channelid == channel_id)
+            ).first()
+        channel = self.bot.get_channel(channel_id)
+        if channel is not None:
+            is_thread = isinstance(channel, Thread)
+            parent_id = channel.parent_id if is_thread else channel_id
+        else:
+            # Without a gateway connection, nothing is cached, and py-cord
+            # can't build a fetched thread without its guild, so this works
+            # from the channel's raw data instead.
+            data = await self.bot.http.get_channel(channel_id)
+            is_thread = ChannelType(data['type']) in THREAD_TYPES
+            parent_id = int(data['parent_id']) if is_thread else channel_id
+        if stored and stored.channelwebhookid:
+            webhook = self.make_webhook(
+                stored.channelwebhookid,
+                stored.channelwebhooktoken
+            )
+        else:
+            # A thread whose parent is gone can't be sent to either; creating
+            # the webhook raises NotFound, a delivery error, for it.
+            try:
+                created = await self.bot.http.create_webhook(
+                    parent_id,
+                    name=WEBHOOK_NAME,
+                    reason='Sending CivvieBot turn notifications'
+                )
+            except Forbidden:
+                logger.info(
+                    ('Missing permission to create a webhook for %d; sending '
+                     'notifications there as the bot user for the next %ds'),
+                    channel_id,
+                    config.NOTIFY_BREAKER_COOLDOWN
+                )
+                # The permission may be granted later.
+                self._retry_webhook[channel_id] = (
+                    monotonic() + config.NOTIFY_BREAKER_COOLDOWN
+                )
+                return None
+            else:
+                self.store_webhook(
+                    channel_id,
+                    int(created['id']),
+                    created['token']
+                )
+                webhook = self.make_webhook(
+                    int(created['id']),
+                    created['token']
+                )
+        self._retry_webhook.pop(channel_id, None)
+        self._webhooks[channel_id] = (webhook, is_thread)
+        return self._webhooks[channel_id]
+
+    @staticmethod
+    def store_webhook(channel_id: int, webhook_id: int, token: str):
+        '''
+        Stores (or, given None, clears) a channel's webhook on its WebhookURL.
+        '''
+        with get_session() as session:
+            session.execute(
+                update(WebhookURL)
+                .where(WebhookURL.channelid == channel_id)
+                .values(
+                    channelwebhookid=webhook_id,
+                    channelwebhooktoken=token
+                )
+            )
+            session.commit()
+
+    async def deliver(self, channel_id: int, **kwargs) -> Message:
+        '''
+        Sends a message to a channel through its webhook, or as the bot user
+        if it doesn't have one.
+        '''
+        found = await self.get_webhook(channel_id)
+        if not found:
+            return await super().deliver(channel_id, **kwargs)
+        webhook, is_thread = found
+        try:
+            return await webhook.send(
+                username=self.bot.user.name,
+                avatar_url=self.bot.user.display_avatar.url,
+                thread=Object(channel_id) if is_thread else MISSING,
+                wait=True,
+                **kwargs
+            )
+        except NotFound:
+            # Someone deleted the webhook; a new one is made next time.
+            logger.info('Webhook for %d was deleted', channel_id)
+            del self._webhooks[channel_id]
+            self.store_webhook(channel_id, None, None)
+            return await super().deliver(channel_id, **kwargs)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+@lru_cache(maxsize=None)
+def get_delivery(bot: Bot) -> ChannelDelivery:
+    '''
+    Gets how the given bot should send notifications, per the configured
+    NOTIFY_VIA_WEBHOOKS.
+    '''
+    if config.NOTIFY_VIA_WEBHOOKS:
+        return WebhookDelivery(bot)
+    return ChannelDelivery(bot)
@@ -0,0 +1,552 @@
+'''
+A local stand-in for Discord, for running the bot without a connection.
+
+FakeDiscord takes the place of the aiohttp session py-cord makes its HTTP
+requests (and interaction responses) through, so the library's own request,
+retry and rate limit handling still runs. Every request is recorded, and
+latency and 429 responses can be injected. Guilds and channels are added to
+the bot's cache the way the gateway would add them, and slash commands can be
+invoked, and buttons on the bot's messages pressed, with fake interactions.
+
+This is meant for benchmarks and end-to-end checks, and shouldn't be used
+with a bot that's connected to Discord.
+'''
+
+import asyncio
+import json
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from itertools import count
+from time import perf_counter
+from typing import Any, Dict, Iterable, List, Tuple
+from discord import ApplicationCommand, Bot, Guild, Interaction
+from aiohttp import FormData
+from discord.user import ClientUser
+from multidict import CIMultiDict
+from bot.delivery import WebhookDelivery, get_delivery
+
+
+# Fake snowflakes are handed out from here up.
+SNOWFLAKE_BASE = 900000000000000000
+# Permissions the fake bot and users have; everything short of administrator.
+ALL_PERMISSIONS = str((1 << 41) - 1 & ~(1 << 3))
+
+
+@dataclass
+class Call:
+    '''
+    A request made to the fake Discord API.
+    '''
+    method: str
+    path: str
+    payload: Any
+    status: int
+    # When the request was made, by perf_counter().
+    time: float = field(default_factory=perf_counter)
+
+
+def get_payload(data: Any) -> Any:
+    '''
+    Gets the JSON payload from the data of a request; either the data itself,
+    or the payload_json field of a multipart form.
+    '''
+    if isinstance(data, FormData):
+        # pylint: disable=protected-access
+        for type_options, _, value in data._fields:
+            if type_options.get('name') == 'payload_json':
+                return json.loads(value)
+        return None
+    if isinstance(data, (str, bytes)):
+        return json.loads(data)
+    return data
+
+
+def get_option_type(value: Any) -> int:
+    '''
+    Gets the Discord application command option type for an option value;
+    users are given as made by FakeDiscord.make_user().
+    '''
+    if isinstance(value, dict):
+        return 6
+    if isinstance(value, bool):
+        return 5
+    if isinstance(value, int):
+        return 4
+    if isinstance(value, float):
+        return 10
+    return 3
+
+
+class FakeResponse:
+    '''
+    Enough of an aiohttp.ClientResponse for py-cord.
+    '''
+
+    def __init__(self, status: int, body: Any = None, latency: float = 0):
+        self.status = status
+        self.reason = 'Fake'
+        self._text = '' if body is None else json.dumps(body)
+        self.headers = CIMultiDict(
+            {} if body is None else {'Content-Type': 'application/json'}
+        )
+        if status == 429:
+            # py-cord assumes a 429 without this came from Cloudflare, not
+            # Discord.
+            self.headers['Via'] = '1.1 google'
+        self._latency = latency
+
+    async def text(self, encoding: str = 'utf-8') -> str:
+        '''
+        Gets the body of the response.
+        '''
+        del encoding
+        return self._text
+
+    async def __aenter__(self):
+        # Even without latency, a real request would yield to the event loop.
+        await asyncio.sleep(self._latency)
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakeDiscord:
+    '''
+    Stands in for the Discord API for a py-cord Bot.
+
+    latency is added to every request, and every rate_limit_every'th request
+    gets a 429 asking to retry after retry_after seconds.
+    '''
+    closed = False
+
+    def __init__(
+        self,
+        bot: Bot,
+        latency: float = 0,
+        rate_limit_every: int = 0,
+        retry_after: float = 0.01
+    ):
+        self.bot = bot
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.calls: List[Call] = []
+        self.channels: Dict[int, dict] = {}
+        self.users: Dict[int, dict] = {}
+        # Messages posted to channels, by ID.
+        self.messages: Dict[int, dict] = {}
+        # Channels of the webhooks the bot has created, by webhook ID.
+        self.webhooks: Dict[int, int] = {}
+        self._snowflakes = count(SNOWFLAKE_BASE)
+        self._requests = 0
+        self._routes = [
+            ('GET', re.compile(r'/users/@me'), self._get_me),
+            ('GET', re.compile(r'/users/(\d+)'), self._get_user),
+            ('GET', re.compile(r'/channels/(\d+)'), self._get_channel),
+            (
+                'POST',
+                re.compile(r'/channels/(\d+)/messages'),
+                self._post_message
+            ),
+            (
+                'PATCH',
+                re.compile(r'/channels/(\d+)/messages/(\d+)'),
+                self._edit_message
+            ),
+            (
+                'DELETE',
+                re.compile(r'/channels/(\d+)/messages/(\d+)'),
+                self._delete_message
+            ),
+            (
+                'POST',
+                re.compile(r'/channels/(\d+)/webhooks'),
+                self._create_webhook
+            ),
+            (
+                'PUT',
+                re.compile(r'/channels/(\d+)/pins/(\d+)'),
+                lambda payload, channel_id, message_id: (204, None)
+            ),
+            (
+                'POST',
+                re.compile(r'/interactions/\d+/[^/]+/callback'),
+                lambda payload: (204, None)
+            ),
+            (
+                None,
+                re.compile(r'/webhooks/(\d+)/[^/]+(/messages/[^/]+)?'),
+                self._webhook_message
+            )
+        ]
+        self.user = self.make_user('CivvieBot', bot=True)
+        self._install()
+
+    def snowflake(self) -> int:
+        '''
+        Gets a new fake snowflake.
+        '''
+        return next(self._snowflakes)
+
+    def _install(self):
+        '''
+        Puts this in place of the bot's HTTP session and logs the bot in.
+        '''
+        # pylint: disable=protected-access
+        self.bot.http._HTTPClient__session = self
+        self.bot.http.token = 'fake'
+        state = self.bot._connection
+        state.user = ClientUser(state=state, data=self.user)
+        state.application_id = int(self.user['id'])
+        # Commands are given their IDs when they're synced with Discord.
+        for command in self.bot.pending_application_commands:
+            command.id = self.snowflake()
+            self.bot._application_commands[command.id] = command
+        # Notifications sent through channel webhooks have their own session.
+        delivery = get_delivery(self.bot)
+        if isinstance(delivery, WebhookDelivery):
+            delivery.session = self
+
+    def make_user(self, name: str, bot: bool = False) -> dict:
+        '''
+        Makes a user that can be fetched.
+        '''
+        user = {
+            'id': str(self.snowflake()),
+            'username': name,
+            'discriminator': '0001',
+            'avatar': None,
+            'bot': bot
+        }
+        self.users[int(user['id'])] = user
+        return user
+
+    def add_guild(
+        self,
+        channel_count: int,
+        members: Iterable[dict] = ()
+    ) -> Guild:
+        '''
+        Adds a guild with some text channels and members to the bot's cache,
+        as if it had been received over the gateway.
+        '''
+        # pylint: disable=protected-access
+        guild_id = str(self.snowflake())
+        channels = []
+        for position in range(channel_count):
+            channel = {
+                'id': str(self.snowflake()),
+                'type': 0,
+                'guild_id': guild_id,
+                'name': f'channel-{position}',
+                'position': position,
+                'permission_overwrites': []
+            }
+            self.channels[int(channel['id'])] = channel
+            channels.append(channel)
+        guild = Guild(
+            state=self.bot._connection,
+            data={
+                'id': guild_id,
+                'name': f'Guild {guild_id}',
+                'owner_id': self.user['id'],
+                'member_count': 0,
+                'roles': [{
+                    'id': guild_id,
+                    'name': '@everyone',
+                    'permissions': ALL_PERMISSIONS,
+                    'position': 0,
+                    'color': 0,
+                    'hoist': False,
+                    'managed': False,
+                    'mentionable': False
+                }],
+                'channels': channels,
+                'threads': [],
+                'members': [
+                    {'user': user, 'roles': [], 'joined_at': None}
+                    for user in [self.user, *members]
+                ]
+            }
+        )
+        self.bot._connection._add_guild(guild)
+        return guild
+
+    def remove_channel(self, channel_id: int):
+        '''
+        Makes a channel unknown to the fake API, as if it had been deleted.
+        '''
+        self.channels.pop(channel_id, None)
+
+    def message(self, channel_id: int, payload: dict) -> dict:
+        '''
+        Makes a message as Discord would return it.
+        '''
+        return {
+            'id': str(self.snowflake()),
+            'channel_id': str(channel_id),
+            'type': 0,
+            'author': self.user,
+            'content': payload.get('content') or '',
+            'embeds': payload.get('embeds') or [],
+            'components': payload.get('components') or [],
+            'attachments': [],
+            'mentions': [],
+            'mention_roles': [],
+            'mention_everyone': False,
+            'pinned': False,
+            'tts': False,
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'edited_timestamp': None
+        }
+
+    def _get_me(self, payload):
+        del payload
+        return 200, self.user
+
+    def _get_user(self, payload, user_id):
+        del payload
+        user = self.users.get(int(user_id))
+        if not user:
+            return 404, {'message': 'Unknown User', 'code': 10013}
+        return 200, user
+
+    def _get_channel(self, payload, channel_id):
+        del payload
+        channel = self.channels.get(int(channel_id))
+        if not channel:
+            return 404, {'message': 'Unknown Channel', 'code': 10003}
+        return 200, channel
+
+    def _post_message(self, payload, channel_id):
+        if int(channel_id) not in self.channels:
+            return 404, {'message': 'Unknown Channel', 'code': 10003}
+        message = self.message(int(channel_id), payload or {})
+        self.messages[int(message['id'])] = message
+        return 200, message
+
+    def _edit_message(self, payload, channel_id, message_id):
+        del channel_id
+        message = self.messages.get(int(message_id))
+        if not message:
+            return 404, {'message': 'Unknown Message', 'code': 10008}
+        message.update(payload or {})
+        return 200, message
+
+    def _delete_message(self, payload, channel_id, message_id):
+        del payload, channel_id
+        if not self.messages.pop(int(message_id), None):
+            return 404, {'message': 'Unknown Message', 'code': 10008}
+        return 204, None
+
+    def _create_webhook(self, payload, channel_id):
+        if int(channel_id) not in self.channels:
+            return 404, {'message': 'Unknown Channel', 'code': 10003}
+        webhook_id = self.snowflake()
+        self.webhooks[webhook_id] = int(channel_id)
+        return 200, {
+            'id': str(webhook_id),
+            'type': 1,
+            'channel_id': channel_id,
+            'name': (payload or {}).get('name'),
+            'avatar': None,
+            'token': f'webhook-token-{self.snowflake()}',
+            'user': self.user
+        }
+
+    def _webhook_message(self, payload, webhook_id, message=None):
+        channel_id = self.webhooks.get(int(webhook_id), 0)
+        if message or not channel_id:
+            # An interaction response, or a followup to one.
+            return 200, self.message(0, payload or {})
+        message = self.message(channel_id, payload or {})
+        self.messages[int(message['id'])] = message
+        return 200, message
+
+    def request(self, method: str, url: str, **kwargs) -> FakeResponse:
+        '''
+        Handles a request as aiohttp.ClientSession.request() would.
+        '''
+        path = re.sub(r'^https?://[^/]+/api/v\d+', '', url).split('?')[0]
+        payload = get_payload(kwargs.get('data'))
+        self._requests += 1
+        if (
+            self.rate_limit_every
+            and self._requests % self.rate_limit_every == 0
+        ):
+            status, body = 429, {
+                'message': 'You are being rate limited.',
+                'retry_after': self.retry_after,
+                'global': False
+            }
+        else:
+            status, body = 404, {'message': 'Unknown route', 'code': 0}
+            for route_method, pattern, handler in self._routes:
+                match = pattern.fullmatch(path)
+                if match and route_method in (None, method):
+                    status, body = handler(
+                        payload,
+                        *[group for group in match.groups() if group]
+                    )
+                    break
+        self.calls.append(Call(method, path, payload, status))
+        return FakeResponse(status, body, self.latency)
+
+    async def close(self):
+        '''
+        Nothing to close.
+        '''
+
+    def get_calls(self, method: str, pattern: str) -> List[Call]:
+        '''
+        Gets the recorded calls with the given method to paths fully matching
+        the given pattern.
+        '''
+        compiled = re.compile(pattern)
+        return [
+            call for call in self.calls
+            if call.method == method and compiled.fullmatch(call.path)
+        ]
+
+    def find_command(self, name: str) -> Tuple[ApplicationCommand, str]:
+        '''
+        Finds a slash command by its qualified name; e.g., 'c6game info'.
+        Returns the top level command and the name of the subcommand, if any.
+        '''
+        parent, _, child = name.partition(' ')
+        for command in self.bot.pending_application_commands:
+            if command.name == parent:
+                return command, child
+        raise KeyError(name)
+
+    async def invoke(
+        self,
+        name: str,
+        channel_id: int,
+        user: dict,
+        /,
+        **options
+    ) -> Tuple[Interaction, float]:
+        '''
+        Invokes a slash command as the given user in the given channel, the
+        way an INTERACTION_CREATE from the gateway would. Returns the
+        interaction and how long the command took, in seconds.
+        '''
+        command, subcommand = self.find_command(name)
+        options_data = [
+            {
+                'name': key,
+                'type': get_option_type(value),
+                'value': value['id'] if isinstance(value, dict) else value
+            }
+            for key, value in options.items()
+        ]
+        if subcommand:
+            options_data = [
+                {'name': subcommand, 'type': 1, 'options': options_data}
+            ]
+        interaction = self._interaction(2, channel_id, user, {
+            'id': str(command.id),
+            'name': command.name,
+            'type': 1,
+            'options': options_data,
+            'resolved': {
+                'users': {
+                    value['id']: value
+                    for value in options.values()
+                    if isinstance(value, dict)
+                }
+            }
+        })
+        start = perf_counter()
+        await self.bot.process_application_commands(interaction)
+        return interaction, perf_counter() - start
+
+    async def press(
+        self,
+        custom_id: str,
+        channel_id: int,
+        user: dict,
+        message: dict = None
+    ) -> Tuple[Interaction, float]:
+        '''
+        Presses the button with the given custom ID as the given user, on the
+        given message if it was posted to a channel (rather than sent as a
+        response to an interaction). Returns the interaction and how long the
+        button's callback took, in seconds.
+
+        Buttons the bot isn't tracking a view for are handed to its
+        on_interaction listeners, as they would be over the gateway.
+        '''
+        # pylint: disable=protected-access
+        interaction = self._interaction(
+            3,
+            channel_id,
+            user,
+            {'component_type': 2, 'custom_id': custom_id},
+            message
+        )
+        views = self.bot._connection._view_store._views
+        found = views.get(
+            (2, message and int(message['id']), custom_id)
+        ) or views.get((2, None, custom_id))
+        start = perf_counter()
+        if found:
+            view, item = found
+            item.refresh_state(interaction)
+            await view._scheduled_task(item, interaction)
+        else:
+            listeners = self.bot.extra_events.get('on_interaction', [])
+            if not listeners:
+                raise KeyError(custom_id)
+            for listener in listeners:
+                await listener(interaction)
+        return interaction, perf_counter() - start
+
+    def _interaction(
+        self,
+        interaction_type: int,
+        channel_id: int,
+        user: dict,
+        data: dict,
+        message: dict = None
+    ) -> Interaction:
+        '''
+        Makes an interaction by the given user in the given channel, the way
+        an INTERACTION_CREATE from the gateway would.
+        '''
+        channel = self.channels[channel_id]
+        payload = {
+            'id': str(self.snowflake()),
+            'type': interaction_type,
+            'application_id': self.user['id'],
+            'token': f'token-{self.snowflake()}',
+            'version': 1,
+            'channel_id': str(channel_id),
+            'guild_id': channel['guild_id'],
+            'member': {
+                'user': user,
+                'roles': [],
+                'joined_at': None,
+                'permissions': ALL_PERMISSIONS
+            },
+            'data': data
+        }
+        if message:
+            payload['message'] = message
+        # pylint: disable=protected-access
+        return Interaction(data=payload, state=self.bot._connection)
+
+
+def get_buttons(payload: dict) -> Dict[str, str]:
+    '''
+    Gets the custom IDs of the buttons in a message payload, by label.
+    '''
+    return {
+        component['label']: component['custom_id']
+        for row in payload.get('components') or []
+        for component in row['components']
+        if component.get('custom_id')
+    }
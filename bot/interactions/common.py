@@ -128,7 +128,8 @@ class GameAwareButton(Button):
 
     def __init__(self, game: Game, *args, **kwargs):
         '''
-        Constructor; sets the game_id, channel_id and bot.
+        Constructor; sets the game_id and channel_id. The game's webhookurl
+        must be loaded.
         '''
         self._game = game.id
         self._channel_id = game.webhookurl.channelid
@@ -10,11 +10,13 @@ from discord.ui import Button
 from discord.ext.commands import Bot
 from sqlalchemy import select
 from sqlalchemy.exc import NoResultFound
+from sqlalchemy.orm import selectinload
 from bot.cogs.cleanup import Cleanup
 from bot.interactions.common import ChannelAwareModal, GameAwareButton, View
 from bot.messaging import game as game_messaging
 from database.connect import get_session
 from database.models import Game, WebhookURL
+from database.replica import mark_written
 from database.utils import delete_game
 from utils.errors import base_error, handle_callback_errors
 from utils.string import get_display_name, expand_seconds
@@ -28,7 +30,7 @@ class ConfirmDeleteButton(GameAwareButton):
     Button that a user can click on to confirm deletion of a game.
     '''
 
-    def __init__(self, game: int, *args, **kwargs):
+    def __init__(self, game: Game, *args, **kwargs):
         '''
         Constructor; set the label.
         '''
@@ -41,6 +43,7 @@ class ConfirmDeleteButton(GameAwareButton):
         Callback; handles the actual deletion.
         '''
         delete_game(self.game)
+        mark_written()
         await interaction.response.send_message(
             content=(
                 f'I am no longer tracking **{self.game}**. Any turn '
@@ -108,6 +111,7 @@ class GameEditModal(ChannelAwareModal):
             )
             game.minturns = int(self.get_child_value('min_turns'))
             session.commit()
+            mark_written()
             if game.remindinterval:
                 response_embed.add_field(
                     name='Re-pings turns every:',
@@ -227,14 +231,26 @@ class MergeGamesButton(Button):
         with get_session() as session:
             session.add(self.merge_target)
             self.merge_source.slug = self.merge_target.slug
-            session.merge(self.merge_source)
-            session.delete(self.merge_source)
+            source = session.merge(
+                self.merge_source,
+                options=[
+                    selectinload(Game.players),
+                    selectinload(Game.turns),
+                    selectinload(Game.summaries),
+                    selectinload(Game.stats)
+                ]
+            )
+            # Deleting cascades to everything loaded above.
+            session.delete(source)
+            # Committing expires the target's webhookurl.
+            channel_id = self.merge_target.webhookurl.channelid
             session.commit()
+            mark_written()
             interaction.response.edit_message(
                 content=(
                     f'{self.merge_source.name} and existing data in this '
                     'channel has been merged with the existing game in '
-                    f'{self.merge_target.webhookurl.channelid}.'
+                    f'{channel_id}.'
                 ),
                 embed=await game_messaging.get_info_embed(
                     self.merge_target,
@@ -4,29 +4,39 @@ Interaction components to use with the 'notify' cog.
 
 import logging
 from random import choice
-from typing import Tuple
+from typing import Optional, Tuple
 from discord import ButtonStyle, Interaction
 from sqlalchemy import select
 from bot.interactions.common import GameAwareButton, View
-from database.models import Player, Game, WebhookURL
+from database.models import Player, Game, TurnNotification, WebhookURL
 from database.connect import get_session
+from database.replica import get_read_session, mark_written
+from database.loading import GAME_WITH_URL, joined_url
 from utils.string import get_display_name
 
 
 logger = logging.getLogger(f'civviebot.{__name__}')
 
 
+# Notification buttons' custom IDs start with these, followed by the game's ID
+# (and for player links, the player's), so that any CivvieBot process can
+# work out what a button was for.
+MUTE_PREFIX = 'mute:'
+PLAYER_LINK_PREFIX = 'link:'
+
+
 class MuteButton(GameAwareButton):
     '''
     Button for toggling a game as muted vs. unmuted.
     '''
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, game: Game, *args, **kwargs):
         '''
         Initialization so we can hold attributes about the game.
         '''
-        super().__init__(*args, **kwargs)
-        self.set_attributes_from_game()
+        kwargs['custom_id'] = f'{MUTE_PREFIX}{game.id}'
+        super().__init__(game, *args, **kwargs)
+        self.set_attributes_from_game(game.muted)
 
     muted = 'Notifications for this game have been muted.'
     unmuted = 'Notifications for this game have been unmuted.'
@@ -44,7 +54,7 @@ class MuteButton(GameAwareButton):
         of self.game.
         '''
         if muted is None:
-            with get_session() as session:
+            with get_read_session() as session:
                 muted = session.scalar(
                     select(Game.muted)
                     .join(Game.webhookurl)
@@ -74,14 +84,18 @@ class MuteButton(GameAwareButton):
             game = session.scalar(
                 select(Game)
                 .join(Game.webhookurl)
+                .options(joined_url(Game))
                 .where(WebhookURL.channelid == self.channel_id)
                 .where(Game.id == self.game)
             )
             game.muted = not game.muted
+            # Committing expires the game's webhookurl.
+            player_link = PlayerLinkButton(game)
             session.commit()
+            mark_written()
             self.set_attributes_from_game(game.muted)
             await interaction.response.edit_message(
-                view=View(PlayerLinkButton(game), self)
+                view=View(player_link, self)
             )
             await interaction.followup.send(
                 self.muted if game.muted else self.unmuted,
@@ -101,13 +115,24 @@ class PlayerLinkButton(GameAwareButton):
     Button for toggling the link between a player and a Discord ID.
     '''
 
-    def __init__(self, game: Game, *args, **kwargs):
+    def __init__(self, game: Game, player: Player = None, *args, **kwargs):
         '''
-        Initialization so we can hold the player.
+        Initialization so we can hold the player; by default, the player whose
+        turn it is in the game.
         '''
-        self._player = game.turns[0].player.id
+        if player is None:
+            with get_session() as session:
+                player = session.scalar(
+                    select(Player)
+                    .join(Player.turns)
+                    .where(TurnNotification.gameid == game.id)
+                    .order_by(TurnNotification.logtime.desc())
+                    .limit(1)
+                )
+        self._player = player.id
+        kwargs['custom_id'] = f'{PLAYER_LINK_PREFIX}{game.id}:{player.id}'
         super().__init__(game, *args, **kwargs)
-        self.set_attributes_from_player()
+        self.set_attributes_from_player(player.discordid)
 
     # When no link, pick an emoji from here.
     could_be_me = (
@@ -126,7 +151,8 @@ class PlayerLinkButton(GameAwareButton):
 
     def set_attributes_from_player(self, discordid: int = None):
         '''
-        Sets button attributes from properties in self.player.
+        Sets button attributes for self.player being linked to the given
+        Discord ID (or to nobody).
         '''
         for key, val in self.get_attributes_from_player(discordid):
             setattr(self, key, val)
@@ -136,17 +162,9 @@ class PlayerLinkButton(GameAwareButton):
         discordid: int = None
     ) -> Tuple[Tuple[str, str]]:
         '''
-        Returns an appropriate set of button attributes for the current
-        value of self.player.
+        Returns an appropriate set of button attributes for self.player being
+        linked to the given Discord ID (or to nobody).
         '''
-        if not discordid:
-            with get_session() as session:
-                discordid = session.scalar(
-                    select(Player.discordid)
-                    .join(Player.webhookurl)
-                    .where(Player.id == self.player)
-                    .where(WebhookURL.channelid == self.channel_id)
-                )
         if discordid:
             return (
                 ('label', 'Unlink Player'),
@@ -176,6 +194,7 @@ class PlayerLinkButton(GameAwareButton):
             game = session.scalar(
                 select(Game)
                 .join(Game.webhookurl)
+                .options(joined_url(Game))
                 .where(Game.id == self.game)
                 .where(WebhookURL.channelid == self.channel_id)
             )
@@ -184,10 +203,13 @@ class PlayerLinkButton(GameAwareButton):
                 if player.discordid
                 else interaction.user.id
             )
+            # Committing expires the game's webhookurl.
+            mute = MuteButton(game)
             session.commit()
+            mark_written()
             self.set_attributes_from_player(player.discordid)
             await interaction.response.edit_message(
-                view=View(self, MuteButton(game))
+                view=View(self, mute)
             )
             await interaction.followup.send(
                 self.linked if player.discordid else self.unlinked,
@@ -211,3 +233,42 @@ class PlayerLinkButton(GameAwareButton):
         The player being referenced by this button.
         '''
         return self._player
+
+
+def is_notification_button(custom_id: str) -> bool:
+    '''
+    Whether a custom ID is a turn notification button's.
+    '''
+    return custom_id.startswith((MUTE_PREFIX, PLAYER_LINK_PREFIX))
+
+
+def get_button(custom_id: str) -> Optional[GameAwareButton]:
+    '''
+    Rebuilds the turn notification button with the given custom ID, or gets
+    None if its game or player is no longer tracked.
+    '''
+    prefix = (
+        MUTE_PREFIX
+        if custom_id.startswith(MUTE_PREFIX)
+        else PLAYER_LINK_PREFIX
+    )
+    try:
+        ids = [int(part) for part in custom_id[len(prefix):].split(':')]
+    except ValueError:
+        return None
+    with get_session() as session:
+        game = session.scalar(
+            select(Game).options(*GAME_WITH_URL).where(Game.id == ids[0])
+        )
+        if game is None:
+            return None
+        if prefix == MUTE_PREFIX:
+            return MuteButton(game)
+        player = session.scalar(
+            select(Player)
+            .where(Player.id == ids[-1])
+            .where(Player.slug == game.slug)
+        )
+        if player is None:
+            return None
+        return PlayerLinkButton(game, player)
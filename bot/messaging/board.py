@@ -0,0 +1,150 @@
+'''
+Builders for the status board; the single message that channels using one
+keep up to date with every game they track, instead of getting a message per
+turn.
+'''
+
+import logging
+from datetime import datetime
+from typing import Iterable, List
+from discord import Embed, Message
+from discord.abc import Messageable
+from discord.errors import Forbidden
+from sqlalchemy import Row, and_, select
+from database.connect import get_session
+from database.models import Game, Player, WebhookURL
+from database.utils import date_rank_subquery
+from utils import config
+
+
+logger = logging.getLogger(f'civviebot.{__name__}')
+
+
+# Embed descriptions can't be longer than this.
+MAX_DESCRIPTION = 4096
+# Nor can message content.
+MAX_CONTENT = 2000
+
+
+def get_board_games(channel_id: int) -> List[Row]:
+    '''
+    Gets every game tracked in a channel along with its latest turn, if it has
+    one, and that turn's player.
+    '''
+    subquery = date_rank_subquery(channel_id)
+    with get_session() as session:
+        return session.execute(
+            select(
+                Game.id,
+                Game.name,
+                Game.muted,
+                subquery.c.turn,
+                subquery.c.logtime,
+                subquery.c.lastnotified,
+                Player.name.label('player'),
+                Player.discordid
+            )
+            .join(Game.webhookurl)
+            .outerjoin(
+                subquery,
+                and_(
+                    subquery.c.gameid == Game.id,
+                    subquery.c.date_rank == 1
+                )
+            )
+            .outerjoin(Player, Player.id == subquery.c.playerid)
+            .where(WebhookURL.channelid == channel_id)
+            .order_by(Game.name)
+        ).all()
+
+
+def get_board_line(game: Row) -> str:
+    '''
+    Gets the line for a game on the status board.
+    '''
+    line = f'**{game.name}**'
+    if game.muted:
+        line += ' (muted)'
+    if game.turn is None:
+        return line + ': no turns yet'
+    player = (
+        f'{game.player} (<@{game.discordid}>)'
+        if game.discordid
+        else game.player
+    )
+    return (
+        f'{line}: turn {game.turn}, {player} '
+        f'<t:{int(game.logtime.timestamp())}:R>'
+    )
+
+
+def get_board_embed(games: List[Row]) -> Embed:
+    '''
+    Gets the embed for a channel's status board.
+    '''
+    embed = Embed(title='Games tracked in this channel')
+    if not games:
+        embed.description = (
+            "There aren't any games being tracked in this channel; use `/"
+            f'{config.COMMAND_PREFIX}tracking add` to start tracking one.'
+        )
+    lines = []
+    length = 0
+    for index, game in enumerate(games):
+        line = get_board_line(game)
+        # Leave room for the line saying how many didn't fit.
+        if length + len(line) + 1 > MAX_DESCRIPTION - 32:
+            lines.append(f'...and {len(games) - index} more')
+            break
+        lines.append(line)
+        length += len(line) + 1
+    if lines:
+        embed.description = '\n'.join(lines)
+    embed.set_footer(
+        text=(
+            'Updated as turns come in. Link yourself to your player with "/'
+            f'{config.COMMAND_PREFIX}self link" to be pinged on your turn.'
+        )
+    )
+    embed.timestamp = datetime.now()
+    return embed
+
+
+async def post_board(channel: Messageable, embed: Embed) -> Message:
+    '''
+    Posts a status board to a channel, pinning it if we're allowed to.
+    '''
+    message = await channel.send(embed=embed)
+    try:
+        await message.pin(reason='CivvieBot status board')
+    except Forbidden:
+        logger.info(
+            'Status board posted in %d, but not pinned; missing permissions',
+            message.channel.id
+        )
+    return message
+
+
+def get_ping_contents(games: Iterable[Row]) -> List[str]:
+    '''
+    Gets the content of the messages pinging the linked players whose turn it
+    is in the given games; usually one message, or none if nobody's linked.
+    '''
+    contents = []
+    for game in games:
+        if not game.discordid:
+            continue
+        line = (
+            f"It's <@{game.discordid}>'s turn in **{game.name}** (turn "
+            f'{game.turn})!'
+            if not game.lastnotified
+            else (
+                f"**Reminder**: it's <@{game.discordid}>'s turn in "
+                f'**{game.name}** (turn {game.turn})'
+            )
+        )
+        if contents and len(contents[-1]) + len(line) < MAX_CONTENT:
+            contents[-1] += '\n' + line
+        else:
+            contents.append(line)
+    return contents
@@ -6,23 +6,41 @@ from datetime import datetime, timedelta
 from discord import Embed
 from discord.ext.commands import Bot
 from sqlalchemy import select, func
-from database.models import Game, TurnNotification, WebhookURL
-from database.connect import get_session
+from database.models import (
+    Game,
+    Player,
+    PlayerGames,
+    TurnNotification,
+    TurnStats,
+    WebhookURL
+)
+from database.replica import get_read_session
+from database.loading import current_turn
 from utils import config
 from utils.string import expand_seconds, get_display_name
 
 
 CLEANUP_CONTENT = 'Information about the game cleanup schedule:'
+# Discord won't send an embed with more fields than this, or a field value
+# longer than this.
+MAX_EMBED_FIELDS = 25
+MAX_FIELD_LENGTH = 1024
 
 
 async def get_info_embed(game: Game, bot: Bot) -> Embed:
     '''
     Gets the embed to provide info about a game.
     '''
-    with get_session() as session:
+    with get_read_session() as session:
         session.add(game)
+        turn = session.scalar(current_turn(game.id))
+        player_count = session.scalar(
+            select(func.count())
+            .select_from(PlayerGames)
+            .where(PlayerGames.gameid == game.id)
+        )
         embed = Embed(title=game.name)
-        if not game.turns:
+        if not turn:
             embed.add_field(
                 name='Current turn:',
                 value='No turns have been tracked yet for this game.'
@@ -30,32 +48,32 @@ async def get_info_embed(game: Game, bot: Bot) -> Embed:
         else:
             embed.add_field(
                 name='Current turn:',
-                value=game.turns[0].turn,
+                value=turn.turn,
                 inline=True
             )
             current_player = (
-                await bot.fetch_user(game.turns[0].player.discordid)
-                if game.turns[0].player.discordid
+                await bot.fetch_user(turn.player.discordid)
+                if turn.player.discordid
                 else None
             )
             embed.add_field(
                 name='Current player:',
                 value=(
-                    (f'{game.turns[0].player.name} ('
+                    (f'{turn.player.name} ('
                      f'{get_display_name(current_player)})')
                     if current_player
-                    else game.turns[0].player.name
+                    else turn.player.name
                 ),
                 inline=True)
             embed.add_field(
                 name='Most recent turn:',
-                value=f'<t:{int(game.turns[0].logtime.timestamp())}:R>',
+                value=f'<t:{int(turn.logtime.timestamp())}:R>',
                 inline=True
             )
             if (
                 game.remindinterval
-                and game.turns[0].lastnotified
-                and game.turns[0].turn > game.minturns
+                and turn.lastnotified
+                and turn.turn > game.minturns
                 and not game.muted
             ):
                 embed.add_field(
@@ -75,7 +93,7 @@ async def get_info_embed(game: Game, bot: Bot) -> Embed:
         )
         embed.add_field(
             name='Tracked players:',
-            value=len(game.players),
+            value=player_count,
             inline=True
         )
         embed.add_field(name='Webhook URL:', value=game.full_url)
@@ -91,6 +109,68 @@ async def get_info_embed(game: Game, bot: Bot) -> Embed:
     return embed
 
 
+def get_stats_embed(game: Game) -> Embed:
+    '''
+    Gets the embed to provide turn time statistics about a game.
+    '''
+    def duration(seconds: float) -> str:
+        return expand_seconds(int(seconds)) or 'Under a second'
+
+    embed = Embed(title=f'Turn times for {game.name}')
+    with get_read_session() as session:
+        stats = session.execute(
+            select(TurnStats, Player.name)
+            .join(Player, Player.id == TurnStats.playerid)
+            .where(TurnStats.gameid == game.id)
+            .order_by(Player.name)
+        ).all()
+    if not stats:
+        embed.description = (
+            "I haven't seen anyone finish a turn in this game yet."
+        )
+        return embed
+    # Players past what fits are listed by name in the last field.
+    if len(stats) > MAX_EMBED_FIELDS:
+        stats, rest = (
+            stats[:MAX_EMBED_FIELDS - 1],
+            stats[MAX_EMBED_FIELDS - 1:]
+        )
+    else:
+        rest = []
+    for player_stats, name in stats:
+        embed.add_field(
+            name=name,
+            value=(
+                f'Turns taken: {player_stats.turns}\n'
+                f'Average: {duration(player_stats.meanduration)}\n'
+                f'Median: {duration(player_stats.medianduration)}\n'
+                f'90th percentile: {duration(player_stats.p90duration)}\n'
+                'Last turn taken: '
+                f'<t:{int(player_stats.lastseen.timestamp())}:R>'
+            ),
+            inline=True
+        )
+    if rest:
+        names = ', '.join(name for _, name in rest)
+        embed.add_field(
+            name=f'And {len(rest)} more:',
+            value=(
+                names
+                if len(names) <= MAX_FIELD_LENGTH
+                else names[:MAX_FIELD_LENGTH - 1] + '…'
+            ),
+            inline=False
+        )
+    embed.set_footer(
+        text=(
+            'A turn is counted from the notification that a player is up to '
+            'the next notification I get for the game. Medians and '
+            'percentiles are estimates.'
+        )
+    )
+    return embed
+
+
 def get_cleanup_embed(channel: int) -> Embed:
     '''
     Gets the embed for displaying cleanup information.
@@ -115,7 +195,7 @@ def get_cleanup_embed(channel: int) -> Embed:
         value=f'{config.CLEANUP_LIMIT} of each type of record'
     )
     stale_time = datetime.now() - timedelta(seconds=config.STALE_GAME_LENGTH)
-    with get_session() as session:
+    with get_read_session() as session:
         stale_games = session.scalar(
             select(func.count())
             .select_from(Game)
@@ -1,5 +1,8 @@
 '''
 Builders for portions of messages dealing with turn notification.
+
+Notifications passed to these should be loaded with
+database.loading.NOTIFICATION.
 '''
 
 import logging
@@ -82,6 +85,6 @@ def get_view(notification: TurnNotification) -> View:
     Gets the initial view for a turn notification.
     '''
     return View(
-        PlayerLinkButton(notification.game),
+        PlayerLinkButton(notification.game, notification.player),
         MuteButton(notification.game)
     )
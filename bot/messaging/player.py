@@ -5,8 +5,8 @@ Messaging components related to players and users.
 from typing import Tuple
 from discord import User, Embed
 from sqlalchemy import select, Row
-from database.connect import get_session
-from database.models import Player, Game, WebhookURL
+from database.replica import get_read_session
+from database.models import Player, PlayerGames, Game, WebhookURL
 from database.utils import date_rank_subquery
 from utils import config
 from utils.string import get_display_name
@@ -17,7 +17,7 @@ def get_player_upin_embed(channel_id: int, user: User) -> Embed:
     Gets an embed with the list of Games the given user is up in in a channel.
     '''
     game_list = Embed(title=f'Games {get_display_name(user)} is up in:')
-    with get_session() as session:
+    with get_read_session() as session:
         subquery = date_rank_subquery(channel_id=channel_id)
         turns = session.execute(
             select(
@@ -25,16 +25,18 @@ def get_player_upin_embed(channel_id: int, user: User) -> Embed:
                 subquery.c.logtime,
                 subquery.c.turn,
                 subquery.c.date_rank,
-                subquery.c.playerid
+                subquery.c.playerid,
+                Game.name
             )
             .join(Player, Player.id == subquery.c.playerid)
+            .join(Game, Game.id == subquery.c.gameid)
             .where(Player.discordid == user.id)
             .where(subquery.c.date_rank == 1)
-        )
+        ).all()
         if turns:
             def to_string(row: Row[Tuple]) -> str:
                 return (
-                    f'{row.game.name} (turn {row.turn} - '
+                    f'{row.name} (turn {row.turn} - '
                     f'<t:{int(row.logtime.timestamp())}:R>)'
                 )
             game_list.description = '\n'.join(
@@ -52,20 +54,21 @@ def get_player_games_embed(channel_id: int, user: User) -> Embed:
     '''
     Gets an embed with the list of Games the given user is in in a channel.
     '''
-    with get_session() as session:
+    with get_read_session() as session:
         game_list = Embed(
             title=(f'Games {get_display_name(user)} is linked to in this '
                    'channel:'))
-        games = session.scalars(
-            select(Game)
+        names = session.scalars(
+            select(Game.name)
             .join(Game.webhookurl)
             .join(Game.players)
+            .join(PlayerGames.player)
             .where(Player.discordid == user.id)
             .where(WebhookURL.channelid == channel_id)
-            .distinct(Game.name)
-        )
-        if games:
-            game_list.description = '\n'.join([game.name for game in games])
+            .distinct()
+        ).all()
+        if names:
+            game_list.description = '\n'.join(names)
             game_list.set_footer(
                 text=('For more information about a game, use '
                       f'"/{config.COMMAND_PREFIX}game info".')
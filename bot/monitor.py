@@ -0,0 +1,232 @@
+'''
+Opt-in monitoring for stalls in the bot's event loop.
+
+Database work in the bot happens synchronously inside coroutines, so a slow
+query blocks everything else on the event loop, Discord heartbeats included.
+With LOOP_MONITOR enabled, asyncio's debug mode logs any callback slower than
+LOOP_STALL_THRESHOLD milliseconds, and a watchdog thread samples the event
+loop thread's stack whenever the loop stops responding for that long. Each
+stall is attributed to the command, cog, loop task or interaction that was
+running, logged with structured details, and counted in the monitor's
+metrics.
+'''
+
+import asyncio
+import logging
+import sys
+from collections import defaultdict
+from functools import lru_cache
+from threading import Lock, Thread, current_thread, get_ident
+from time import monotonic, sleep
+from traceback import extract_stack, format_list
+from typing import List, Optional
+from weakref import WeakKeyDictionary
+from discord import ApplicationContext
+from discord.ext.commands import Bot
+from discord.ext.tasks import Loop
+from discord.ui import View
+from utils import config
+
+
+logger = logging.getLogger(f'civviebot.{__name__}')
+
+
+# How many of the innermost frames of a stalled stack to log.
+STACK_DEPTH = 15
+
+
+def describe_task(task: Optional[asyncio.Task]) -> str:
+    '''
+    Describes what an unlabelled task is doing, as best we can tell.
+    '''
+    if task is None:
+        return 'a callback outside of any task'
+    coroutine = task.get_coro()
+    frame = getattr(coroutine, 'cr_frame', None)
+    owner = frame.f_locals.get('self') if frame else None
+    if isinstance(owner, Loop):
+        return f'loop task {owner.coro.__qualname__}'
+    if isinstance(owner, View) and 'item' in frame.f_locals:
+        return f'interaction with {type(frame.f_locals["item"]).__name__}'
+    return f'task {getattr(coroutine, "__qualname__", task.get_name())}'
+
+
+def describe_current_task() -> str:
+    '''
+    Describes what the current task is doing, or the current thread if it's
+    not running an event loop.
+    '''
+    try:
+        return describe_task(asyncio.current_task())
+    except RuntimeError:
+        return f'thread {current_thread().name}'
+
+
+class LoopMonitor:
+    '''
+    Watches an event loop for stalls longer than the given threshold, in
+    seconds.
+    '''
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        # How often the loop checks in with the watchdog.
+        self.interval = threshold / 4
+        self._loop: asyncio.AbstractEventLoop = None
+        self._loop_thread: int = None
+        self._beat: float = None
+        self._labels = WeakKeyDictionary()
+        self._lock = Lock()
+        self._stalls = 0
+        self._stalled = 0.0
+        self._longest = 0.0
+        self._sources = defaultdict(lambda: [0, 0.0])
+
+    def install(self, bot: Bot):
+        '''
+        Starts monitoring the bot's event loop.
+        '''
+        self._loop = bot.loop
+        self._loop.set_debug(True)
+        self._loop.slow_callback_duration = self.threshold
+        # The watchdog only starts once the loop is actually running.
+        self._loop.call_soon(self._start_watchdog)
+
+    def label_command(self, ctx: ApplicationContext):
+        '''
+        Labels the task invoking a command with the command's details. This
+        should be called from the bot's before_invoke hook.
+        '''
+        self.label_current_task(
+            f'command /{ctx.command.qualified_name}',
+            {
+                'cog': ctx.cog.qualified_name if ctx.cog else None,
+                'interaction': ctx.interaction.id,
+                'channel': ctx.channel_id,
+                'user': ctx.user.id if ctx.user else None
+            }
+        )
+
+    def label_current_task(self, source: str, details: dict = None):
+        '''
+        Labels the current task, so that stalls in it are attributed to the
+        given source. Details are logged with the stall, but not counted
+        separately in the metrics.
+        '''
+        task = asyncio.current_task()
+        if task:
+            self._labels[task] = (source, details or {})
+
+    def _start_watchdog(self):
+        '''
+        Starts the heartbeat and the watchdog thread.
+        '''
+        self._loop_thread = get_ident()
+        self._heartbeat()
+        Thread(
+            target=self._watch,
+            name='civviebot-loop-monitor',
+            daemon=True
+        ).start()
+
+    def _heartbeat(self):
+        '''
+        Checks in with the watchdog.
+        '''
+        self._beat = monotonic()
+        self._loop.call_later(self.interval, self._heartbeat)
+
+    def _sample(self) -> List[str]:
+        '''
+        Gets the innermost frames of the event loop thread's current stack.
+        '''
+        # pylint: disable=protected-access
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return []
+        return format_list(extract_stack(frame)[-STACK_DEPTH:])
+
+    def _watch(self):
+        '''
+        Watches for the heartbeat falling behind, sampling what's running when
+        it does and reporting on it once the loop catches up.
+        '''
+        stall = None
+        while not self._loop.is_closed():
+            sleep(self.interval)
+            last_beat = self._beat
+            if monotonic() - last_beat > self.threshold:
+                if stall is None:
+                    task = asyncio.current_task(self._loop)
+                    source, details = (
+                        task and self._labels.get(task)
+                    ) or (describe_task(task), {})
+                    stall = (last_beat, source, details, self._sample())
+            elif stall:
+                started, source, details, stack = stall
+                self._report(
+                    last_beat - started - self.interval,
+                    source,
+                    details,
+                    stack
+                )
+                stall = None
+
+    def _report(
+        self,
+        duration: float,
+        source: str,
+        details: dict,
+        stack: List[str]
+    ):
+        '''
+        Counts and logs a stall.
+
+        The duration is a lower bound; the stall may have started up to one
+        interval before the last heartbeat was due.
+        '''
+        with self._lock:
+            self._stalls += 1
+            self._stalled += duration
+            self._longest = max(self._longest, duration)
+            self._sources[source][0] += 1
+            self._sources[source][1] += duration
+        logger.warning(
+            'Event loop stalled for %dms in %s %s; stack when sampled:\n%s',
+            duration * 1000,
+            source,
+            details,
+            ''.join(stack),
+            extra={
+                'loop_stall': {
+                    'duration_ms': round(duration * 1000),
+                    'source': source,
+                    **details,
+                    'stack': stack
+                }
+            }
+        )
+
+    def get_metrics(self) -> dict:
+        '''
+        Gets the number and total length of stalls, overall and by source.
+        '''
+        with self._lock:
+            return {
+                'stalls': self._stalls,
+                'stalled_seconds': self._stalled,
+                'longest_seconds': self._longest,
+                'sources': {
+                    source: {'stalls': stalls, 'stalled_seconds': stalled}
+                    for source, (stalls, stalled) in self._sources.items()
+                }
+            }
+
+
+@lru_cache(maxsize=None)
+def get_loop_monitor() -> LoopMonitor:
+    '''
+    Gets the event loop monitor for this process, using the configured
+    LOOP_STALL_THRESHOLD.
+    '''
+    return LoopMonitor(config.LOOP_STALL_THRESHOLD / 1000)
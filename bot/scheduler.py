@@ -0,0 +1,193 @@
+'''
+Prioritized scheduling for the notifications the bot sends each round.
+
+Everything due in a round goes into a NotificationQueue, and is sent in order
+of priority: new turns first, then duplicate game warnings, then reminders.
+Within a priority, channels take turns, one notification each, so a channel
+tracking hundreds of games can't use up the round's NOTIFY_LIMIT before any
+other channel gets a turn. Whatever doesn't fit in a round is picked up again
+in the next one.
+
+The scheduler counts, for each priority, how long notifications waited
+between coming due and being sent.
+'''
+
+import logging
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from datetime import datetime
+from enum import IntEnum
+from functools import lru_cache
+from typing import (
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Hashable,
+    Iterator,
+    Optional
+)
+
+
+logger = logging.getLogger(f'civviebot.{__name__}')
+
+
+class Priority(IntEnum):
+    '''
+    Kinds of notification, from most to least urgent.
+    '''
+    TURN = 0
+    DUPLICATE = 1
+    REMINDER = 2
+
+
+@dataclass
+class Job:
+    '''
+    A notification to send to a channel.
+
+    The key identifies the notification from one round to the next. The send
+    coroutine function returns whether the notification is done with, which
+    it is unless it's going to be tried again later.
+    '''
+    priority: Priority
+    channel_id: int
+    key: Hashable
+    send: Callable[[], Awaitable[bool]]
+    # When the notification came due, if it's known; otherwise, it's
+    # considered due from the first round it was queued in.
+    due: Optional[datetime] = None
+
+
+@dataclass
+class PriorityStats:
+    '''
+    How many notifications of a priority were sent, how long they waited,
+    and how many were put off to a later round.
+    '''
+    sent: int = 0
+    waited: float = 0.0
+    longest: float = 0.0
+    deferred: int = 0
+
+
+class NotificationQueue:
+    '''
+    A round's worth of jobs, taken in priority order and round robin across
+    channels.
+    '''
+
+    def __init__(self):
+        # Dicts keep insertion order, so channels take turns in the order
+        # they were first queued.
+        self._jobs: Dict[Priority, Dict[int, Deque[Job]]] = {
+            priority: defaultdict(deque) for priority in Priority
+        }
+
+    def put(self, job: Job):
+        '''
+        Queues a job.
+        '''
+        self._jobs[job.priority][job.channel_id].append(job)
+
+    def __len__(self) -> int:
+        return sum(
+            len(jobs)
+            for channels in self._jobs.values()
+            for jobs in channels.values()
+        )
+
+    def __iter__(self) -> Iterator[Job]:
+        '''
+        Takes jobs off the queue in the order they should be run.
+        '''
+        for priority in Priority:
+            channels = self._jobs[priority]
+            while channels:
+                for channel_id in list(channels):
+                    jobs = channels[channel_id]
+                    yield jobs.popleft()
+                    if not jobs:
+                        del channels[channel_id]
+
+
+class NotificationScheduler:
+    '''
+    Runs queued notifications and keeps metrics on how long they waited.
+    '''
+
+    def __init__(self):
+        # When jobs without a known due time were first queued, by key.
+        self._first_queued: Dict[Hashable, datetime] = {}
+        self._stats = {priority: PriorityStats() for priority in Priority}
+
+    async def run(self, queue: NotificationQueue, limit: int) -> int:
+        '''
+        Runs up to the given number of jobs from the queue, leaving the rest
+        for a later round. Returns how many were run.
+        '''
+        now = datetime.now()
+        ran = 0
+        deferred = 0
+        queued = set()
+        for job in queue:
+            queued.add(job.key)
+            if ran >= limit:
+                self.defer(job, now)
+                deferred += 1
+                continue
+            ran += 1
+            due = job.due or self._first_queued.setdefault(job.key, now)
+            if not await job.send():
+                continue
+            self._first_queued.pop(job.key, None)
+            waited = max((datetime.now() - due).total_seconds(), 0)
+            stats = self._stats[job.priority]
+            stats.sent += 1
+            stats.waited += waited
+            stats.longest = max(stats.longest, waited)
+        # Anything not queued again this round was dropped (e.g., its game
+        # was deleted) rather than sent, so it's no longer waiting.
+        for key in self._first_queued.keys() - queued:
+            del self._first_queued[key]
+        if deferred:
+            logger.info(
+                'Notification limit of %d reached; %d put off to the next '
+                'round',
+                limit,
+                deferred
+            )
+        return ran
+
+    def defer(self, job: Job, now: datetime):
+        '''
+        Counts a job as put off to a later round.
+        '''
+        self._stats[job.priority].deferred += 1
+        if job.due is None:
+            self._first_queued.setdefault(job.key, now)
+
+    def get_metrics(self) -> dict:
+        '''
+        Gets the number sent, the mean and longest wait in seconds, and the
+        number put off to a later round, by priority.
+        '''
+        return {
+            priority.name.lower(): {
+                'sent': stats.sent,
+                'mean_wait_seconds': (
+                    stats.waited / stats.sent if stats.sent else 0.0
+                ),
+                'longest_wait_seconds': stats.longest,
+                'deferred': stats.deferred
+            }
+            for priority, stats in self._stats.items()
+        }
+
+
+@lru_cache(maxsize=None)
+def get_scheduler() -> NotificationScheduler:
+    '''
+    Gets the notification scheduler for this process.
+    '''
+    return NotificationScheduler()
@@ -0,0 +1,110 @@
+'''
+The notifier worker; a CivvieBot that never connects to Discord's gateway.
+
+It logs in over REST only, and runs the loops that send notifications and
+clean up stale games, leaving slash commands and buttons to the bot. With
+NOTIFY_WORKER enabled, the bot leaves those loops to workers instead, so a
+slow round of notifications doesn't hold up commands, and the other way
+around. Everything the two need to agree on is in the database.
+
+Several workers can run at once; each takes the tracked channels whose ID
+modulo NOTIFY_WORKER_COUNT is its NOTIFY_WORKER_INDEX, and only worker 0
+cleans up stale games.
+'''
+
+import asyncio
+import logging
+from signal import SIGINT, SIGTERM, SIGUSR1
+from discord import AllowedMentions, Intents
+from discord.ext.commands import Bot
+from sqlalchemy import ColumnElement, true
+from bot.delivery import get_delivery
+from bot.scheduler import get_scheduler
+from database.models import WebhookURL
+from utils import config
+
+
+logger = logging.getLogger(f'civviebot.{__name__}')
+
+
+# The extensions with the loops the worker runs.
+EXTENSIONS = ('bot.cogs.notify', 'bot.cogs.cleanup')
+
+
+class NotifierWorker(Bot):
+    '''
+    A bot that only talks to Discord over REST, to run the notification and
+    cleanup loops.
+    '''
+
+    def __init__(self):
+        super().__init__(
+            intents=Intents.none(),
+            allowed_mentions=AllowedMentions(
+                everyone=False,
+                users=True,
+                roles=False
+            )
+        )
+
+    async def work(self, token: str):
+        '''
+        Logs in, then runs the loops until the process is told to stop.
+        '''
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal in (SIGINT, SIGTERM):
+            loop.add_signal_handler(signal, stopping.set)
+        loop.add_signal_handler(
+            SIGUSR1,
+            lambda: logger.info(
+                'Notification queue: %s',
+                get_scheduler().get_metrics()
+            )
+        )
+        await self.login(token)
+        # The cogs start their loops when they're loaded, so this has to wait
+        # until there's a token to send with.
+        for extension in EXTENSIONS:
+            self.load_extension(extension)
+        logger.info(
+            'Notifier worker %d of %d started as %s',
+            config.NOTIFY_WORKER_INDEX,
+            config.NOTIFY_WORKER_COUNT,
+            self.user
+        )
+        try:
+            await stopping.wait()
+        finally:
+            for extension in EXTENSIONS:
+                self.unload_extension(extension)
+            await get_delivery(self).close()
+            await self.close()
+
+
+def runs_loops(bot: Bot) -> bool:
+    '''
+    Whether the given bot should run the notification and cleanup loops; only
+    notifier workers do if NOTIFY_WORKER is enabled.
+    '''
+    return isinstance(bot, NotifierWorker) or not config.NOTIFY_WORKER
+
+
+def runs_cleanup(bot: Bot) -> bool:
+    '''
+    Whether the given bot should run the cleanup loop; only one of them does.
+    '''
+    return runs_loops(bot) and config.NOTIFY_WORKER_INDEX == 0
+
+
+def channel_share() -> ColumnElement[bool]:
+    '''
+    Gets a clause limiting WebhookURLs to the channels this process sends
+    notifications for.
+    '''
+    if config.NOTIFY_WORKER_COUNT < 2:
+        return true()
+    return (
+        WebhookURL.channelid % config.NOTIFY_WORKER_COUNT
+        == config.NOTIFY_WORKER_INDEX
+    )
@@ -1,14 +1,53 @@
 '''
 Discord bot and webhook API for Civilization 6 turn notifications.
+
+Run without arguments to start the bot, as 'civviebot.py worker' to start a
+notifier worker (see bot.worker), or as 'civviebot.py migrate' to create or
+update the database schema; migrate before starting the bot or the API for the
+first time, and after upgrading.
 '''
 
-from os import environ
-from bot.civviebot import civviebot
-from database.utils import emit_all
-from utils.config import initialize_logging, add_dotenv
+from sys import argv, exit as sys_exit
+from utils.config import initialize_logging, get_settings
+
+
+def migrate():
+    '''
+    Emits all DDL statements to the database.
+    '''
+    # pylint: disable=import-outside-toplevel
+    from database.utils import emit_all
+    emit_all()
+
+
+def run():
+    '''
+    Runs the bot.
+    '''
+    # Importing the bot pulls in all of py-cord, which migrate doesn't need.
+    # pylint: disable=import-outside-toplevel
+    from bot.civviebot import civviebot
+    civviebot.run(get_settings().DISCORD_TOKEN)
+
+
+def worker():
+    '''
+    Runs a notifier worker.
+    '''
+    # pylint: disable=import-outside-toplevel
+    from bot.worker import NotifierWorker
+    notifier = NotifierWorker()
+    notifier.loop.run_until_complete(
+        notifier.work(get_settings().DISCORD_TOKEN)
+    )
+
+
+COMMANDS = {'migrate': migrate, 'run': run, 'worker': worker}
+
 
 if __name__ == '__main__':
     initialize_logging()
-    emit_all()
-    add_dotenv()
-    civviebot.run(environ.get('DISCORD_TOKEN'))
+    command = argv[1] if len(argv) > 1 else 'run'
+    if command not in COMMANDS:
+        sys_exit(f'Usage: {argv[0]} [{"|".join(COMMANDS)}]')
+    COMMANDS[command]()
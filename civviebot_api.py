@@ -1,13 +1,33 @@
 '''
 API for receiving incoming requests from Civilization 6.
+
+Importing this doesn't touch the database or start logging; create_app() is
+the app factory to serve (e.g., gunicorn 'civviebot_api:create_app()'), so
+that logging starts in each worker after it's forked. Run 'civviebot.py
+migrate' to set up the schema.
 '''
 
+import atexit
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from api.routes import api_blueprint
-from database.utils import emit_all
+from database.profiler import get_profiler
+from utils import config
 from utils.config import initialize_logging
 
-initialize_logging()
-emit_all()
-civviebot_api = Flask(__name__)
-civviebot_api.register_blueprint(api_blueprint)
+
+def create_app() -> Flask:
+    '''
+    Creates the API application.
+    '''
+    initialize_logging()
+    app = Flask(__name__)
+    app.config['MAX_CONTENT_LENGTH'] = config.API_MAX_CONTENT_LENGTH
+    app.register_blueprint(api_blueprint)
+    if config.API_TRUSTED_PROXIES:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.API_TRUSTED_PROXIES)
+    if config.SQL_PROFILER:
+        # Gunicorn uses the signals a report could otherwise be asked for
+        # with, so each worker logs its own on the way out instead.
+        atexit.register(get_profiler().log_report, config.SQL_PROFILER_TOP)
+    return app
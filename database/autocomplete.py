@@ -6,7 +6,7 @@ from typing import Type
 from discord import AutocompleteContext
 from sqlalchemy import select, Select
 from database.models import Game, Player, WebhookURL, CivvieBotBase
-from database.connect import get_session
+from database.replica import get_read_session
 
 
 def _base_model_select(
@@ -34,7 +34,7 @@ def get_games_for_channel(ctx: AutocompleteContext) -> str:
         ctx.interaction.channel_id,
         ctx.value
     )
-    with get_session() as session:
+    with get_read_session() as session:
         for result in session.scalars(game_select):
             yield result.name
 
@@ -48,7 +48,7 @@ def get_players_for_channel(ctx: AutocompleteContext) -> str:
         ctx.interaction.channel_id,
         ctx.value
     )
-    with get_session() as session:
+    with get_read_session() as session:
         for result in session.scalars(player_select):
             yield result.name
 
@@ -61,7 +61,7 @@ def get_unlinked_players_for_channel(ctx: AutocompleteContext) -> str:
         _base_model_select(Player, ctx.interaction.channel_id, ctx.value)
         .where(Player.discordid == None)
     )
-    with get_session() as session:
+    with get_read_session() as session:
         for result in session.scalars(player_select):
             yield result.name
 
@@ -74,7 +74,7 @@ def get_linked_players_for_channel(ctx: AutocompleteContext) -> str:
         _base_model_select(Player, ctx.interaction.channel_id, ctx.value)
         .where(Player.discordid != None)
     )
-    with get_session() as session:
+    with get_read_session() as session:
         for result in session.execute(player_select):
             yield result.name
 
@@ -88,6 +88,6 @@ def get_self_linked_players_for_channel(ctx: AutocompleteContext) -> str:
         _base_model_select(Player, ctx.interaction.channel_id, ctx.value)
         .where(Player.discordid == ctx.interaction.user.id)
     )
-    with get_session() as session:
+    with get_read_session() as session:
         for result in session.scalars(player_select):
             yield result.name
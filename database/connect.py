@@ -3,23 +3,78 @@ Connection management functionality and base utilities for the database.
 '''
 
 import logging
-from sqlalchemy import create_engine, URL, Engine
+from functools import lru_cache
+from sqlalchemy import create_engine, event, URL, Engine
 from sqlalchemy.orm import Session
 from utils import config
+from .profiler import get_profiler
 
 
 logger = logging.getLogger(f'civviebot.{__name__}')
 
 
-def get_db() -> Engine:
+def make_engine(url_kwargs: dict, **engine_kwargs) -> Engine:
     '''
-    Gets an Engine representing the CivvieBot database.
+    Makes an Engine for a database with the configured dialect and driver,
+    given the parameters for its URL and any other arguments for
+    create_engine().
+
+    If SQL_PROFILER is enabled, the profiler is installed on it, and SQLite
+    databases get the SQLite profile (see tune_sqlite).
     '''
     url = URL.create(
         f'{config.CIVVIEBOT_DB_DIALECT}+{config.CIVVIEBOT_DB_DRIVER}',
-        **config.DB_URL_KWARGS
+        **url_kwargs
+    )
+    engine = create_engine(url, **engine_kwargs)
+    if config.CIVVIEBOT_DB_DIALECT == 'sqlite':
+        tune_sqlite(engine)
+    if config.SQL_PROFILER:
+        get_profiler().install(engine)
+    return engine
+
+
+@lru_cache(maxsize=None)
+def get_db() -> Engine:
+    '''
+    Gets an Engine representing the CivvieBot database.
+
+    The Engine is created the first time this is called, and shared by every
+    session in the process afterwards.
+    '''
+    return make_engine(config.DB_URL_KWARGS)
+
+
+def tune_sqlite(engine: Engine):
+    '''
+    Sets up each connection the given SQLite Engine makes so that separate
+    processes (e.g., the bot and the API) can share the database file.
+
+    The journal is put in WAL mode, so readers and the one writer don't block
+    each other; a connection that finds the database locked by another
+    writer waits up to SQLITE_BUSY_TIMEOUT for it rather than failing
+    straight away; and SQLITE_SYNCHRONOUS, SQLITE_MMAP_SIZE and
+    SQLITE_CACHE_SIZE are applied.
+    '''
+    pragmas = (
+        # Set first, so that switching to WAL waits on other connections too.
+        f'busy_timeout = {config.SQLITE_BUSY_TIMEOUT}',
+        'journal_mode = WAL',
+        f'synchronous = {config.SQLITE_SYNCHRONOUS}',
+        f'mmap_size = {config.SQLITE_MMAP_SIZE}',
+        # Negative sizes are in KiB rather than pages.
+        f'cache_size = -{config.SQLITE_CACHE_SIZE}'
     )
-    return create_engine(url)
+
+    def apply_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(f'PRAGMA {pragma}')
+        finally:
+            cursor.close()
+
+    event.listen(engine, 'connect', apply_pragmas)
 
 
 def get_session() -> Session:
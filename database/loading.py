@@ -0,0 +1,47 @@
+'''
+Loader options for the ways CivvieBot reads models along with their
+relationships.
+
+Relationships on the models raise rather than lazy loading (see
+database.models), so anything that needs a related object says so up front
+with one of these. A relationship used from a loop over query results then
+gets loaded for every row at once, instead of with a query per row.
+'''
+
+from typing import Type
+from sqlalchemy import Select, select
+from sqlalchemy.orm import contains_eager, joinedload
+from sqlalchemy.orm.interfaces import LoaderOption
+from .models import Game, NamedConvertable, TurnNotification
+
+
+# A turn notification with everything needed to send it: its player, and its
+# game and the game's webhook URL (for the buttons on the message).
+NOTIFICATION = (
+    joinedload(TurnNotification.player),
+    joinedload(TurnNotification.game).joinedload(Game.webhookurl)
+)
+# A game with its webhook URL, for queries that don't already join it.
+GAME_WITH_URL = (joinedload(Game.webhookurl),)
+
+
+def joined_url(model: Type[NamedConvertable]) -> LoaderOption:
+    '''
+    Gets the option to populate a model's webhookurl from a query that already
+    joins it.
+    '''
+    return contains_eager(model.webhookurl)
+
+
+def current_turn(game: int) -> Select:
+    '''
+    Gets a Select for the most recent TurnNotification in a game, loaded as
+    NOTIFICATION.
+    '''
+    return (
+        select(TurnNotification)
+        .options(*NOTIFICATION)
+        .where(TurnNotification.gameid == game)
+        .order_by(TurnNotification.logtime.desc())
+        .limit(1)
+    )
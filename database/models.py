@@ -6,29 +6,31 @@ information. The goal of these models (besides stashing config) is to allow
 turn notifications to be stashed with a unique game and player by linking them
 back to the webhook URL they came from, and to make it easy to ask about a
 game's current turn.
+
+Relationships never load on their own; they raise if they'd have to run a
+query. Anything that needs a related object asks for it when querying, with
+the loader options in database.loading.
 '''
 
 from datetime import datetime
 from hashlib import sha1
 from time import time
 from typing import List
-from discord import ApplicationContext
 from sqlalchemy import (
     String,
     Integer,
     BigInteger,
     DateTime,
     Boolean,
+    Float,
+    JSON,
     ForeignKey,
     UniqueConstraint,
-    select,
     desc
 )
-from sqlalchemy.exc import NoResultFound
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.ext.declarative import declared_attr
 from utils import config
-from .connect import get_session
 
 
 class CivvieBotBase(DeclarativeBase):
@@ -87,18 +89,49 @@ class WebhookURL(HasSlug, CivvieBotBase):
         nullable=False,
         unique=True
     )
+    # The snowflake of the guild the channel is in. May be null for URLs
+    # created before this was tracked, until the bot sees the channel again.
+    guildid: Mapped[int] = mapped_column(
+        BigInteger,
+        default=None,
+        nullable=True,
+        index=True
+    )
+    # The snowflake of the status board message in the channel, if the channel
+    # keeps one instead of getting a message per turn (None if it doesn't).
+    statusboard: Mapped[int] = mapped_column(
+        BigInteger,
+        default=None,
+        nullable=True
+    )
+    # The snowflake and token of the Discord webhook notifications are posted
+    # to the channel through, if NOTIFY_VIA_WEBHOOKS is enabled and one has
+    # been made (None if not).
+    channelwebhookid: Mapped[int] = mapped_column(
+        BigInteger,
+        default=None,
+        nullable=True
+    )
+    channelwebhooktoken: Mapped[str] = mapped_column(
+        String(255),
+        default=None,
+        nullable=True
+    )
     # One-to-many relationship to the tables linked back to this URL.
     games: Mapped[List['Game']] = relationship(
         back_populates='webhookurl',
-        cascade='all'
+        cascade='all',
+        lazy='raise_on_sql'
     )
     players: Mapped[List['Player']] = relationship(
         back_populates='webhookurl',
-        cascade='all'
+        cascade='all',
+        lazy='raise_on_sql'
     )
     turns: Mapped[List['TurnNotification']] = relationship(
         back_populates='webhookurl',
-        cascade='all'
+        cascade='all',
+        lazy='raise_on_sql'
     )
 
 
@@ -111,13 +144,13 @@ class SlugRelated(HasSlug):
         '''
         Relationship to the WebhookURL provided by self.slug.
         '''
-        return relationship(WebhookURL)
+        return relationship(WebhookURL, lazy='raise_on_sql')
 
 
 class NamedConvertable(SlugRelated):
     '''
-    Mixin class providing a 'name', which is used as the target for a 'convert'
-    method compatible with py-cord parameter conversion.
+    Mixin class providing a 'name', which is used as the target for converting
+    slash command options to models (see bot.converters).
     '''
     @declared_attr
     def name(self) -> Mapped[str]:
@@ -126,22 +159,6 @@ class NamedConvertable(SlugRelated):
         '''
         return mapped_column(String(255))
 
-    async def convert(self, ctx: ApplicationContext, arg: str):
-        '''
-        Converts the given string to the appropriate resource.
-        '''
-        with get_session() as session:
-            scalar = session.scalar(
-                select(self.__class__)
-                .join(self.__class__.webhookurl)
-                .where(self.__class__.name == arg)
-                .where(WebhookURL.channelid == ctx.channel_id)
-            )
-        if not scalar:
-            raise NoResultFound(
-                'Failed to find the given resource in the database.')
-        return scalar
-
 
 class PlayerGames(HasSlug, CivvieBotBase):
     '''
@@ -162,8 +179,14 @@ class PlayerGames(HasSlug, CivvieBotBase):
         primary_key=True
     )
     # Relationships tied to the above primary keys.
-    player: Mapped['Player'] = relationship(back_populates='games')
-    game: Mapped['Game'] = relationship(back_populates='players')
+    player: Mapped['Player'] = relationship(
+        back_populates='games',
+        lazy='raise_on_sql'
+    )
+    game: Mapped['Game'] = relationship(
+        back_populates='players',
+        lazy='raise_on_sql'
+    )
 
 
 class TurnNotification(SlugRelated, CivvieBotBase):
@@ -196,23 +219,145 @@ class TurnNotification(SlugRelated, CivvieBotBase):
         default=None,
         nullable=True
     )
+    # The time a newer notification for the same game superseded this one
+    # before it was pinged (None for never).
+    skipped: Mapped[datetime] = mapped_column(
+        DateTime,
+        default=None,
+        nullable=True
+    )
+    # How many pings for this notification have failed since the last one
+    # that didn't.
+    attempts: Mapped[int] = mapped_column(
+        Integer,
+        default=0,
+        server_default='0',
+        nullable=False
+    )
+    # After a failed ping, the earliest time to try again (None if the last
+    # ping didn't fail).
+    nextattempt: Mapped[datetime] = mapped_column(
+        DateTime,
+        default=None,
+        nullable=True
+    )
+    # The time pings for this notification were given up on, after
+    # NOTIFY_MAX_ATTEMPTS failed in a row (None if they haven't been).
+    deadlettered: Mapped[datetime] = mapped_column(
+        DateTime,
+        default=None,
+        nullable=True
+    )
     # One-to-many relationship to the Player table.
     player: Mapped['Player'] = relationship(
         back_populates='turns',
-        lazy='immediate'
+        lazy='raise_on_sql'
     )
     # One-to-many relationship to the Game table.
     game: Mapped['Game'] = relationship(
         back_populates='turns',
-        lazy='immediate'
+        lazy='raise_on_sql'
     )
     # One-to-many relationship to the WebhookURL table.
     webhookurl: Mapped['WebhookURL'] = relationship(
         back_populates='turns',
-        lazy='immediate'
+        lazy='raise_on_sql'
     )
 
 
+class TurnSummary(CivvieBotBase):
+    '''
+    Represents a compacted TurnNotification whose raw row has been removed.
+
+    Only what's needed to describe a game's history is kept; the slug and
+    notification state of the original notification are discarded.
+    '''
+    __tablename__ = 'turn_summary'
+    # The game the compacted notification was reported for.
+    gameid: Mapped[int] = mapped_column(
+        ForeignKey('game.id'),
+        primary_key=True
+    )
+    # The turn number reported by the compacted notification.
+    turn: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # The player reported by the compacted notification.
+    playerid: Mapped[int] = mapped_column(
+        ForeignKey('player.id'),
+        primary_key=True
+    )
+    # The time the compacted notification came in.
+    logtime: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    # Seconds between the previous notification in the game and this one (None
+    # if this was the first notification we know of).
+    duration: Mapped[int] = mapped_column(
+        Integer,
+        default=None,
+        nullable=True
+    )
+
+
+class TurnStats(CivvieBotBase):
+    '''
+    Represents the turn time statistics for a player in a game.
+
+    Kept up to date as turn notifications come in; see database.stats.
+    '''
+    __tablename__ = 'turn_stats'
+    # The game these statistics are for.
+    gameid: Mapped[int] = mapped_column(
+        ForeignKey('game.id'),
+        primary_key=True
+    )
+    # The player these statistics are for.
+    playerid: Mapped[int] = mapped_column(
+        ForeignKey('player.id'),
+        primary_key=True
+    )
+    # The number of turns the player has been seen to finish.
+    turns: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # Running mean of the player's turn durations, in seconds.
+    meanduration: Mapped[float] = mapped_column(
+        Float,
+        nullable=False,
+        default=0
+    )
+    # Estimated median of the player's turn durations, in seconds.
+    medianduration: Mapped[int] = mapped_column(
+        Integer,
+        nullable=False,
+        default=0
+    )
+    # Estimated 90th percentile of the player's turn durations, in seconds.
+    p90duration: Mapped[int] = mapped_column(
+        Integer,
+        nullable=False,
+        default=0
+    )
+    # Counts of the player's turn durations in log-scale buckets, which the
+    # estimates above are made from.
+    histogram: Mapped[List[int]] = mapped_column(JSON, nullable=False)
+    # The last time the player was seen to finish a turn.
+    lastseen: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    # Reference relationship to the Player these statistics are for.
+    player: Mapped['Player'] = relationship(lazy='raise_on_sql')
+
+
+class RateLimit(CivvieBotBase):
+    '''
+    Represents a token bucket the API uses to rate limit incoming requests.
+
+    Only used when rate limits are shared through a database; see
+    api.ratelimit.
+    '''
+    __tablename__ = 'rate_limit'
+    # What's being limited; e.g., 'slug:<slug>' or 'ip:<address>'.
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    # The number of requests left in the bucket as of updated.
+    tokens: Mapped[float] = mapped_column(Float, nullable=False)
+    # When the bucket was last taken from, as a UNIX timestamp.
+    updated: Mapped[float] = mapped_column(Float, nullable=False)
+
+
 class Player(NamedConvertable, CivvieBotBase):
     '''
     Represents a player being tracked in a Civilization 6 game.
@@ -231,13 +376,20 @@ class Player(NamedConvertable, CivvieBotBase):
         nullable=True
     )
     # Many-to-many relationship to the Games table via the player_games table.
-    games: Mapped[List['PlayerGames']] = relationship(back_populates='player')
+    games: Mapped[List['PlayerGames']] = relationship(
+        back_populates='player',
+        lazy='raise_on_sql'
+    )
     # Reference relationship to the WebhookURL tracking this player.
-    webhookurl: Mapped['WebhookURL'] = relationship(back_populates='players')
+    webhookurl: Mapped['WebhookURL'] = relationship(
+        back_populates='players',
+        lazy='raise_on_sql'
+    )
     # One-to-many relationship to the TurnNotification table.
     turns: Mapped[List[TurnNotification]] = relationship(
         back_populates='player',
-        order_by=desc(TurnNotification.logtime)
+        order_by=desc(TurnNotification.logtime),
+        lazy='raise_on_sql'
     )
 
 
@@ -286,16 +438,29 @@ class Game(NamedConvertable, CivvieBotBase):
     # One-to-one relationship to the WebhookURL table.
     webhookurl: Mapped['WebhookURL'] = relationship(
         back_populates='games',
-        lazy='immediate'
+        lazy='raise_on_sql'
     )
     # Many-to-many relationship to the Player table via the player_games table.
     players: Mapped[List['PlayerGames']] = relationship(
         back_populates='game',
-        cascade='save-update, merge, delete, delete-orphan'
+        cascade='save-update, merge, delete, delete-orphan',
+        lazy='raise_on_sql'
     )
     # One-to-many relationship to the TurnNotification table.
     turns: Mapped[List[TurnNotification]] = relationship(
         back_populates='game',
         cascade='save-update, merge, delete, delete-orphan',
-        order_by=desc(TurnNotification.logtime)
+        order_by=desc(TurnNotification.logtime),
+        lazy='raise_on_sql'
+    )
+    # One-to-many relationship to the TurnSummary table.
+    summaries: Mapped[List[TurnSummary]] = relationship(
+        cascade='save-update, merge, delete, delete-orphan',
+        order_by=desc(TurnSummary.logtime),
+        lazy='raise_on_sql'
+    )
+    # One-to-many relationship to the TurnStats table.
+    stats: Mapped[List[TurnStats]] = relationship(
+        cascade='save-update, merge, delete, delete-orphan',
+        lazy='raise_on_sql'
     )
@@ -0,0 +1,326 @@
+'''
+Monthly range partitioning of the turn_notification table on PostgreSQL.
+
+Each month of turn notifications lives in its own partition, named
+turn_notification_YYYYMM. Rather than deleting old notifications row by row,
+whole months are retired at once: notifications that aren't the most recent
+for their game are compacted into TurnSummary rows in one statement, the rest
+are moved to the default partition, and the month's partition is dropped.
+
+Other dialects keep the plain turn_notification table.
+'''
+
+import logging
+from datetime import datetime
+from typing import List, Tuple
+from sqlalchemy import (
+    Connection,
+    Dialect,
+    Engine,
+    Integer,
+    MetaData,
+    PrimaryKeyConstraint,
+    Table,
+    cast,
+    extract,
+    inspect,
+    select,
+    text
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.schema import CreateTable
+from utils import config
+from .models import CivvieBotBase, TurnNotification, TurnSummary
+from .retention import archive_turns, turn_history_subquery
+
+
+logger = logging.getLogger(f'civviebot.{__name__}')
+
+
+PARENT = TurnNotification.__tablename__
+DEFAULT_PARTITION = f'{PARENT}_default'
+# The table existing notifications are moved to while migrating.
+LEGACY_TABLE = f'{PARENT}_unpartitioned'
+# Every column is carried over when notifications are moved between tables,
+# so none of their notification state is lost.
+_TURN_COLUMNS = ', '.join(
+    column.name for column in TurnNotification.__table__.columns
+)
+
+
+def partitioning_enabled(engine: Engine) -> bool:
+    '''
+    Whether turn_notification should be partitioned in the given database.
+    '''
+    return config.TURN_PARTITIONING and engine.dialect.name == 'postgresql'
+
+
+def month_start(when: datetime, offset: int = 0) -> datetime:
+    '''
+    Gets the start of the month the given time is in, offset by some number of
+    months.
+    '''
+    months = when.year * 12 + when.month - 1 + offset
+    return datetime(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    '''
+    Gets the name of the partition holding the given month.
+    '''
+    return f'{PARENT}_{month.strftime("%Y%m")}'
+
+
+def get_partitioned_table() -> Table:
+    '''
+    Gets a copy of the turn_notification Table, partitioned by range on
+    logtime.
+
+    PostgreSQL requires the partition key to be part of the primary key, so
+    logtime is added to it.
+    '''
+    metadata = MetaData()
+    for table in CivvieBotBase.metadata.sorted_tables:
+        table.to_metadata(metadata)
+    partitioned = metadata.tables[PARENT]
+    partitioned.c.logtime.primary_key = True
+    partitioned.append_constraint(
+        PrimaryKeyConstraint(
+            *[column.name for column in partitioned.c if column.primary_key]
+        )
+    )
+    partitioned.dialect_options['postgresql']['partition_by'] = (
+        'RANGE (logtime)'
+    )
+    return partitioned
+
+
+def get_partition_ddl(month: datetime) -> str:
+    '''
+    Gets the DDL to create the partition for the given month.
+    '''
+    return (
+        f'CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF '
+        f"{PARENT} FOR VALUES FROM ('{month.strftime('%Y-%m-%d')}') TO "
+        f"('{month_start(month, 1).strftime('%Y-%m-%d')}')"
+    )
+
+
+def get_partitioned_ddl(dialect: Dialect, months_ahead: int) -> List[str]:
+    '''
+    Gets the DDL to create the partitioned turn_notification table, its
+    default partition, and partitions from this month to months_ahead.
+    '''
+    this_month = month_start(datetime.now())
+    return [
+        str(
+            CreateTable(get_partitioned_table(), if_not_exists=True)
+            .compile(dialect=dialect)
+        ),
+        (
+            f'CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF '
+            f'{PARENT} DEFAULT'
+        )
+    ] + [
+        get_partition_ddl(month_start(this_month, offset))
+        for offset in range(months_ahead + 1)
+    ]
+
+
+def get_partitions(connection: Connection) -> List[Tuple[str, datetime]]:
+    '''
+    Gets the name and month of each monthly partition that currently exists.
+    '''
+    names = connection.scalars(
+        text(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class parent ON pg_inherits.inhparent = parent.oid '
+            'JOIN pg_class child ON pg_inherits.inhrelid = child.oid '
+            'WHERE parent.relname = :parent'
+        ),
+        {'parent': PARENT}
+    )
+    partitions = []
+    for name in names:
+        try:
+            month = datetime.strptime(name[len(PARENT) + 1:], '%Y%m')
+        except ValueError:
+            # The default partition, or something we didn't make.
+            continue
+        partitions.append((name, month))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def ensure_partitions(
+    connection: Connection,
+    months_ahead: int,
+    since: datetime = None
+) -> int:
+    '''
+    Creates any missing partitions from the month of since (or this month) up
+    to months_ahead months from now. Returns the number of partitions created.
+    '''
+    existing = {name for name, _ in get_partitions(connection)}
+    month = month_start(since or datetime.now())
+    last = month_start(datetime.now(), months_ahead)
+    created = 0
+    while month <= last:
+        if partition_name(month) not in existing:
+            connection.execute(text(get_partition_ddl(month)))
+            created += 1
+        month = month_start(month, 1)
+    return created
+
+
+def migrate_to_partitions(connection: Connection) -> bool:
+    '''
+    Creates the partitioned turn_notification table if it doesn't exist, or
+    migrates an existing plain turn_notification table into one.
+
+    Returns True if existing notifications were migrated.
+    '''
+    relkind = connection.scalar(
+        text('SELECT relkind FROM pg_class WHERE relname = :parent'),
+        {'parent': PARENT}
+    )
+    if relkind == 'p':
+        return False
+    if relkind is not None:
+        connection.execute(
+            text(f'ALTER TABLE {PARENT} RENAME TO {LEGACY_TABLE}')
+        )
+        connection.execute(
+            text(
+                f'ALTER TABLE {LEGACY_TABLE} RENAME CONSTRAINT {PARENT}_pkey '
+                f'TO {LEGACY_TABLE}_pkey'
+            )
+        )
+    for statement in get_partitioned_ddl(
+        connection.dialect,
+        config.TURN_PARTITION_PREMAKE
+    ):
+        connection.execute(text(statement))
+    if relkind is None:
+        return False
+    earliest = connection.scalar(
+        text(f'SELECT min(logtime) FROM {LEGACY_TABLE}')
+    )
+    if earliest:
+        ensure_partitions(
+            connection,
+            config.TURN_PARTITION_PREMAKE,
+            since=earliest
+        )
+    # The existing table may predate some columns, which are left to their
+    # defaults.
+    existing = {
+        column['name']
+        for column in inspect(connection).get_columns(LEGACY_TABLE)
+    }
+    columns = ', '.join(
+        column.name
+        for column in TurnNotification.__table__.columns
+        if column.name in existing
+    )
+    connection.execute(
+        text(
+            f'INSERT INTO {PARENT} ({columns}) SELECT {columns} '
+            f'FROM {LEGACY_TABLE}'
+        )
+    )
+    connection.execute(text(f'DROP TABLE {LEGACY_TABLE}'))
+    logger.info('Migrated existing turn notifications to a partitioned table')
+    return True
+
+
+def emit_partitioned(engine: Engine):
+    '''
+    Emits DDL statements for all tables, partitioning turn_notification.
+    '''
+    CivvieBotBase.metadata.create_all(
+        engine,
+        tables=[
+            table
+            for table in CivvieBotBase.metadata.sorted_tables
+            if table.name != PARENT
+        ]
+    )
+    with engine.begin() as connection:
+        migrate_to_partitions(connection)
+        ensure_partitions(connection, config.TURN_PARTITION_PREMAKE)
+
+
+def retire_partitions(
+    engine: Engine,
+    before: datetime,
+    archive_path: str = None
+) -> int:
+    '''
+    Retires monthly partitions that end before the given time, archiving
+    compacted notifications first if an archive_path is given.
+
+    The most recent notification for each game in a retired partition is moved
+    to the default partition; the rest are compacted into TurnSummary rows.
+    Returns the number of partitions that were retired.
+    '''
+    with engine.connect() as connection:
+        partitions = get_partitions(connection)
+    retired = 0
+    for name, month in partitions:
+        if month_start(month, 1) > before:
+            break
+        history = turn_history_subquery()
+        compacted = (
+            select(history)
+            .where(history.c.date_rank > 1)
+            .where(history.c.logtime >= month)
+            .where(history.c.logtime < month_start(month, 1))
+        ).subquery()
+        with engine.begin() as connection:
+            if archive_path:
+                archive_turns(
+                    connection.execute(select(compacted)),
+                    archive_path
+                )
+            # A turn Civ 6 sent again after it was summarized keeps its
+            # first summary.
+            connection.execute(
+                insert(TurnSummary).from_select(
+                    ['gameid', 'turn', 'playerid', 'logtime', 'duration'],
+                    select(
+                        compacted.c.gameid,
+                        compacted.c.turn,
+                        compacted.c.playerid,
+                        compacted.c.logtime,
+                        cast(
+                            extract(
+                                'epoch',
+                                compacted.c.logtime - compacted.c.previous
+                            ),
+                            Integer
+                        )
+                    )
+                ).on_conflict_do_nothing()
+            )
+            connection.execute(
+                text(f'ALTER TABLE {PARENT} DETACH PARTITION {name}')
+            )
+            # With the partition detached, its month now routes to the default
+            # partition.
+            connection.execute(
+                text(
+                    f'INSERT INTO {PARENT} ({_TURN_COLUMNS}) '
+                    f'SELECT {_TURN_COLUMNS} FROM ('
+                    f'SELECT {_TURN_COLUMNS}, rank() OVER ('
+                    'PARTITION BY gameid ORDER BY logtime DESC) AS date_rank '
+                    f'FROM {name}) AS retired '
+                    'WHERE retired.date_rank = 1 AND NOT EXISTS ('
+                    f'SELECT 1 FROM {PARENT} AS newer '
+                    'WHERE newer.gameid = retired.gameid '
+                    'AND newer.logtime > retired.logtime)'
+                )
+            )
+            connection.execute(text(f'DROP TABLE {name}'))
+        retired += 1
+        logger.info('Retired turn notification partition %s', name)
+    return retired
@@ -0,0 +1,208 @@
+'''
+Opt-in profiling of the SQL CivvieBot runs.
+
+With SQL_PROFILER enabled, every statement the engine executes is timed and
+counted by its fingerprint; the statement with literals and bound parameter
+lists collapsed, so that the same query with different values is counted
+together. Each fingerprint also keeps count of where it was run from; the bot
+labels queries with the slash command or loop that ran them, and the API with
+the route. A report of the slowest and most frequent fingerprints makes N+1
+patterns easy to spot, as one source running the same fingerprint many times.
+'''
+
+import logging
+import re
+from collections import Counter
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field
+from functools import lru_cache
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import Engine, event
+
+
+logger = logging.getLogger(f'civviebot.{__name__}')
+
+
+# Where queries in the current context are being run from.
+query_source: ContextVar[Optional[str]] = ContextVar(
+    'query_source',
+    default=None
+)
+
+# Beyond this many fingerprints, new ones are counted as dropped instead.
+MAX_FINGERPRINTS = 1000
+# How many sources to list for each fingerprint in a report.
+REPORT_SOURCES = 3
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAMETER_LIST = re.compile(
+    r'\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)'
+)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def label_queries(source: str) -> Token:
+    '''
+    Attributes queries run in the current context from here on to the given
+    source. Returns a token that can be used to reset it.
+    '''
+    return query_source.set(source)
+
+
+@lru_cache(maxsize=4096)
+def get_fingerprint(statement: str) -> str:
+    '''
+    Gets the fingerprint of a SQL statement.
+    '''
+    fingerprint = _STRING_LITERAL.sub('?', statement)
+    fingerprint = _NUMBER_LITERAL.sub('?', fingerprint)
+    # IN clauses get a parameter per value.
+    fingerprint = _PARAMETER_LIST.sub('(...)', fingerprint)
+    return _WHITESPACE.sub(' ', fingerprint).strip()
+
+
+@dataclass
+class QueryStats:
+    '''
+    How often, and for how long, a fingerprint has been run.
+    '''
+    count: int = 0
+    seconds: float = 0.0
+    longest: float = 0.0
+    # Only counted where the driver reports it; most don't for SELECTs.
+    rows: int = 0
+    sources: Counter = field(default_factory=Counter)
+
+
+class QueryProfiler:
+    '''
+    Records statements executed by the engines it's installed on.
+
+    describe_source, if given, is called for a source for queries that
+    haven't been labelled.
+    '''
+
+    def __init__(self, describe_source: Callable[[], str] = None):
+        self.describe_source = describe_source
+        self._stats: Dict[str, QueryStats] = {}
+        self._dropped = 0
+        self._lock = Lock()
+
+    def install(self, engine: Engine):
+        '''
+        Starts profiling statements executed by the given engine.
+        '''
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    @staticmethod
+    def _before_execute(conn, *args):
+        '''
+        Notes when a statement started.
+        '''
+        del args
+        conn.info.setdefault('profiler_start', []).append(perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, *args):
+        '''
+        Records a finished statement.
+        '''
+        del args
+        duration = perf_counter() - conn.info['profiler_start'].pop()
+        source = query_source.get()
+        if source is None:
+            source = (
+                self.describe_source() if self.describe_source else 'unknown'
+            )
+        rows = max(cursor.rowcount, 0)
+        fingerprint = get_fingerprint(statement)
+        with self._lock:
+            stats = self._stats.get(fingerprint)
+            if stats is None:
+                if len(self._stats) >= MAX_FINGERPRINTS:
+                    self._dropped += 1
+                    return
+                stats = self._stats[fingerprint] = QueryStats()
+            stats.count += 1
+            stats.seconds += duration
+            stats.longest = max(stats.longest, duration)
+            stats.rows += rows
+            stats.sources[source] += 1
+
+    def reset(self):
+        '''
+        Forgets everything recorded so far.
+        '''
+        with self._lock:
+            self._stats.clear()
+            self._dropped = 0
+
+    def get_top(self, count: int, by: str = 'seconds') -> List[tuple]:
+        '''
+        Gets the given number of (fingerprint, QueryStats) pairs with the
+        highest value of the given QueryStats attribute.
+        '''
+        with self._lock:
+            return sorted(
+                (
+                    (fingerprint, QueryStats(
+                        stats.count,
+                        stats.seconds,
+                        stats.longest,
+                        stats.rows,
+                        stats.sources.copy()
+                    ))
+                    for fingerprint, stats in self._stats.items()
+                ),
+                key=lambda pair: getattr(pair[1], by),
+                reverse=True
+            )[:count]
+
+    def get_report(self, count: int) -> str:
+        '''
+        Gets a plain text report of the given number of slowest and most
+        frequent fingerprints.
+        '''
+        lines = []
+        for title, by in (
+            ('Slowest statements, by total time', 'seconds'),
+            ('Most frequent statements', 'count')
+        ):
+            lines.append(f'{title}:')
+            for fingerprint, stats in self.get_top(count, by):
+                lines.append(
+                    f'{stats.count:>8} runs {stats.seconds * 1000:>10.1f}ms '
+                    f'total {stats.seconds / stats.count * 1000:>8.2f}ms avg '
+                    f'{stats.longest * 1000:>8.2f}ms max {stats.rows:>8} rows'
+                )
+                lines.append(f'  {fingerprint}')
+                lines.append('  from ' + ', '.join(
+                    f'{source} ({runs})'
+                    for source, runs
+                    in stats.sources.most_common(REPORT_SOURCES)
+                ))
+            lines.append('')
+        if self._dropped:
+            lines.append(
+                f'{self._dropped} statements with new fingerprints were not '
+                f'recorded, as {MAX_FINGERPRINTS} were already being tracked.'
+            )
+        return '\n'.join(lines)
+
+    def log_report(self, count: int):
+        '''
+        Logs a report of the given number of slowest and most frequent
+        fingerprints.
+        '''
+        logger.info('SQL profile:\n%s', self.get_report(count))
+
+
+@lru_cache(maxsize=None)
+def get_profiler() -> QueryProfiler:
+    '''
+    Gets the profiler for this process.
+    '''
+    return QueryProfiler()
@@ -0,0 +1,203 @@
+'''
+Routing for read-only database work to a replica, if one is configured.
+
+Some of what the bot reads (autocomplete, game info, the games a player is
+in or up in, and the like) doesn't need to come from the primary database,
+and can be sent to a read replica set up with CIVVIEBOT_DB_REPLICA_URL_*
+instead, using get_read_session(). Anything that writes, or reads as part of
+a write, uses get_session() as usual.
+
+Reads go to the primary instead while the replica can't be reached, or is
+more than CIVVIEBOT_DB_REPLICA_MAX_LAG seconds behind it. That's checked on a
+background thread every CIVVIEBOT_DB_REPLICA_CHECK_INTERVAL seconds, so that
+a replica that's slow to answer never holds up the bot's event loop, and
+reads go to the primary until the first check is done. The lag can only be
+measured on PostgreSQL, so other replicas are trusted as long as they
+respond. Connecting to the replica gives up after
+CIVVIEBOT_DB_REPLICA_CONNECT_TIMEOUT seconds, where the driver allows it.
+
+Reads also go to the primary for CIVVIEBOT_DB_REPLICA_MAX_LAG seconds after
+mark_written() is called, so that someone who just changed something (e.g.,
+linked a player) sees the change straight away.
+'''
+
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from time import monotonic
+from typing import Optional
+from sqlalchemy import Engine, event, select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from utils import config
+from .connect import get_db, get_session, make_engine
+
+
+logger = logging.getLogger(f'civviebot.{__name__}')
+
+
+# Queries for how far behind the primary a replica is, in seconds, by dialect.
+LAG_QUERIES = {
+    # A replica that has replayed everything it's received is caught up, no
+    # matter how long ago the last transaction was; on a primary, this is
+    # NULL.
+    'postgresql': text(
+        'SELECT CASE WHEN pg_last_wal_receive_lsn() = '
+        'pg_last_wal_replay_lsn() THEN 0 ELSE EXTRACT(EPOCH FROM now() - '
+        'pg_last_xact_replay_timestamp()) END'
+    )
+}
+# The connect() argument each driver takes a connection timeout in seconds
+# as, for those that have one.
+CONNECT_TIMEOUT_ARGUMENTS = {
+    'pg8000': 'timeout',
+    'psycopg2': 'connect_timeout',
+    'psycopg': 'connect_timeout',
+    'pymysql': 'connect_timeout',
+    'mysqldb': 'connect_timeout'
+}
+
+
+class ReplicaRouter:
+    '''
+    Picks the Engine read-only sessions should use.
+    '''
+
+    def __init__(self, primary: Engine, replica: Engine):
+        self.primary = primary
+        self.replica = replica
+        # Whether the replica can be read from, and when that was last
+        # checked, once it has been.
+        self._usable: bool = None
+        self._checked: float = None
+        # Until when reads go to the primary regardless.
+        self._held_until = 0.0
+        self._checker = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix='replica-check'
+        )
+        self._check: Future = None
+        event.listen(replica, 'handle_error', self._on_error)
+
+    def get_lag(self) -> float:
+        '''
+        Gets how many seconds behind the primary the replica is.
+        '''
+        with self.replica.connect() as connection:
+            query = LAG_QUERIES.get(self.replica.dialect.name)
+            if query is None:
+                connection.execute(select(1))
+                return 0.0
+            return float(connection.scalar(query) or 0)
+
+    def is_usable(self) -> bool:
+        '''
+        Whether the replica could be read from when it was last checked.
+
+        Doesn't wait on the replica; if it hasn't been checked for
+        CIVVIEBOT_DB_REPLICA_CHECK_INTERVAL seconds, a check is started in
+        the background for later calls to see.
+        '''
+        interval = config.CIVVIEBOT_DB_REPLICA_CHECK_INTERVAL
+        if (
+            (self._checked is None or monotonic() - self._checked >= interval)
+            and (self._check is None or self._check.done())
+        ):
+            self._check = self._checker.submit(self.check)
+        return bool(self._usable)
+
+    def check(self):
+        '''
+        Checks whether the replica can be read from, waiting on it.
+        '''
+        try:
+            lag = self.get_lag()
+        except SQLAlchemyError as error:
+            self.set_usable(False, f'it could not be reached: {error}')
+        else:
+            self.set_usable(
+                lag <= config.CIVVIEBOT_DB_REPLICA_MAX_LAG,
+                f'it is {lag:.1f}s behind the primary'
+            )
+        self._checked = monotonic()
+
+    def set_usable(self, usable: bool, reason: str):
+        '''
+        Sets whether the replica can be read from, logging any change.
+        '''
+        if usable == self._usable:
+            return
+        self._usable = usable
+        if usable:
+            logger.info('Reading from the replica; %s', reason)
+        else:
+            logger.warning(
+                'Reading from the primary instead of the replica; %s',
+                reason
+            )
+
+    def _on_error(self, context):
+        '''
+        Stops reading from the replica until the next check if it's been
+        disconnected from.
+        '''
+        if context.is_disconnect:
+            self._checked = monotonic()
+            self.set_usable(False, 'it was disconnected from')
+
+    def hold(self, seconds: float):
+        '''
+        Sends reads to the primary for the next given number of seconds.
+        '''
+        self._held_until = max(self._held_until, monotonic() + seconds)
+
+    def get_engine(self) -> Engine:
+        '''
+        Gets the Engine to read from.
+        '''
+        if monotonic() < self._held_until or not self.is_usable():
+            return self.primary
+        return self.replica
+
+
+@lru_cache(maxsize=None)
+def get_router() -> Optional[ReplicaRouter]:
+    '''
+    Gets the replica router for this process, or None if there's no replica
+    configured.
+    '''
+    if not config.DB_REPLICA_URL_KWARGS:
+        return None
+    connect_args = {}
+    timeout_argument = CONNECT_TIMEOUT_ARGUMENTS.get(
+        config.CIVVIEBOT_DB_DRIVER
+    )
+    if timeout_argument:
+        connect_args[timeout_argument] = (
+            config.CIVVIEBOT_DB_REPLICA_CONNECT_TIMEOUT
+        )
+    return ReplicaRouter(
+        get_db(),
+        make_engine(config.DB_REPLICA_URL_KWARGS, connect_args=connect_args)
+    )
+
+
+def get_read_session() -> Session:
+    '''
+    Gets a session for read-only work, on the replica if there is one that's
+    up to date enough.
+    '''
+    router = get_router()
+    if router is None:
+        return get_session()
+    return Session(router.get_engine())
+
+
+def mark_written():
+    '''
+    Notes that something a user will want to see straight away was just
+    written, so that reads stay on the primary until replicas have caught up.
+    '''
+    router = get_router()
+    if router is not None:
+        router.hold(config.CIVVIEBOT_DB_REPLICA_MAX_LAG)
@@ -0,0 +1,167 @@
+'''
+Retention of turn notification history.
+
+Only the most recent turn notification for a game matters for notifications,
+so older ones are compacted into TurnSummary rows and removed from the hot
+turn_notification table.
+'''
+
+import gzip
+import json
+from datetime import datetime
+from os import makedirs, path
+from typing import Iterable
+from sqlalchemy import select, delete, insert, tuple_, Row, Subquery, func
+from .connect import get_session
+from .models import TurnNotification, TurnSummary
+
+
+def turn_history_subquery() -> Subquery:
+    '''
+    Gets a Subquery of all TurnNotifications, with the 'date_rank' from
+    date_rank_subquery() and the logtime of the notification before it in the
+    same game attached as 'previous'.
+
+    If a game's earlier notifications have already been compacted, the
+    'previous' of its earliest notification is the most recent TurnSummary.
+    '''
+    last_summary = (
+        select(func.max(TurnSummary.logtime))
+        .where(TurnSummary.gameid == TurnNotification.gameid)
+        .scalar_subquery()
+    )
+    return (
+        select(
+            func.rank().over(
+                order_by=TurnNotification.logtime.desc(),
+                partition_by=TurnNotification.gameid
+            ).label('date_rank'),
+            func.coalesce(
+                func.lag(TurnNotification.logtime).over(
+                    order_by=TurnNotification.logtime,
+                    partition_by=TurnNotification.gameid
+                ),
+                last_summary
+            ).label('previous'),
+            TurnNotification.turn,
+            TurnNotification.playerid,
+            TurnNotification.gameid,
+            TurnNotification.slug,
+            TurnNotification.logtime,
+            TurnNotification.lastnotified,
+            TurnNotification.skipped
+        )
+        .select_from(TurnNotification)
+        .subquery()
+    )
+
+
+def archive_turns(turns: Iterable[Row], archive_path: str):
+    '''
+    Appends the given TurnNotification rows to this month's gzipped JSON lines
+    archive in archive_path.
+    '''
+    makedirs(archive_path, exist_ok=True)
+    destination = path.join(
+        archive_path,
+        f'turn_notification-{datetime.now().strftime("%Y%m")}.jsonl.gz'
+    )
+    with gzip.open(destination, mode='at', encoding='utf-8') as archive:
+        for turn in turns:
+            archive.write(json.dumps({
+                'turn': turn.turn,
+                'playerid': turn.playerid,
+                'gameid': turn.gameid,
+                'slug': turn.slug,
+                'logtime': turn.logtime.isoformat(),
+                'lastnotified': (
+                    turn.lastnotified.isoformat()
+                    if turn.lastnotified
+                    else None
+                ),
+                'skipped': (
+                    turn.skipped.isoformat() if turn.skipped else None
+                )
+            }) + '\n')
+
+
+def compact_turns(
+    before: datetime,
+    limit: int,
+    archive_path: str = None
+) -> int:
+    '''
+    Compacts up to limit TurnNotifications logged before the given time into
+    TurnSummary rows, then removes them, archiving them first if an
+    archive_path is given.
+
+    The most recent notification for each game is never compacted, and
+    notifications for a turn that's already summarized (e.g., Civ 6 sent it
+    again after it was compacted) are removed without another summary.
+    Returns the number of notifications that were compacted.
+    '''
+    history = turn_history_subquery()
+    with get_session() as session:
+        turns = session.execute(
+            select(history)
+            .where(history.c.date_rank > 1)
+            .where(history.c.logtime < before)
+            .order_by(history.c.gameid, history.c.logtime)
+            .limit(limit)
+        ).all()
+        if not turns:
+            return 0
+        if archive_path:
+            archive_turns(turns, archive_path)
+        # Only the earliest notification for each summarized turn counts.
+        summaries = {}
+        for turn in turns:
+            summaries.setdefault((turn.gameid, turn.turn, turn.playerid), turn)
+        summarized = session.execute(
+            select(TurnSummary.gameid, TurnSummary.turn, TurnSummary.playerid)
+            .where(
+                tuple_(
+                    TurnSummary.gameid,
+                    TurnSummary.turn,
+                    TurnSummary.playerid
+                ).in_(list(summaries))
+            )
+        ).all()
+        for key in summarized:
+            del summaries[tuple(key)]
+        if summaries:
+            session.execute(
+                insert(TurnSummary),
+                [
+                    {
+                        'gameid': turn.gameid,
+                        'turn': turn.turn,
+                        'playerid': turn.playerid,
+                        'logtime': turn.logtime,
+                        'duration': (
+                            int(
+                                (turn.logtime - turn.previous).total_seconds()
+                            )
+                            if turn.previous
+                            else None
+                        )
+                    }
+                    for turn in summaries.values()
+                ]
+            )
+        session.execute(
+            delete(TurnNotification)
+            .where(
+                tuple_(
+                    TurnNotification.turn,
+                    TurnNotification.playerid,
+                    TurnNotification.gameid,
+                    TurnNotification.slug
+                ).in_([
+                    (turn.turn, turn.playerid, turn.gameid, turn.slug)
+                    for turn in turns
+                ])
+            )
+        )
+        session.commit()
+    return len(turns)
@@ -1,10 +1,13 @@
 CREATE TABLE webhook_url (
 	slug VARCHAR(16) NOT NULL,
 	channelid BIGINT NOT NULL,
+	guildid BIGINT,
 	PRIMARY KEY (slug),
 	UNIQUE (channelid)
 );
 
+CREATE INDEX ix_webhook_url_guildid ON webhook_url (guildid);
+
 CREATE TABLE game (
 	id SERIAL NOT NULL,
 	muted BOOLEAN NOT NULL,
@@ -50,4 +53,37 @@ CREATE TABLE turn_notification (
 	FOREIGN KEY(playerid) REFERENCES player (id),
 	FOREIGN KEY(gameid) REFERENCES game (id),
 	FOREIGN KEY(slug) REFERENCES webhook_url (slug)
-);
\ No newline at end of file
+);
+
+CREATE TABLE turn_summary (
+	gameid INTEGER NOT NULL,
+	turn INTEGER NOT NULL,
+	playerid INTEGER NOT NULL,
+	logtime TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+	duration INTEGER,
+	PRIMARY KEY (gameid, turn, playerid),
+	FOREIGN KEY(gameid) REFERENCES game (id),
+	FOREIGN KEY(playerid) REFERENCES player (id)
+);
+
+
+CREATE TABLE turn_stats (
+	gameid INTEGER NOT NULL,
+	playerid INTEGER NOT NULL,
+	turns INTEGER NOT NULL,
+	meanduration FLOAT NOT NULL,
+	medianduration INTEGER NOT NULL,
+	p90duration INTEGER NOT NULL,
+	histogram JSON NOT NULL,
+	lastseen TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+	PRIMARY KEY (gameid, playerid),
+	FOREIGN KEY(gameid) REFERENCES game (id),
+	FOREIGN KEY(playerid) REFERENCES player (id)
+);
+
+CREATE TABLE rate_limit (
+	key VARCHAR(255) NOT NULL,
+	tokens FLOAT NOT NULL,
+	updated FLOAT NOT NULL,
+	PRIMARY KEY (key)
+);
@@ -0,0 +1,106 @@
+'''
+Incrementally maintained turn time statistics.
+
+Each player's turn durations in a game are counted in a log-scale histogram,
+so the mean, median and 90th percentile can be updated in constant time as
+turn notifications come in, without scanning a game's turn history.
+'''
+
+from datetime import datetime, timedelta
+from math import log, sqrt
+from typing import List
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .models import TurnStats
+
+
+# Each bucket holds durations up to sqrt(2) times longer than the one before
+# it, which keeps estimates within about 20% of the true value.
+BUCKET_GROWTH = sqrt(2)
+# Bucket 0 holds durations under a second; the last bucket holds anything over
+# about 48 days.
+BUCKET_COUNT = 46
+
+
+def get_bucket(seconds: float) -> int:
+    '''
+    Gets the histogram bucket a duration in seconds belongs in.
+    '''
+    if seconds < 1:
+        return 0
+    return min(int(log(seconds, BUCKET_GROWTH)) + 1, BUCKET_COUNT - 1)
+
+
+def get_bucket_estimate(bucket: int) -> float:
+    '''
+    Gets the duration in seconds that represents a histogram bucket; the
+    geometric middle of the bucket.
+    '''
+    if bucket == 0:
+        return 0
+    return BUCKET_GROWTH ** (bucket - 1) * sqrt(BUCKET_GROWTH)
+
+
+def estimate_quantile(histogram: List[int], quantile: float) -> float:
+    '''
+    Estimates the given quantile of the durations counted in a histogram.
+    '''
+    target = quantile * sum(histogram)
+    seen = 0
+    for bucket, count in enumerate(histogram):
+        seen += count
+        if count and seen >= target:
+            return get_bucket_estimate(bucket)
+    return 0
+
+
+def record_turn_duration(
+    session: Session,
+    gameid: int,
+    playerid: int,
+    duration: timedelta,
+    finished: datetime
+) -> TurnStats:
+    '''
+    Adds a finished turn to a player's statistics for a game.
+
+    The statistics are locked until the caller commits the session, so turns
+    recorded at once by separate processes (e.g., API workers and the bot's
+    listener) don't lose each other's updates.
+    '''
+    stats = session.get(TurnStats, (gameid, playerid), with_for_update=True)
+    if not stats:
+        # Anything already pending is written first, so that it can't be
+        # mistaken for a conflict on the statistics.
+        session.flush()
+        stats = TurnStats(
+            gameid=gameid,
+            playerid=playerid,
+            turns=0,
+            meanduration=0,
+            histogram=[0] * BUCKET_COUNT,
+            lastseen=finished
+        )
+        try:
+            with session.begin_nested():
+                session.add(stats)
+        except IntegrityError:
+            # Another process made them first; only the savepoint is rolled
+            # back, so the rest of the caller's work is kept.
+            stats = session.get(
+                TurnStats,
+                (gameid, playerid),
+                with_for_update=True
+            )
+    seconds = max(duration.total_seconds(), 0)
+    stats.turns += 1
+    stats.meanduration += (seconds - stats.meanduration) / stats.turns
+    # The histogram has to be replaced, rather than modified in place, to be
+    # picked up as a change.
+    histogram = list(stats.histogram)
+    histogram[get_bucket(seconds)] += 1
+    stats.histogram = histogram
+    stats.medianduration = int(estimate_quantile(histogram, 0.5))
+    stats.p90duration = int(estimate_quantile(histogram, 0.9))
+    stats.lastseen = finished
+    return stats
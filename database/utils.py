@@ -2,10 +2,34 @@
 Utility functions for the database.
 '''
 
-from sqlalchemy import select, delete, Subquery, func
+from typing import Iterable, List, Tuple
+from sqlalchemy import (
+    Engine,
+    inspect,
+    select,
+    delete,
+    and_,
+    or_,
+    text,
+    update,
+    Subquery,
+    func
+)
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
 from .connect import get_db, get_session
-from .models import WebhookURL, Game, Player, TurnNotification, PlayerGames
+from .partitions import emit_partitioned, partitioning_enabled
+from .models import (
+    CivvieBotBase,
+    WebhookURL,
+    Game,
+    Player,
+    TurnNotification,
+    TurnStats,
+    TurnSummary,
+    PlayerGames
+)
 
 
 def emit_all():
@@ -13,25 +37,61 @@ def emit_all():
     Emits all DDL statements to the database.
     '''
     database = get_db()
-    WebhookURL.metadata.create_all(database)
-    Game.metadata.create_all(database)
-    Player.metadata.create_all(database)
-    PlayerGames.metadata.create_all(database)
-    TurnNotification.metadata.create_all(database)
+    if partitioning_enabled(database):
+        emit_partitioned(database)
+    else:
+        # Every model shares the same metadata.
+        CivvieBotBase.metadata.create_all(database)
+    add_missing_columns(database)
 
 
-def get_url_for_channel(channel_id: int) -> WebhookURL:
+def add_missing_columns(database: Engine):
+    '''
+    Adds columns and indexes that were added to models after their tables were
+    created.
+
+    Only columns that are nullable or have a server default can be added this
+    way; anything else requires a manual migration.
+    '''
+    inspector = inspect(database)
+    with database.begin() as connection:
+        for table in CivvieBotBase.metadata.sorted_tables:
+            existing = {
+                column['name']
+                for column in inspector.get_columns(table.name)
+            }
+            for column in table.columns:
+                if column.name in existing or (
+                    not column.nullable and column.server_default is None
+                ):
+                    continue
+                connection.execute(
+                    text(
+                        f'ALTER TABLE {table.name} ADD COLUMN '
+                        + str(CreateColumn(column).compile(database))
+                    )
+                )
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+
+def get_url_for_channel(channel_id: int, guild_id: int = None) -> WebhookURL:
     '''
     Gets the URL for a channel, creating it if it doesn't exist.
+
+    If a guild_id is given, it's recorded against the URL if it's missing.
     '''
     with get_session() as session:
         url = session.scalar(
             select(WebhookURL)
             .where(WebhookURL.channelid == channel_id)
         )
+        if url and guild_id and not url.guildid:
+            url.guildid = guild_id
+            session.commit()
         if not url:
             try:
-                url = WebhookURL(channelid=channel_id)
+                url = WebhookURL(channelid=channel_id, guildid=guild_id)
                 session.add(url)
                 session.commit()
             except IntegrityError:
@@ -52,6 +112,14 @@ def delete_game(game: int):
             delete(TurnNotification)
             .where(TurnNotification.gameid == game)
         )
+        session.execute(
+            delete(TurnSummary)
+            .where(TurnSummary.gameid == game)
+        )
+        session.execute(
+            delete(TurnStats)
+            .where(TurnStats.gameid == game)
+        )
         session.execute(
             delete(PlayerGames)
             .where(PlayerGames.gameid == game)
@@ -82,7 +150,10 @@ def date_rank_subquery(channel_id: int = None) -> Subquery:
             TurnNotification.gameid,
             TurnNotification.slug,
             TurnNotification.logtime,
-            TurnNotification.lastnotified
+            TurnNotification.lastnotified,
+            TurnNotification.attempts,
+            TurnNotification.nextattempt,
+            TurnNotification.deadlettered
         )
         .select_from(TurnNotification)
     )
@@ -92,3 +163,99 @@ def date_rank_subquery(channel_id: int = None) -> Subquery:
             .where(WebhookURL.channelid == channel_id)
         )
     return subquery.subquery()
+
+
+def _purge_slugs(session: Session, slugs: List[str]):
+    '''
+    Cascade deletes the data for the given slugs.
+
+    The caller is expected to commit the session.
+    '''
+    if not slugs:
+        return
+    games = select(Game.id).where(Game.slug.in_(slugs))
+    for model in (TurnSummary, TurnStats):
+        session.execute(delete(model).where(model.gameid.in_(games)))
+    for model in (PlayerGames, TurnNotification, Player, Game, WebhookURL):
+        session.execute(delete(model).where(model.slug.in_(slugs)))
+
+
+def purge_channel(channel: int):
+    '''
+    Cascade deletes the data for a channel.
+    '''
+    with get_session() as session:
+        _purge_slugs(
+            session,
+            session.scalars(
+                select(WebhookURL.slug)
+                .where(WebhookURL.channelid == channel)
+            ).all()
+        )
+        session.commit()
+
+
+def purge_guild(guild: int, channels: Iterable[int] = ()) -> int:
+    '''
+    Cascade deletes the data for every channel in a guild. Returns the number
+    of webhook URLs removed.
+
+    URLs that don't know their guild yet are matched against the given
+    channels instead.
+    '''
+    with get_session() as session:
+        slugs = session.scalars(
+            select(WebhookURL.slug)
+            .where(
+                or_(
+                    WebhookURL.guildid == guild,
+                    and_(
+                        WebhookURL.guildid == None,
+                        WebhookURL.channelid.in_(list(channels))
+                    )
+                )
+            )
+        ).all()
+        _purge_slugs(session, slugs)
+        session.commit()
+    return len(slugs)
+
+
+def set_guild_for_channels(guild: int, channels: Iterable[int]):
+    '''
+    Records the guild against any of the given channels' URLs that are missing
+    it.
+    '''
+    with get_session() as session:
+        session.execute(
+            update(WebhookURL)
+            .where(WebhookURL.guildid == None)
+            .where(WebhookURL.channelid.in_(list(channels)))
+            .values(guildid=guild)
+        )
+        session.commit()
+
+
+def purge_channels(channels: Iterable[int]) -> int:
+    '''
+    Cascade deletes the data for several channels at once. Returns the number
+    of webhook URLs removed.
+    '''
+    with get_session() as session:
+        slugs = session.scalars(
+            select(WebhookURL.slug)
+            .where(WebhookURL.channelid.in_(list(channels)))
+        ).all()
+        _purge_slugs(session, slugs)
+        session.commit()
+    return len(slugs)
+
+
+def get_tracked_channels() -> List[Tuple[int, int]]:
+    '''
+    Gets the channel and guild IDs of every webhook URL.
+    '''
+    with get_session() as session:
+        return session.execute(
+            select(WebhookURL.channelid, WebhookURL.guildid)
+        ).tuples().all()
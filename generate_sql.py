@@ -8,13 +8,18 @@ used.
 from os import path, remove
 from sqlalchemy.schema import CreateTable
 from database.connect import get_db
+from database.partitions import get_partitioned_ddl, partitioning_enabled
 from database.models import (
     WebhookURL,
     Game,
     Player,
     PlayerGames,
-    TurnNotification
+    TurnNotification,
+    TurnSummary,
+    TurnStats,
+    RateLimit
 )
+from utils import config
 
 engine = get_db()
 destination = path.join(
@@ -28,7 +33,23 @@ if path.isfile(destination):
     remove(destination)
 
 for idx, model in enumerate(
-    [WebhookURL, Game, Player, PlayerGames, TurnNotification]
+    [
+        WebhookURL,
+        Game,
+        Player,
+        PlayerGames,
+        TurnNotification,
+        TurnSummary,
+        TurnStats,
+        RateLimit
+    ]
 ):
     with open(destination, mode='a', encoding='utf-8') as sqlfile:
+        if model is TurnNotification and partitioning_enabled(engine):
+            for statement in get_partitioned_ddl(
+                engine.dialect,
+                config.TURN_PARTITION_PREMAKE
+            ):
+                sqlfile.write(statement + ';')
+            continue
         sqlfile.write(str(CreateTable(model.__table__).compile(engine)) + ';')
@@ -0,0 +1,282 @@
+'''
+A utility script that simulates Civilization 6 clients sending turn
+notifications to the API, for capacity planning.
+
+Each simulated game runs in its own thread, sending a notification for each
+player in turn, with the configured cadence, burstiness, duplicate rate and
+invalid slug noise. Latency percentiles and error rates are reported at the
+end.
+
+By default, requests go through Flask's test client in this process, with
+rate limits disabled unless they're configured explicitly; pass --url to send
+them to a running API instead (and bear in mind its rate limits). Games are
+either seeded directly in the database with --seed, or given as existing
+webhook URL slugs and game names with --target.
+'''
+
+import os
+from argparse import ArgumentParser, Namespace
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps
+from random import Random
+from secrets import token_hex
+from statistics import quantiles
+from threading import Lock
+from time import perf_counter, sleep
+from typing import Callable, Dict, List, Tuple
+from urllib.request import Request, urlopen
+
+# Seeded URLs use channel IDs from here up, so they're easy to find again.
+SEED_CHANNEL_BASE = 1000000000000000000
+
+
+def get_arguments() -> Namespace:
+    '''
+    Parses the command line.
+    '''
+    parser = ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument(
+        '--url',
+        help='Base URL of a running API; e.g., http://localhost:3002'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        metavar='GAMES',
+        help='Create this many webhook URLs and games in the database'
+    )
+    parser.add_argument(
+        '--target',
+        action='append',
+        default=[],
+        metavar='SLUG:GAME',
+        help='An existing webhook URL slug and game name to send to'
+    )
+    parser.add_argument(
+        '--cleanup',
+        action='store_true',
+        help='Delete seeded webhook URLs and games when finished'
+    )
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--turns', type=int, default=20)
+    parser.add_argument(
+        '--cadence',
+        type=float,
+        default=0.1,
+        help='Mean seconds between notifications in a game'
+    )
+    parser.add_argument(
+        '--burstiness',
+        type=float,
+        default=0.2,
+        help='Chance that a notification follows the last with no wait'
+    )
+    parser.add_argument(
+        '--duplicates',
+        type=float,
+        default=0.05,
+        help='Chance that a notification is sent again, as a retry would be'
+    )
+    parser.add_argument(
+        '--noise',
+        type=float,
+        default=0.1,
+        help='Chance of also sending a notification to a made up slug'
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=8,
+        help='How many games to run at once'
+    )
+    parser.add_argument('--random-seed', type=int, default=None)
+    return parser.parse_args()
+
+
+def get_sender(url: str) -> Callable[[str, bytes], int]:
+    '''
+    Gets a function that POSTs a body to a slug, returning the status code.
+    '''
+    if url:
+        def send(slug: str, body: bytes) -> int:
+            request = Request(
+                f'{url.rstrip("/")}/civ6/{slug}',
+                data=body,
+                headers={'Content-Type': 'application/json'}
+            )
+            with urlopen(request, timeout=30) as response:
+                return response.status
+        return send
+
+    # pylint: disable=import-outside-toplevel
+    from civviebot_api import create_app
+    app = create_app()
+
+    def send(slug: str, body: bytes) -> int:
+        # Test clients keep state between requests, so each call gets one.
+        return app.test_client().post(
+            f'/civ6/{slug}',
+            data=body,
+            content_type='application/json'
+        ).status_code
+    return send
+
+
+def seed(count: int) -> List[Tuple[str, str]]:
+    '''
+    Creates webhook URLs with one game each, returning their slugs and names.
+    '''
+    # pylint: disable=import-outside-toplevel
+    from database.connect import get_session
+    from database.models import Game, WebhookURL
+    targets = []
+    with get_session() as session:
+        for index in range(count):
+            # generate_slug() can repeat itself when called this quickly.
+            url = WebhookURL(
+                slug=token_hex(8),
+                channelid=SEED_CHANNEL_BASE + index
+            )
+            session.add(url)
+            session.add(Game(name=f'Load test {index}', slug=url.slug))
+            targets.append((url.slug, f'Load test {index}'))
+        session.commit()
+    return targets
+
+
+def cleanup(count: int):
+    '''
+    Deletes seeded webhook URLs and everything tracked by them.
+    '''
+    # pylint: disable=import-outside-toplevel
+    from database.utils import purge_channels
+    purge_channels(range(SEED_CHANNEL_BASE, SEED_CHANNEL_BASE + count))
+
+
+class Results:
+    '''
+    Latencies and failures, by kind of request.
+    '''
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self._lock = Lock()
+
+    def record(self, kind: str, send: Callable[[], int]):
+        '''
+        Sends a request, recording how long it took and whether it failed.
+        '''
+        start = perf_counter()
+        try:
+            failed = send() != 200
+        except OSError:
+            failed = True
+        elapsed = perf_counter() - start
+        with self._lock:
+            self.latencies[kind].append(elapsed)
+            if failed:
+                self.errors[kind] += 1
+
+    def report(self, duration: float):
+        '''
+        Prints a summary of the results.
+        '''
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        print(f'{total} requests in {duration:.2f}s '
+              f'({total / duration:.1f}/s)')
+        for kind, latencies in sorted(self.latencies.items()):
+            if len(latencies) > 1:
+                cuts = quantiles(latencies, n=100, method='inclusive')
+                p50, p90, p99 = cuts[49], cuts[89], cuts[98]
+            else:
+                p50 = p90 = p99 = latencies[0]
+            print(
+                f'{kind}: {len(latencies)} requests, '
+                f'p50 {p50 * 1000:.2f}ms, p90 {p90 * 1000:.2f}ms, '
+                f'p99 {p99 * 1000:.2f}ms, max {max(latencies) * 1000:.2f}ms, '
+                f'{self.errors[kind] / len(latencies):.1%} errors'
+            )
+
+
+def play(
+    slug: str,
+    game: str,
+    arguments: Namespace,
+    send: Callable[[str, bytes], int],
+    results: Results,
+    random: Random
+):
+    '''
+    Plays through a game, sending each player's turn notification in order.
+    '''
+    for turn in range(1, arguments.turns + 1):
+        for player in range(arguments.players):
+            if random.random() >= arguments.burstiness:
+                sleep(random.expovariate(1 / arguments.cadence))
+            body = dumps({
+                'value1': game,
+                'value2': f'Player {player}',
+                'value3': turn
+            }).encode()
+            results.record('turn', lambda body=body: send(slug, body))
+            if random.random() < arguments.duplicates:
+                results.record(
+                    'duplicate',
+                    lambda body=body: send(slug, body)
+                )
+            if random.random() < arguments.noise:
+                results.record(
+                    'noise',
+                    lambda body=body: send(token_hex(8), body)
+                )
+
+
+def main():
+    '''
+    Runs the simulation.
+    '''
+    arguments = get_arguments()
+    if not arguments.url:
+        for limit in (
+            'API_IP_RATE_LIMIT',
+            'API_SLUG_RATE_LIMIT',
+            'NEW_PLAYER_LIMIT'
+        ):
+            os.environ.setdefault(limit, '0')
+    targets = [
+        tuple(target.split(':', maxsplit=1)) for target in arguments.target
+    ]
+    if arguments.seed:
+        targets += seed(arguments.seed)
+    if not targets:
+        raise SystemExit('Nothing to send to; use --seed or --target')
+    send = get_sender(arguments.url)
+    results = Results()
+    random = Random(arguments.random_seed)
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=arguments.concurrency) as executor:
+        games = [
+            executor.submit(
+                play,
+                slug,
+                game,
+                arguments,
+                send,
+                results,
+                Random(random.random())
+            )
+            for slug, game in targets
+        ]
+        for game in games:
+            # Raise anything that went wrong in a game's thread.
+            game.result()
+    results.report(perf_counter() - start)
+    if arguments.seed and arguments.cleanup:
+        cleanup(arguments.seed)
+
+
+if __name__ == '__main__':
+    main()
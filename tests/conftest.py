@@ -0,0 +1,61 @@
+'''
+Fixtures shared by the tests.
+'''
+
+from os import devnull, environ
+import pytest
+from api.ratelimit import get_backend
+from bot.delivery import get_delivery
+from bot.harness import FakeDiscord
+from bot.scheduler import get_scheduler
+from database.connect import get_db
+from database.utils import emit_all
+from utils import config
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    '''
+    Points CivvieBot at a scratch SQLite database with the schema emitted.
+    '''
+    monkeypatch.setenv('DOTENV_PATH', devnull)
+    for name in list(environ):
+        if name.startswith('CIVVIEBOT_DB_'):
+            monkeypatch.delenv(name)
+    monkeypatch.setenv('CIVVIEBOT_DB_DIALECT', 'sqlite')
+    monkeypatch.setenv('CIVVIEBOT_DB_DRIVER', 'pysqlite')
+    monkeypatch.setenv(
+        'CIVVIEBOT_DB_URL_DATABASE',
+        str(tmp_path / 'civviebot.db')
+    )
+    monkeypatch.setenv('TURN_PARTITIONING', 'false')
+    config.get_settings.cache_clear()
+    get_db.cache_clear()
+    get_backend.cache_clear()
+    emit_all()
+    yield get_db()
+    get_db().dispose()
+    get_db.cache_clear()
+    get_backend.cache_clear()
+    config.get_settings.cache_clear()
+
+
+@pytest.fixture
+def discord(database):
+    '''
+    Logs CivvieBot in to a fake Discord, with its notification and cleanup
+    loops left to be run by hand.
+    '''
+    del database
+    # The bot is only imported once the environment points at the scratch
+    # database, as it reads some settings when it's built.
+    from bot.civviebot import civviebot
+    get_delivery.cache_clear()
+    get_scheduler.cache_clear()
+    for loop in (
+        civviebot.get_cog('Notify').notify_turns,
+        civviebot.get_cog('Cleanup').run_cleanup
+    ):
+        loop.cancel()
+    yield FakeDiscord(civviebot)
+    get_delivery.cache_clear()
@@ -0,0 +1,135 @@
+'''
+Tests for recording incoming turn notifications.
+'''
+
+from json import dumps
+import pytest
+from sqlalchemy import func, select
+from api.ingest import (
+    MAX_NAME_LENGTH,
+    ingest_notification,
+    is_valid_slug,
+    parse_notification
+)
+from database.connect import get_session
+from database.models import Game, TurnNotification, WebhookURL
+from database.partitions import get_partitioned_table
+
+SLUG = '0123456789abcdef'
+
+
+def make_body(**values) -> bytes:
+    '''
+    Makes a turn notification body, with valid values unless given others;
+    values given as None are left out.
+    '''
+    body = {'value1': 'Game', 'value2': 'Player', 'value3': 12}
+    body.update(values)
+    return dumps({
+        key: value for key, value in body.items() if value is not None
+    }).encode()
+
+
+@pytest.mark.parametrize('slug, valid', [
+    (SLUG, True),
+    ('0123456789ABCDEF', False),
+    ('0123456789abcde', False),
+    ('0123456789abcdef0', False),
+    ('0123456789abcdeg', False),
+    ('', False)
+])
+def test_is_valid_slug(slug, valid):
+    '''
+    Only 16 lowercase hex characters could be a slug.
+    '''
+    assert is_valid_slug(slug) is valid
+
+
+def test_parse_notification():
+    '''
+    A valid body is parsed into the game name, player name and turn, and any
+    other keys are ignored.
+    '''
+    assert parse_notification(make_body(value4='ignored')) == (
+        'Game',
+        'Player',
+        12
+    )
+
+
+@pytest.mark.parametrize('body', [
+    b'',
+    b'{"value1": "Game"',
+    b'\xff\xfe',
+    b'{} {}',
+    dumps(['Game', 'Player', 12]).encode(),
+    b'[' * 100000 + b']' * 100000,
+    make_body(value1=None),
+    make_body(value1=''),
+    make_body(value1=12),
+    make_body(value1='G' * (MAX_NAME_LENGTH + 1)),
+    make_body(value2=None),
+    make_body(value2=''),
+    make_body(value2=['Player']),
+    make_body(value2='P' * (MAX_NAME_LENGTH + 1)),
+    make_body(value3=None),
+    make_body(value3='12'),
+    make_body(value3=12.5),
+    make_body(value3=True),
+    make_body(value3=0),
+    make_body(value3=-1)
+])
+def test_parse_invalid_notification(body):
+    '''
+    Malformed JSON, and missing, oversized or mistyped values, are rejected.
+    '''
+    with pytest.raises(ValueError):
+        parse_notification(body)
+
+
+def test_invalid_notification_is_ignored(database):
+    '''
+    An invalid notification isn't recorded, even for a tracked game.
+    '''
+    with get_session() as session:
+        session.add_all([
+            WebhookURL(slug=SLUG, channelid=1),
+            Game(name='Game', slug=SLUG)
+        ])
+        session.commit()
+
+    body = make_body(value3='12')
+    assert ingest_notification(SLUG, body, '127.0.0.1') is None
+
+    with get_session() as session:
+        assert not session.scalar(
+            select(func.count()).select_from(TurnNotification)
+        )
+
+
+@pytest.mark.parametrize('partitioned', [False, True])
+def test_repeated_turn_is_ignored(database, partitioned):
+    '''
+    A turn Civ 6 sends more than once is only recorded once, including when
+    turn_notification is partitioned and its primary key includes logtime.
+    '''
+    if partitioned:
+        # SQLite can't partition, but the partitioned table's primary key is
+        # what matters here.
+        TurnNotification.__table__.drop(database)
+        get_partitioned_table().create(database)
+    with get_session() as session:
+        session.add_all([
+            WebhookURL(slug=SLUG, channelid=1),
+            Game(name='Game', slug=SLUG)
+        ])
+        session.commit()
+    body = dumps({'value1': 'Game', 'value2': 'Player', 'value3': 12}).encode()
+
+    assert ingest_notification(SLUG, body, '127.0.0.1') is not None
+    assert ingest_notification(SLUG, body, '127.0.0.1') is None
+
+    with get_session() as session:
+        assert session.scalar(
+            select(func.count()).select_from(TurnNotification)
+        ) == 1
@@ -0,0 +1,193 @@
+'''
+Tests that the bot loads what it needs in a bounded number of SQL statements.
+
+Relationships are lazy='raise_on_sql', so a missed eager load fails outright;
+a query run once per game instead of once in all (an N+1) is caught by giving
+each step a budget of statements that doesn't grow with the number of games
+beyond what each game's own writes need.
+'''
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from secrets import token_hex
+from typing import Iterator, List
+import pytest
+from sqlalchemy import Engine, event, func, select
+from bot.harness import FakeDiscord
+from database.connect import get_session
+from database.models import (
+    Game,
+    Player,
+    PlayerGames,
+    TurnNotification,
+    WebhookURL
+)
+from utils import config
+
+
+GAMES = 10
+# How many SQL statements each step may run, for each message sent or stale
+# game cleaned up, and in all; and how many a command may run.
+STATEMENTS_PER_MESSAGE = 3
+STATEMENTS_PER_STALE_GAME = 5
+STATEMENTS_PER_STEP = 10
+STATEMENTS_PER_COMMAND = 3
+
+
+@contextmanager
+def counting(engine: Engine) -> Iterator[List[str]]:
+    '''
+    Collects the SQL statements run on the given engine.
+    '''
+    statements = []
+
+    def count_statement(connection, cursor, statement, *args):
+        del connection, cursor, args
+        statements.append(statement)
+    event.listen(engine, 'after_cursor_execute', count_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'after_cursor_execute', count_statement)
+
+
+def seed(
+    channels: List[int],
+    guild_id: int,
+    user: dict,
+    logtime: datetime,
+    games: int = 1
+):
+    '''
+    Seeds the given number of games in each of the given channels, with a
+    player linked to the given user, who's up with a turn logged at the given
+    time.
+    '''
+    with get_session() as session:
+        for channel_id in channels:
+            url = WebhookURL(
+                slug=token_hex(8),
+                channelid=channel_id,
+                guildid=guild_id
+            )
+            player = Player(
+                name='Player',
+                slug=url.slug,
+                discordid=user['id']
+            )
+            session.add_all([url, player])
+            for index in range(games):
+                game = Game(name=f'Game {index}', slug=url.slug)
+                session.add(game)
+                session.flush()
+                session.add_all([
+                    PlayerGames(
+                        gameid=game.id,
+                        playerid=player.id,
+                        slug=url.slug
+                    ),
+                    TurnNotification(
+                        turn=game.minturns + 1,
+                        playerid=player.id,
+                        gameid=game.id,
+                        slug=url.slug,
+                        logtime=logtime
+                    )
+                ])
+        session.commit()
+
+
+def get_responses(discord: FakeDiscord) -> List[dict]:
+    '''
+    Gets the data the bot responded to interactions with.
+    '''
+    return [
+        call.payload['data']
+        for call in discord.get_calls(
+            'POST',
+            r'/interactions/\d+/[^/]+/callback'
+        )
+    ]
+
+
+def test_notify_round(discord, database):
+    '''
+    A round of notifications sends every due turn in a bounded number of
+    statements.
+    '''
+    user = discord.make_user('Player')
+    guild = discord.add_guild(GAMES, [user])
+    seed(
+        [channel.id for channel in guild.channels],
+        guild.id,
+        user,
+        datetime.now() - timedelta(seconds=config.NOTIFY_DEBOUNCE + 1)
+    )
+    notify = discord.bot.get_cog('Notify')
+
+    with counting(database) as statements:
+        discord.bot.loop.run_until_complete(notify.send_round())
+
+    assert len(discord.get_calls('POST', r'/channels/\d+/messages')) == GAMES
+    assert len(statements) <= (
+        GAMES * STATEMENTS_PER_MESSAGE + STATEMENTS_PER_STEP
+    )
+
+
+def test_cleanup(discord, database):
+    '''
+    Cleaning up stale games removes each in a bounded number of statements.
+    '''
+    user = discord.make_user('Player')
+    guild = discord.add_guild(GAMES, [user])
+    seed(
+        [channel.id for channel in guild.channels],
+        guild.id,
+        user,
+        datetime.now() - timedelta(seconds=config.STALE_GAME_LENGTH + 60)
+    )
+    cleanup = discord.bot.get_cog('Cleanup')
+
+    with counting(database) as statements:
+        discord.bot.loop.run_until_complete(cleanup.cleanup(discord.bot))
+
+    with get_session() as session:
+        assert not session.scalar(select(func.count()).select_from(Game))
+    assert len(statements) <= (
+        GAMES * STATEMENTS_PER_STALE_GAME + STATEMENTS_PER_STEP
+    )
+
+
+@pytest.mark.parametrize('command', [
+    'game info',
+    'game players',
+    'game stats',
+    'player games',
+    'player upin'
+])
+def test_command(discord, database, command):
+    '''
+    Each command responds without an error in a bounded number of
+    statements, however many games there are in the channel.
+    '''
+    user = discord.make_user('Player')
+    guild = discord.add_guild(1, [user])
+    channel_id = guild.channels[0].id
+    seed([channel_id], guild.id, user, datetime.now(), GAMES)
+    if command.startswith('game'):
+        options = {'game': 'Game 0'}
+    else:
+        options = {'user': user}
+
+    with counting(database) as statements:
+        discord.bot.loop.run_until_complete(discord.invoke(
+            config.COMMAND_PREFIX + command,
+            channel_id,
+            user,
+            **options
+        ))
+
+    responses = get_responses(discord)
+    assert len(responses) == 1
+    assert not (responses[0].get('content') or '').startswith('Sorry')
+    assert len(statements) <= STATEMENTS_PER_COMMAND
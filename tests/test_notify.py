@@ -0,0 +1,175 @@
+'''
+Tests for sending turn notifications.
+'''
+
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from bot.delivery import get_delivery
+from database.connect import get_session
+from database.models import (
+    Game,
+    Player,
+    PlayerGames,
+    TurnNotification,
+    WebhookURL
+)
+from utils import config
+
+SLUG = '0123456789abcdef'
+
+
+def seed(channel_id: int, players: int = 1) -> int:
+    '''
+    Seeds a game with the given number of players in the given channel.
+    Returns the game's ID.
+    '''
+    with get_session() as session:
+        game = Game(name='Game', slug=SLUG)
+        session.add_all([WebhookURL(slug=SLUG, channelid=channel_id), game])
+        session.flush()
+        for index in range(players):
+            player = Player(name=f'Player {index}', slug=SLUG)
+            session.add(player)
+            session.flush()
+            session.add(
+                PlayerGames(gameid=game.id, playerid=player.id, slug=SLUG)
+            )
+        session.commit()
+        return game.id
+
+
+def add_turn(game_id: int, player: int, turn: int, logtime: datetime):
+    '''
+    Logs a turn notification for the player with the given index.
+    '''
+    with get_session() as session:
+        session.add(TurnNotification(
+            turn=turn,
+            playerid=session.scalar(
+                select(Player.id).where(Player.name == f'Player {player}')
+            ),
+            gameid=game_id,
+            slug=SLUG,
+            logtime=logtime
+        ))
+        session.commit()
+
+
+def get_turns(game_id: int) -> dict:
+    '''
+    Gets a game's turn notifications, by turn.
+    '''
+    with get_session() as session:
+        return {
+            turn.turn: turn
+            for turn in session.scalars(
+                select(TurnNotification)
+                .where(TurnNotification.gameid == game_id)
+            )
+        }
+
+
+def test_debounced_turns(discord):
+    '''
+    Of two turns logged within NOTIFY_DEBOUNCE of each other, only the newer
+    is sent, once it's been the newest for NOTIFY_DEBOUNCE, and the older is
+    marked as skipped.
+    '''
+    channel_id = discord.add_guild(1).channels[0].id
+    game_id = seed(channel_id, players=2)
+    now = datetime.now()
+    add_turn(game_id, 0, 11, now - timedelta(seconds=2))
+    add_turn(game_id, 1, 12, now - timedelta(seconds=1))
+    notify = discord.bot.get_cog('Notify')
+    sent = discord.messages
+
+    discord.bot.loop.run_until_complete(notify.send_round())
+    assert not sent
+    assert all(turn.skipped is None for turn in get_turns(game_id).values())
+
+    # Both turns are a debounce window older.
+    with get_session() as session:
+        for turn in session.scalars(select(TurnNotification)):
+            turn.logtime -= timedelta(seconds=config.NOTIFY_DEBOUNCE)
+        session.commit()
+    discord.bot.loop.run_until_complete(notify.send_round())
+
+    turns = get_turns(game_id)
+    assert turns[11].skipped is not None
+    assert turns[11].lastnotified is None
+    assert turns[12].skipped is None
+    assert turns[12].lastnotified is not None
+    assert len(sent) == 1
+    assert 'Player 1' in next(iter(sent.values()))['content']
+
+
+def test_failed_turn_is_retried_then_dead_lettered(discord):
+    '''
+    A turn that fails to send is retried after NOTIFY_RETRY_DELAY, doubling
+    with each failure, and given up on after NOTIFY_MAX_ATTEMPTS.
+    '''
+    settings = config.get_settings()
+    settings.NOTIFY_MAX_ATTEMPTS = 3
+    # The channel's breaker is left closed, so each round tries it.
+    settings.NOTIFY_BREAKER_THRESHOLD = settings.NOTIFY_MAX_ATTEMPTS + 1
+    channel_id = discord.add_guild(1).channels[0].id
+    game_id = seed(channel_id)
+    add_turn(
+        game_id,
+        0,
+        11,
+        datetime.now() - timedelta(seconds=config.NOTIFY_DEBOUNCE + 1)
+    )
+    # Sends to the channel fail with a 404.
+    discord.remove_channel(channel_id)
+    notify = discord.bot.get_cog('Notify')
+
+    for attempt in range(1, settings.NOTIFY_MAX_ATTEMPTS + 1):
+        before = datetime.now()
+        discord.bot.loop.run_until_complete(notify.send_round())
+        turn = get_turns(game_id)[11]
+        assert turn.attempts == attempt
+        assert turn.lastnotified is None
+        assert turn.nextattempt >= before + timedelta(
+            seconds=config.NOTIFY_RETRY_DELAY * 2 ** (attempt - 1)
+        )
+        if attempt == settings.NOTIFY_MAX_ATTEMPTS:
+            assert turn.deadlettered is not None
+            break
+        assert turn.deadlettered is None
+        # Nothing's tried again until the retry is due.
+        discord.bot.loop.run_until_complete(notify.send_round())
+        assert get_turns(game_id)[11].attempts == attempt
+        with get_session() as session:
+            for turn in session.scalars(select(TurnNotification)):
+                turn.nextattempt = datetime.now()
+            session.commit()
+
+    tried = len(discord.calls)
+    discord.bot.loop.run_until_complete(notify.send_round())
+    assert len(discord.calls) == tried
+
+
+def test_duplicate_warning_waits_for_breaker(discord):
+    '''
+    A duplicate warning for a channel whose breaker opened earlier in the
+    round isn't sent, and is left to a later round.
+    '''
+    channel_id = discord.add_guild(1).channels[0].id
+    game_id = seed(channel_id)
+    with get_session() as session:
+        session.get(Game, game_id).duplicatewarned = False
+        session.commit()
+        game = session.execute(
+            select(Game.id, Game.name, WebhookURL.channelid)
+            .join(Game.webhookurl)
+        ).one()
+    delivery = get_delivery(discord.bot)
+    for _ in range(config.NOTIFY_BREAKER_THRESHOLD):
+        delivery.record_failure(channel_id)
+    notify = discord.bot.get_cog('Notify')
+
+    assert not discord.bot.loop.run_until_complete(notify.send_duplicate(game))
+    assert not discord.calls
+    with get_session() as session:
+        assert session.get(Game, game_id).duplicatewarned is False
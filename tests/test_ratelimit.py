@@ -0,0 +1,111 @@
+'''
+Tests for rate limiting turn notifications.
+'''
+
+from json import dumps
+import pytest
+from sqlalchemy import func, select
+from api import ratelimit
+from api.ingest import ingest_notification
+from api.ratelimit import DatabaseBackend, MemoryBackend, allow
+from database.connect import get_session
+from database.models import Game, Player, WebhookURL
+from utils import config
+
+SLUG = '0123456789abcdef'
+# A bucket of three tokens, refilling one every 20 seconds.
+CAPACITY = 3
+PERIOD = 60
+NOW = 1000000.0
+
+
+@pytest.fixture(params=['memory', 'database'])
+def backend(request, database):
+    '''
+    Gets each backend, keeping its buckets in the scratch database if it
+    keeps them in one.
+    '''
+    if request.param == 'database':
+        return DatabaseBackend(database)
+    return MemoryBackend()
+
+
+def test_exhaustion(backend):
+    '''
+    A bucket allows as many takes as its capacity, then no more.
+    '''
+    assert [
+        backend.take('key', CAPACITY, PERIOD, NOW)
+        for _ in range(CAPACITY + 1)
+    ] == [True] * CAPACITY + [False]
+    # Other keys have their own buckets.
+    assert backend.take('other', CAPACITY, PERIOD, NOW)
+
+
+def test_refill(backend):
+    '''
+    An empty bucket refills at capacity tokens per period, up to its
+    capacity.
+    '''
+    for _ in range(CAPACITY):
+        backend.take('key', CAPACITY, PERIOD, NOW)
+
+    assert not backend.take('key', CAPACITY, PERIOD, NOW + 10)
+    assert backend.take('key', CAPACITY, PERIOD, NOW + 20)
+    assert not backend.take('key', CAPACITY, PERIOD, NOW + 20)
+
+    later = NOW + PERIOD * 10
+    assert [
+        backend.take('key', CAPACITY, PERIOD, later)
+        for _ in range(CAPACITY + 1)
+    ] == [True] * CAPACITY + [False]
+
+
+def test_disabled(database, monkeypatch):
+    '''
+    A capacity of 0 or less allows everything without taking from a bucket.
+    '''
+    del database
+
+    def get_backend():
+        raise AssertionError('A disabled limit used the backend')
+    monkeypatch.setattr(ratelimit, 'get_backend', get_backend)
+
+    assert all(allow('key', 0, PERIOD) for _ in range(CAPACITY + 1))
+    assert all(allow('key', -1, PERIOD) for _ in range(CAPACITY + 1))
+
+
+def test_new_player_limit(database, monkeypatch):
+    '''
+    Only NEW_PLAYER_LIMIT new players an hour are tracked in a game, while
+    players already tracked carry on.
+    '''
+    del database
+    monkeypatch.setattr(ratelimit, 'time', lambda: NOW)
+    config.get_settings().NEW_PLAYER_LIMIT = 2
+    with get_session() as session:
+        session.add_all([
+            WebhookURL(slug=SLUG, channelid=1),
+            Game(name='Game', slug=SLUG)
+        ])
+        session.commit()
+
+    def send(player: str, turn: int) -> bool:
+        body = {'value1': 'Game', 'value2': player, 'value3': turn}
+        return ingest_notification(
+            SLUG,
+            dumps(body).encode(),
+            '127.0.0.1'
+        ) is not None
+
+    assert send('Player 1', 1)
+    assert send('Player 2', 2)
+    assert not send('Player 3', 3)
+    assert send('Player 1', 4)
+    monkeypatch.setattr(ratelimit, 'time', lambda: NOW + 1800)
+    assert send('Player 3', 5)
+
+    with get_session() as session:
+        assert session.scalar(
+            select(func.count()).select_from(Player)
+        ) == 3
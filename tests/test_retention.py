@@ -0,0 +1,66 @@
+'''
+Tests for compacting turn notifications into turn summaries.
+'''
+
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from database.connect import get_session
+from database.models import (
+    Game,
+    Player,
+    TurnNotification,
+    TurnSummary,
+    WebhookURL
+)
+from database.retention import compact_turns
+
+SLUG = '0123456789abcdef'
+
+
+def add_turn(game: int, player: int, turn: int, logtime: datetime):
+    '''
+    Logs a turn notification.
+    '''
+    with get_session() as session:
+        session.add(TurnNotification(
+            turn=turn,
+            playerid=player,
+            gameid=game,
+            slug=SLUG,
+            logtime=logtime
+        ))
+        session.commit()
+
+
+def test_compacting_a_repeated_turn(database):
+    '''
+    A turn Civ 6 sends again after it was compacted is compacted again
+    without a second summary.
+    '''
+    del database
+    with get_session() as session:
+        game = Game(name='Game', slug=SLUG)
+        player = Player(name='Player', slug=SLUG)
+        session.add_all([WebhookURL(slug=SLUG, channelid=1), game, player])
+        session.commit()
+        game_id, player_id = game.id, player.id
+    start = datetime.now() - timedelta(days=10)
+    add_turn(game_id, player_id, 1, start)
+    add_turn(game_id, player_id, 2, start + timedelta(days=1))
+    assert compact_turns(datetime.now(), 100) == 1
+
+    # Turn 1 comes in again, then the game moves on.
+    add_turn(game_id, player_id, 1, start + timedelta(days=2))
+    add_turn(game_id, player_id, 3, start + timedelta(days=3))
+    assert compact_turns(datetime.now(), 100) == 2
+
+    with get_session() as session:
+        summaries = session.execute(
+            select(TurnSummary.turn, TurnSummary.logtime)
+            .order_by(TurnSummary.turn)
+        ).all()
+        remaining = session.scalar(
+            select(func.count()).select_from(TurnNotification)
+        )
+    assert summaries == [(1, start), (2, start + timedelta(days=1))]
+    assert remaining == 1
@@ -0,0 +1,86 @@
+'''
+Tests for scheduling the notifications sent each round.
+'''
+
+import asyncio
+from typing import List
+from bot.scheduler import (
+    Job,
+    NotificationQueue,
+    NotificationScheduler,
+    Priority
+)
+
+
+def make_job(
+    sent: List[str],
+    priority: Priority,
+    channel_id: int,
+    name: str,
+    done: bool = True
+) -> Job:
+    '''
+    Makes a job that records its name as sent, and returns whether it's done
+    with.
+    '''
+    async def send() -> bool:
+        sent.append(name)
+        return done
+    return Job(priority, channel_id, name, send)
+
+
+def test_channels_take_turns():
+    '''
+    Jobs are taken in priority order, and within a priority, one from each
+    channel in turn, so a channel with a backlog doesn't crowd out the rest.
+    '''
+    sent = []
+    queue = NotificationQueue()
+    for name in ('A1', 'A2', 'A3', 'A4'):
+        queue.put(make_job(sent, Priority.TURN, 1, name))
+    queue.put(make_job(sent, Priority.REMINDER, 2, 'B reminder'))
+    queue.put(make_job(sent, Priority.TURN, 2, 'B1'))
+    queue.put(make_job(sent, Priority.TURN, 3, 'C1'))
+    queue.put(make_job(sent, Priority.TURN, 3, 'C2'))
+    queue.put(make_job(sent, Priority.DUPLICATE, 1, 'A duplicate'))
+
+    assert asyncio.run(NotificationScheduler().run(queue, 6)) == 6
+
+    assert sent == ['A1', 'B1', 'C1', 'A2', 'C2', 'A3']
+
+
+def test_deferred_jobs_are_counted():
+    '''
+    Jobs past the round's limit are left for a later round.
+    '''
+    sent = []
+    queue = NotificationQueue()
+    for name in ('A1', 'A2', 'A3'):
+        queue.put(make_job(sent, Priority.TURN, 1, name))
+    scheduler = NotificationScheduler()
+
+    assert asyncio.run(scheduler.run(queue, 1)) == 1
+
+    metrics = scheduler.get_metrics()['turn']
+    assert metrics['sent'] == 1
+    assert metrics['deferred'] == 2
+
+
+def test_dropped_jobs_are_forgotten():
+    '''
+    A job that isn't done with is remembered while it's queued again, and
+    forgotten once it isn't.
+    '''
+    # pylint: disable=protected-access
+    sent = []
+    scheduler = NotificationScheduler()
+    for _ in range(2):
+        queue = NotificationQueue()
+        queue.put(make_job(sent, Priority.DUPLICATE, 1, 'retried', False))
+        queue.put(make_job(sent, Priority.DUPLICATE, 1, 'later', False))
+        asyncio.run(scheduler.run(queue, 1))
+        assert scheduler._first_queued.keys() == {'retried', 'later'}
+
+    asyncio.run(scheduler.run(NotificationQueue(), 1))
+
+    assert not scheduler._first_queued
@@ -0,0 +1,147 @@
+'''
+Tests for turn time statistics.
+'''
+
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from database.connect import get_session
+from database.models import Game, Player, TurnStats, WebhookURL
+from database.stats import (
+    BUCKET_COUNT,
+    BUCKET_GROWTH,
+    estimate_quantile,
+    get_bucket,
+    get_bucket_estimate,
+    record_turn_duration
+)
+
+SLUG = '0123456789abcdef'
+
+
+def seed() -> tuple:
+    '''
+    Seeds a game with a player. Returns their IDs.
+    '''
+    with get_session() as session:
+        game = Game(name='Game', slug=SLUG)
+        player = Player(name='Player', slug=SLUG)
+        session.add_all([WebhookURL(slug=SLUG, channelid=1), game, player])
+        session.commit()
+        return game.id, player.id
+
+
+@pytest.mark.parametrize('seconds, bucket', [
+    (0, 0),
+    (0.5, 0),
+    (1, 1),
+    (BUCKET_GROWTH, 2),
+    (60, 12),
+    (3600, 24),
+    (86400 * 365, BUCKET_COUNT - 1)
+])
+def test_get_bucket(seconds, bucket):
+    '''
+    Durations go in log-scale buckets, with everything under a second in the
+    first and everything too long in the last.
+    '''
+    assert get_bucket(seconds) == bucket
+
+
+@pytest.mark.parametrize('seconds', [1, 2, 45, 60, 3600, 86400, 86400 * 7])
+def test_bucket_estimate(seconds):
+    '''
+    A bucket's estimate is within a fifth of any duration in it.
+    '''
+    estimate = get_bucket_estimate(get_bucket(seconds))
+    assert estimate == pytest.approx(seconds, rel=0.2)
+
+
+def test_estimate_quantile():
+    '''
+    Quantiles are estimated from the bucket the quantile falls in.
+    '''
+    histogram = [0] * BUCKET_COUNT
+    for seconds in [60] * 5 + [600] * 4 + [86400]:
+        histogram[get_bucket(seconds)] += 1
+
+    assert estimate_quantile(histogram, 0.5) == pytest.approx(60, rel=0.2)
+    assert estimate_quantile(histogram, 0.9) == pytest.approx(600, rel=0.2)
+    assert estimate_quantile(histogram, 1) == pytest.approx(86400, rel=0.2)
+    assert estimate_quantile([0] * BUCKET_COUNT, 0.5) == 0
+
+
+def test_record_turn_duration(database):
+    '''
+    Recording turns keeps the count, mean, median and 90th percentile up to
+    date.
+    '''
+    del database
+    game_id, player_id = seed()
+    now = datetime.now()
+    with get_session() as session:
+        for minutes in [1, 1, 1, 10, 60]:
+            record_turn_duration(
+                session,
+                game_id,
+                player_id,
+                timedelta(minutes=minutes),
+                now
+            )
+        session.commit()
+
+    with get_session() as session:
+        stats = session.get(TurnStats, (game_id, player_id))
+        assert stats.turns == 5
+        assert stats.meanduration == pytest.approx(876)
+        assert stats.medianduration == pytest.approx(60, rel=0.2)
+        assert stats.p90duration == pytest.approx(3600, rel=0.2)
+        assert sum(stats.histogram) == 5
+        assert stats.lastseen == now
+
+
+def test_recording_races_another_process(database, monkeypatch):
+    '''
+    If another process makes a player's statistics between this one finding
+    none and making them, this one's turn is added to theirs rather than
+    failing.
+    '''
+    del database
+    game_id, player_id = seed()
+    now = datetime.now()
+    get = Session.get
+
+    def get_after_another(self, *args, **kwargs):
+        monkeypatch.setattr(Session, 'get', get)
+        with get_session() as other:
+            record_turn_duration(
+                other,
+                game_id,
+                player_id,
+                timedelta(minutes=1),
+                now
+            )
+            other.commit()
+        return None
+    monkeypatch.setattr(Session, 'get', get_after_another)
+
+    with get_session() as session:
+        # The rest of the caller's work is kept.
+        session.add(Player(name='Other player', slug=SLUG))
+        record_turn_duration(
+            session,
+            game_id,
+            player_id,
+            timedelta(minutes=10),
+            now
+        )
+        session.commit()
+
+    with get_session() as session:
+        stats = session.get(TurnStats, (game_id, player_id))
+        assert stats.turns == 2
+        assert stats.meanduration == pytest.approx(330)
+        assert session.scalar(
+            select(Player.id).where(Player.name == 'Other player')
+        )
@@ -1,12 +1,19 @@
 '''
 Loads and works with configs potentially passed in from the environment.
+
+Configuration is read from the environment (and the dotenv, if any) the first
+time a setting is accessed, rather than at import. Settings can be accessed as
+attributes of this module (e.g., config.COMMAND_PREFIX) or of get_settings().
 '''
 
 import logging
 import logging.config as logging_config
+from functools import lru_cache
 from os import environ, access, R_OK
+from typing import Mapping
 from dotenv import load_dotenv
 from yaml import load, SafeLoader
+from utils.logs import queue_handlers
 
 logger = logging.getLogger(f'civviebot.{__name__}')
 
@@ -18,47 +25,255 @@ def add_dotenv():
     load_dotenv(environ.get('DOTENV_PATH', None))
 
 
-add_dotenv()
-
-
-DISCORD_CLIENT_ID = environ.get('DISCORD_CLIENT_ID', None)
-if not DISCORD_CLIENT_ID:
-    raise ValueError('DISCORD_CLIENT_ID cannot be None')
-COMMAND_PREFIX = environ.get('COMMAND_PREFIX', 'c6')
-MIN_TURNS = int(environ.get('MIN_TURNS', 10))
-NOTIFY_INTERVAL = int(environ.get('NOTIFY_INTERVAL', 5))
-REMIND_INTERVAL = int(environ.get('REMIND_INTERVAL', 604800))
-STALE_GAME_LENGTH = int(environ.get('STALE_GAME_LENGTH', 2592000))
-NOTIFY_LIMIT = int(environ.get('NOTIFY_LIMIT', 100))
-CLEANUP_INTERVAL = int(environ.get('CLEANUP_INTERVAL', 86400))
-CLEANUP_LIMIT = int(environ.get('CLEANUP_LIMIT', 1000))
-USE_FULL_NAMES = bool(environ.get('USE_FULL_NAMES', False))
-_DEBUG_GUILD = environ.get('DEBUG_GUILD', None)
-DEBUG_GUILDS = [int(_DEBUG_GUILD)] if _DEBUG_GUILD else []
-CIVVIEBOT_HOST = environ.get('CIVVIEBOT_HOST', 'localhost')
-LOGGING_CONFIG = environ.get('LOGGING_CONFIG', 'logging.yml')
-CIVVIEBOT_DB_DIALECT = environ.get('CIVVIEBOT_DB_DIALECT', 'postgresql')
-CIVVIEBOT_DB_DRIVER = environ.get('CIVVIEBOT_DB_DRIVER', 'pg8000')
-DB_URL_KWARGS = {
-    key[17:].lower(): environ.get(key)
-    for key in environ
-    if key[:17] == 'CIVVIEBOT_DB_URL_'
-}
-# Stash a copy of the endpoint.
-_FULL_HOST = (CIVVIEBOT_HOST[:-1]
-              if CIVVIEBOT_HOST[-1] == '/'
-              else CIVVIEBOT_HOST)
-if CIVVIEBOT_HOST[0:7] != 'http://' and CIVVIEBOT_HOST[0:8] != 'https://':
-    _FULL_HOST = 'http://' + CIVVIEBOT_HOST
-API_ENDPOINT = _FULL_HOST + '/civ6/'
+def _get_int(env: Mapping[str, str], name: str, default: int) -> int:
+    '''
+    Gets an integer setting from the environment.
+    '''
+    try:
+        return int(env.get(name, default))
+    except ValueError as error:
+        raise ValueError(f'{name} must be an integer') from error
+
+
+def _get_float(env: Mapping[str, str], name: str, default: float) -> float:
+    '''
+    Gets a number setting from the environment.
+    '''
+    try:
+        return float(env.get(name, default))
+    except ValueError as error:
+        raise ValueError(f'{name} must be a number') from error
+
+
+def _get_bool(env: Mapping[str, str], name: str, default: bool) -> bool:
+    '''
+    Gets a boolean setting from the environment.
+    '''
+    if name not in env:
+        return default
+    return env[name].lower() in ('1', 'true', 'yes')
+
+
+class Settings:
+    '''
+    CivvieBot's configuration, validated as it's read from the environment.
+
+    Settings only some parts of CivvieBot need (like DISCORD_TOKEN) are
+    validated when they're accessed instead.
+    '''
+    # pylint: disable=invalid-name,too-many-instance-attributes
+
+    def __init__(self, env: Mapping[str, str]):
+        '''
+        Constructor; reads every setting from the given environment.
+        '''
+        self._discord_client_id = env.get('DISCORD_CLIENT_ID', None)
+        self._discord_token = env.get('DISCORD_TOKEN', None)
+        self.COMMAND_PREFIX = env.get('COMMAND_PREFIX', 'c6')
+        self.MIN_TURNS = _get_int(env, 'MIN_TURNS', 10)
+        self.NOTIFY_INTERVAL = _get_int(env, 'NOTIFY_INTERVAL', 5)
+        self.NOTIFY_DEBOUNCE = _get_int(env, 'NOTIFY_DEBOUNCE', 10)
+        self.NOTIFY_MAX_ATTEMPTS = _get_int(env, 'NOTIFY_MAX_ATTEMPTS', 5)
+        self.NOTIFY_RETRY_DELAY = _get_int(env, 'NOTIFY_RETRY_DELAY', 30)
+        self.NOTIFY_BREAKER_THRESHOLD = _get_int(
+            env,
+            'NOTIFY_BREAKER_THRESHOLD',
+            3
+        )
+        self.NOTIFY_BREAKER_COOLDOWN = _get_int(
+            env,
+            'NOTIFY_BREAKER_COOLDOWN',
+            300
+        )
+        self.NOTIFY_VIA_WEBHOOKS = _get_bool(
+            env,
+            'NOTIFY_VIA_WEBHOOKS',
+            False
+        )
+        self.NOTIFY_WORKER = _get_bool(env, 'NOTIFY_WORKER', False)
+        self.NOTIFY_WORKER_COUNT = _get_int(env, 'NOTIFY_WORKER_COUNT', 1)
+        self.NOTIFY_WORKER_INDEX = _get_int(env, 'NOTIFY_WORKER_INDEX', 0)
+        if not 0 <= self.NOTIFY_WORKER_INDEX < self.NOTIFY_WORKER_COUNT:
+            raise ValueError(
+                'NOTIFY_WORKER_INDEX must be from 0 to NOTIFY_WORKER_COUNT - 1'
+            )
+        self.REMIND_INTERVAL = _get_int(env, 'REMIND_INTERVAL', 604800)
+        self.STALE_GAME_LENGTH = _get_int(env, 'STALE_GAME_LENGTH', 2592000)
+        self.NOTIFY_LIMIT = _get_int(env, 'NOTIFY_LIMIT', 100)
+        self.CLEANUP_INTERVAL = _get_int(env, 'CLEANUP_INTERVAL', 86400)
+        self.CLEANUP_LIMIT = _get_int(env, 'CLEANUP_LIMIT', 1000)
+        self.RECONCILE_INTERVAL = _get_float(env, 'RECONCILE_INTERVAL', 1)
+        self.RECONCILE_LIMIT = _get_int(env, 'RECONCILE_LIMIT', 50)
+        self.TURN_RETENTION_LENGTH = _get_int(
+            env,
+            'TURN_RETENTION_LENGTH',
+            604800
+        )
+        self.TURN_RETENTION_LIMIT = _get_int(
+            env,
+            'TURN_RETENTION_LIMIT',
+            1000
+        )
+        self.TURN_ARCHIVE_PATH = env.get('TURN_ARCHIVE_PATH', None)
+        self.TURN_PARTITIONING = _get_bool(env, 'TURN_PARTITIONING', False)
+        self.TURN_PARTITION_PREMAKE = _get_int(
+            env,
+            'TURN_PARTITION_PREMAKE',
+            3
+        )
+        self.USE_FULL_NAMES = _get_bool(env, 'USE_FULL_NAMES', False)
+        self.LOOP_MONITOR = _get_bool(env, 'LOOP_MONITOR', False)
+        self.LOOP_STALL_THRESHOLD = _get_int(env, 'LOOP_STALL_THRESHOLD', 250)
+        self.SQL_PROFILER = _get_bool(env, 'SQL_PROFILER', False)
+        self.SQL_PROFILER_TOP = _get_int(env, 'SQL_PROFILER_TOP', 10)
+        self.SQLITE_BUSY_TIMEOUT = _get_int(env, 'SQLITE_BUSY_TIMEOUT', 5000)
+        self.SQLITE_SYNCHRONOUS = env.get(
+            'SQLITE_SYNCHRONOUS',
+            'NORMAL'
+        ).upper()
+        if self.SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+            raise ValueError(
+                'SQLITE_SYNCHRONOUS must be one of OFF, NORMAL, FULL or EXTRA'
+            )
+        self.SQLITE_MMAP_SIZE = _get_int(env, 'SQLITE_MMAP_SIZE', 268435456)
+        self.SQLITE_CACHE_SIZE = _get_int(env, 'SQLITE_CACHE_SIZE', 16384)
+        self.LOG_DEBUG_SAMPLE_RATE = _get_float(
+            env,
+            'LOG_DEBUG_SAMPLE_RATE',
+            1
+        )
+        self.DEBUG_GUILDS = (
+            [_get_int(env, 'DEBUG_GUILD', 0)]
+            if env.get('DEBUG_GUILD', None)
+            else []
+        )
+        self.CIVVIEBOT_HOST = env.get('CIVVIEBOT_HOST', 'localhost')
+        self.API_MAX_CONTENT_LENGTH = _get_int(
+            env,
+            'API_MAX_CONTENT_LENGTH',
+            4096
+        )
+        self.API_IP_RATE_LIMIT = _get_int(env, 'API_IP_RATE_LIMIT', 60)
+        self.API_SLUG_RATE_LIMIT = _get_int(env, 'API_SLUG_RATE_LIMIT', 30)
+        self.API_RATE_LIMIT_BACKEND = env.get(
+            'API_RATE_LIMIT_BACKEND',
+            'memory'
+        )
+        self.API_RATE_LIMIT_FILE = env.get(
+            'API_RATE_LIMIT_FILE',
+            'ratelimit.db'
+        )
+        self.API_TRUSTED_PROXIES = _get_int(env, 'API_TRUSTED_PROXIES', 0)
+        self.WEBHOOK_LISTENER = _get_bool(env, 'WEBHOOK_LISTENER', False)
+        self.WEBHOOK_LISTENER_HOST = env.get(
+            'WEBHOOK_LISTENER_HOST',
+            '0.0.0.0'
+        )
+        self.WEBHOOK_LISTENER_PORT = _get_int(
+            env,
+            'WEBHOOK_LISTENER_PORT',
+            3002
+        )
+        self.NEW_PLAYER_LIMIT = _get_int(env, 'NEW_PLAYER_LIMIT', 12)
+        self.LOGGING_CONFIG = env.get('LOGGING_CONFIG', 'logging.yml')
+        self.PAGE_CACHE_MAX_AGE = _get_int(env, 'PAGE_CACHE_MAX_AGE', 3600)
+        self.CIVVIEBOT_DB_DIALECT = env.get(
+            'CIVVIEBOT_DB_DIALECT',
+            'postgresql'
+        )
+        self.CIVVIEBOT_DB_DRIVER = env.get('CIVVIEBOT_DB_DRIVER', 'pg8000')
+        self.DB_URL_KWARGS = {
+            key[17:].lower(): env.get(key)
+            for key in env
+            if key[:17] == 'CIVVIEBOT_DB_URL_'
+        }
+        self.DB_REPLICA_URL_KWARGS = {
+            key[25:].lower(): env.get(key)
+            for key in env
+            if key[:25] == 'CIVVIEBOT_DB_REPLICA_URL_'
+        }
+        self.CIVVIEBOT_DB_REPLICA_MAX_LAG = _get_float(
+            env,
+            'CIVVIEBOT_DB_REPLICA_MAX_LAG',
+            5
+        )
+        self.CIVVIEBOT_DB_REPLICA_CHECK_INTERVAL = _get_float(
+            env,
+            'CIVVIEBOT_DB_REPLICA_CHECK_INTERVAL',
+            10
+        )
+        self.CIVVIEBOT_DB_REPLICA_CONNECT_TIMEOUT = _get_int(
+            env,
+            'CIVVIEBOT_DB_REPLICA_CONNECT_TIMEOUT',
+            2
+        )
+        # Stash a copy of the endpoint.
+        full_host = (self.CIVVIEBOT_HOST[:-1]
+                     if self.CIVVIEBOT_HOST[-1] == '/'
+                     else self.CIVVIEBOT_HOST)
+        if (
+            self.CIVVIEBOT_HOST[0:7] != 'http://'
+            and self.CIVVIEBOT_HOST[0:8] != 'https://'
+        ):
+            full_host = 'http://' + self.CIVVIEBOT_HOST
+        self.API_ENDPOINT = full_host + '/civ6/'
+
+    @property
+    def DISCORD_CLIENT_ID(self) -> str:
+        '''
+        The client ID of the Discord application; required by the API.
+        '''
+        if not self._discord_client_id:
+            raise ValueError('DISCORD_CLIENT_ID cannot be None')
+        return self._discord_client_id
+
+    @property
+    def DISCORD_TOKEN(self) -> str:
+        '''
+        The token of the Discord bot user; required by the bot.
+        '''
+        if not self._discord_token:
+            raise ValueError('DISCORD_TOKEN cannot be None')
+        return self._discord_token
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    '''
+    Gets the settings, reading them from the environment the first time.
+    '''
+    add_dotenv()
+    return Settings(environ)
+
+
+def __getattr__(name: str):
+    '''
+    Passes access to settings through to get_settings().
+    '''
+    if name.isupper():
+        return getattr(get_settings(), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def initialize_logging():
     '''
     Standardized logging initialization.
+
+    Handlers from the config are moved behind queues (see utils.logs), so
+    this must be called after any fork; in each gunicorn worker, for example,
+    rather than before gunicorn preloads the app.
     '''
-    if not access(LOGGING_CONFIG, R_OK):
-        raise PermissionError(f'Cannot read config from {LOGGING_CONFIG}')
-    with open(LOGGING_CONFIG, encoding='utf-8') as log_config:
+    logging_path = get_settings().LOGGING_CONFIG
+    if not access(logging_path, R_OK):
+        raise PermissionError(f'Cannot read config from {logging_path}')
+    with open(logging_path, encoding='utf-8') as log_config:
         log_config = load(log_config, Loader=SafeLoader)
     logging_config.dictConfig(log_config)
+    root = logging.getLogger()
+    queue_handlers(
+        [root] + [
+            named for named in root.manager.loggerDict.values()
+            if isinstance(named, logging.Logger)
+        ],
+        get_settings().LOG_DEBUG_SAMPLE_RATE
+    )
@@ -0,0 +1,131 @@
+'''
+Structured logging that stays off the request path and the event loop.
+
+Once logging is configured, every handler is moved behind a QueueHandler;
+logging a record then only puts it on a queue, and a QueueListener thread
+formats and writes it. Formatting is deferred to the listener as well, so a
+record's arguments are only turned into strings if it's actually written.
+
+Records pick up the fields of the context they were logged from (the
+interaction a command was invoked with, or the request the API is handling),
+which JsonFormatter writes out alongside any structured extras.
+'''
+
+import atexit
+import json
+import logging
+from contextvars import ContextVar, Token
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from random import random
+from types import MappingProxyType
+from typing import Iterable, List, Mapping
+
+
+# Fields added to every record logged from the current context.
+log_context: ContextVar[Mapping] = ContextVar(
+    'log_context',
+    default=MappingProxyType({})
+)
+
+# Attributes every LogRecord has; anything else on a record is an extra.
+RECORD_ATTRIBUTES = frozenset(
+    vars(logging.LogRecord('', 0, '', 0, '', (), None))
+) | {'message', 'asctime', 'context', 'taskName'}
+
+
+def set_log_context(**fields) -> Token:
+    '''
+    Sets the fields added to records logged from the current context from
+    here on. Returns a token that can be used to reset them.
+    '''
+    return log_context.set(MappingProxyType(fields))
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    Formats records as a single line of JSON each.
+    '''
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(
+                record.created,
+                timezone.utc
+            ).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'location': (
+                f'{record.filename}:{record.lineno}:{record.funcName}'
+            ),
+            'message': record.getMessage(),
+            **getattr(record, 'context', {})
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class DebugSampler(logging.Filter):
+    '''
+    Lets through the given fraction of DEBUG records, and every record above
+    DEBUG.
+    '''
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random() < self.rate
+
+
+class ContextQueueHandler(QueueHandler):
+    '''
+    Puts records on a queue along with the current log context.
+
+    Unlike QueueHandler, this leaves formatting to the listener; the queue
+    never leaves the process, so records don't need to be made picklable.
+    '''
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if not hasattr(record, 'context'):
+            record.context = log_context.get()
+        return record
+
+
+def queue_handlers(
+    loggers: Iterable[logging.Logger],
+    debug_sample_rate: float = 1.0
+) -> List[QueueListener]:
+    '''
+    Moves the handlers of the given loggers behind queues, starting a
+    listener for each distinct set of handlers. Listeners are stopped, and
+    their queues flushed, at exit.
+    '''
+    queues = {}
+    for logger in loggers:
+        if not logger.handlers:
+            continue
+        handlers = tuple(logger.handlers)
+        if handlers not in queues:
+            queue = SimpleQueue()
+            handler = ContextQueueHandler(queue)
+            if debug_sample_rate < 1:
+                handler.addFilter(DebugSampler(debug_sample_rate))
+            queues[handlers] = (
+                handler,
+                QueueListener(queue, *handlers, respect_handler_level=True)
+            )
+        logger.handlers = [queues[handlers][0]]
+    listeners = [listener for _, listener in queues.values()]
+    for listener in listeners:
+        listener.start()
+        atexit.register(listener.stop)
+    return listeners